@@ -0,0 +1,125 @@
+#import modules
+import os.path as osp
+import io
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import utils as ut
+import ledger
+import profiling
+
+
+def run_case(job):
+    '''
+    Runs the preprocessing of a single geometry, used as the work unit of run_batch. Every case gets its own scratch
+    directory inside the temporary directory so cases running at the same time never share intermediate files.
+    Unexpected errors are caught and reported in the log directory, so one broken case can't stop the batch.
+    :arg1 job: dict with the arguments of pipeline.preprocess_case and a 'capture' bool. When capture is True all
+               printed output of the case is collected and returned instead of printed
+
+    returns dict with the case name, status, number of retries, runtime in seconds and the log text (if captured)
+    '''
+    #Import inside the worker, so the main process only needs the heavy meshing modules when running serially
+    import pipeline
+
+    start = time.time()
+    case_name = job['case_name']
+    log_dir = job['log_dir']
+    scratch_dir = osp.join(job['temp_dir'], case_name)
+
+    buffer = io.StringIO()
+    redirect = contextlib.redirect_stdout(buffer) if job['capture'] else contextlib.nullcontext()
+    with redirect:
+        try:
+            result = pipeline.preprocess_case(case_name, job['output_name'], job['input_dir'], job['vel_profile_dir'],
+                                              job['output_dir'], scratch_dir, log_dir, job['file_dir'], job['settings'],
+                                              job['stages'])
+        except Exception as e:
+            print('an error has occured:')
+            print(e)
+            ut.save_string_to_file('an unknown error has occured. Check if directories and input are set up correctly', osp.join(log_dir, r'failed', f'unknown_error_{case_name}'))
+            result = dict(case=case_name, output=job['output_name'], status='error', retries=None, runtime=None, profile=None)
+
+    result['walltime'] = time.time() - start
+    result['log'] = buffer.getvalue()
+    return result
+
+def run_batch(input_dir, input_list, vel_profile_dir, output_dir, temp_dir, log_dir, file_dir, settings, n_workers=1, resume=True, stages=('mesh', 'map', 'feb')):
+    '''
+    Preprocesses a list of geometries. With n_workers = 1 the cases run one after another in the current process
+    (plots are shown if enabled in the settings). With n_workers > 1 the cases are divided over a pool of worker
+    processes, plotting is disabled and the printed output of every case is written to log_dir/log_<case>.txt.
+    If settings contains a 'ledger_path', cases that are done according to the run ledger with the same settings are
+    skipped (resume).
+    The timing profiles of the cases that ran are combined in log_dir/profile_summary.json.
+    :arg1 input_dir: path to the directory containing the geometry folders
+    :arg2 input_list: list of geometry folder names to process
+    :arg3 vel_profile_dir: path to the directory containing the velocity profiles
+    :arg4 output_dir: path to the output directory
+    :arg5 temp_dir: path to the temporary directory, a subdirectory is created for every case
+    :arg6 log_dir: path to the log directory
+    :arg7 file_dir: path to the directory of the workflow (location of template_xml.feb)
+    :arg8 settings: dict with the parameters of the Setup part of main_workflow
+    :opt arg9 n_workers: number of cases that are processed at the same time, default is 1
+    :opt arg10 resume: bool, skip cases that are done with the same settings according to the run ledger, default is True
+    :opt arg11 stages: parts of the workflow to run, see pipeline.preprocess_case, default is all parts
+
+    returns list of result dicts (see run_case), in the order of input_list, skipped cases have the status 'skipped'
+    '''
+    #Create a job for every geometry, output folder names are based on the position in the input list
+    parallel = n_workers > 1
+    if parallel:
+        settings = dict(settings, show_plot=False)
+    jobs = [dict(case_name=name, output_name=f'0{i}_Result_{name}', input_dir=input_dir, vel_profile_dir=vel_profile_dir,
+                 output_dir=output_dir, temp_dir=temp_dir, log_dir=log_dir, file_dir=file_dir, settings=settings,
+                 stages=stages, capture=parallel) for i, name in enumerate(input_list)]
+
+    results = [None] * len(jobs)
+
+    #Skip the cases that finished in an earlier (possibly interrupted) run with the same settings and inputs, cases that
+    #finished with other settings or of which e.g. the geometry or the mesh changed run again (unchanged stages come from the cache)
+    if resume and settings.get('ledger_path'):
+        con = ledger.connect(settings['ledger_path'])
+        hashes = {job['case_name']: ledger.case_hash(settings, stages, ledger.case_inputs(
+                      osp.join(input_dir, job['case_name']), osp.join(output_dir, job['output_name']), vel_profile_dir,
+                      stages)) for job in jobs}
+        finished = ledger.finished_cases(con, hashes)
+        changed = [name for name in ledger.finished_cases(con) if name in input_list and name not in finished]
+        con.close()
+        if changed:
+            print(f'{len(changed)} geometries were done with other settings or inputs, they run again')
+        for i, job in enumerate(jobs):
+            if job['case_name'] in finished:
+                results[i] = dict(case=job['case_name'], output=job['output_name'], status='skipped', retries=None,
+                                  runtime=finished[job['case_name']], profile=None, walltime=0, log='')
+        if finished:
+            print(f'{sum(r is not None for r in results)} geometries already done according to the run ledger, skipped')
+
+    #Without the mesh part, only cases that were meshed in an earlier run can be processed
+    if 'mesh' not in stages:
+        for i, job in enumerate(jobs):
+            if results[i] is None and not osp.isdir(osp.join(output_dir, job['output_name'], r'mesh')):
+                results[i] = dict(case=job['case_name'], output=job['output_name'], status='skipped', retries=None,
+                                  runtime=None, profile=None, walltime=0, log='')
+    todo = [i for i in range(len(jobs)) if results[i] is None]
+
+    if not parallel:
+        for i in todo:
+            results[i] = run_case(jobs[i])
+    else:
+        print(f'Start batch of {len(todo)} geometries on {n_workers} workers')
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(run_case, jobs[i]): i for i in todo}
+            for future in as_completed(futures):
+                i = futures[future]
+                result = future.result()
+                results[i] = result
+
+                #Store the output of the case and report progress
+                ut.save_string_to_file(result['log'], osp.join(log_dir, f'log_{result["case"]}.txt'))
+                n_finished = sum(r is not None for r in results)
+                print(f'[{n_finished}/{len(jobs)}] {result["case"]}: {result["status"]} ({result["walltime"]:.1f} s)')
+
+    #Combine the timing profiles, to see which stages dominate the batch
+    profiling.write_summary([results[i]['profile'] for i in todo], osp.join(log_dir, r'profile_summary.json'))
+    return results
@@ -0,0 +1,143 @@
+#import modules
+import os
+import os.path as osp
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+import pyvista as pv
+
+"""
+Persistent cache for the intermediate results of the meshing workflow. Every stage result is stored in its own
+directory (an entry) inside the cache directory. The name of the entry is a hash of everything the stage depends on:
+the key of the stage before it (or the bytes of the input files) plus the parameters of the stage itself. A change
+in a parameter therefore only invalidates the stage that uses it and the stages after it.
+
+Supported items in an entry are pyvista meshes (saved as .vtk), numpy arrays (.npy) and json compatible values.
+"""
+
+def hash_files(paths):
+    '''
+    Hashes the content of a list of files
+    :arg1 paths: list of file paths, the order matters
+
+    returns hex string
+    '''
+    sha = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(2**20), b''):
+                sha.update(block)
+    return sha.hexdigest()
+
+def stage_key(stage, parent_key, parameters=None):
+    '''
+    Creates the cache key of a workflow stage
+    :arg1 stage: str, name of the stage
+    :arg2 parent_key: key of the previous stage or hash of the input files
+    :opt arg3 parameters: json compatible object (usually a parameter dict) the stage depends on
+
+    returns hex string
+    '''
+    text = json.dumps(dict(stage=stage, parent=parent_key, parameters=parameters), sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def load(cache_dir, key, mmap_mode=None):
+    '''
+    Loads a cache entry
+    :arg1 cache_dir: path to the cache directory, if None the cache is disabled and None is returned
+    :arg2 key: key of the entry
+    :opt arg3 mmap_mode: memory-map the numpy arrays instead of reading them (e.g. 'r', see np.load), default is None
+
+    returns dict with the stored items, or None if the entry does not exist
+    '''
+    if cache_dir is None:
+        return None
+    entry = osp.join(cache_dir, key)
+    if not osp.isdir(entry):
+        return None
+
+    with open(osp.join(entry, r'values.json')) as file:
+        items = json.load(file)
+    for filename in os.listdir(entry):
+        name, ext = osp.splitext(filename)
+        if ext == '.vtk':
+            items[name] = pv.read(osp.join(entry, filename))
+        elif ext == '.npy':
+            items[name] = np.load(osp.join(entry, filename), mmap_mode=mmap_mode)
+
+    #Mark entry as recently used (used for eviction)
+    os.utime(entry)
+    return items
+
+def store(cache_dir, key, items):
+    '''
+    Stores items in a cache entry. The entry is written to a temporary directory first and then renamed, so
+    processes that share the cache never see a half written entry.
+    :arg1 cache_dir: path to the cache directory, if None nothing is stored
+    :arg2 key: key of the entry
+    :arg3 items: dict with pyvista meshes, numpy arrays or json compatible values
+    '''
+    if cache_dir is None:
+        return
+    entry = osp.join(cache_dir, key)
+    if osp.isdir(entry):
+        return
+
+    temp_entry = f'{entry}.tmp{os.getpid()}'
+    os.makedirs(temp_entry, exist_ok=True)
+    values = {}
+    for name, item in items.items():
+        if isinstance(item, pv.DataSet):
+            item.save(osp.join(temp_entry, f'{name}.vtk'))
+        elif isinstance(item, np.ndarray):
+            np.save(osp.join(temp_entry, f'{name}.npy'), item)
+        else:
+            values[name] = item
+    with open(osp.join(temp_entry, r'values.json'), 'w') as file:
+        json.dump(values, file)
+
+    try:
+        os.rename(temp_entry, entry)
+    except OSError:
+        #Another process stored the same entry in the meantime
+        shutil.rmtree(temp_entry, ignore_errors=True)
+
+def evict(cache_dir, max_size=None, max_age=None):
+    '''
+    Removes cache entries. First all entries that have not been used for max_age days are removed, then the least
+    recently used entries are removed until the cache is smaller than max_size.
+    :arg1 cache_dir: path to the cache directory
+    :opt arg2 max_size: maximum size of the cache in bytes, default is no limit
+    :opt arg3 max_age: maximum number of days since the last use of an entry, default is no limit
+
+    returns number of removed entries
+    '''
+    if cache_dir is None or not osp.isdir(cache_dir):
+        return 0
+
+    #Collect the last use and size of all entries
+    entries = []
+    for key in os.listdir(cache_dir):
+        entry = osp.join(cache_dir, key)
+        if not osp.isdir(entry):
+            continue
+        size = sum(osp.getsize(osp.join(entry, filename)) for filename in os.listdir(entry))
+        entries.append((osp.getmtime(entry), size, entry))
+    entries.sort()
+
+    removed = 0
+    total_size = sum(size for _, size, _ in entries)
+    for last_use, size, entry in entries:
+        too_old = max_age is not None and (time.time() - last_use) > max_age * 86400
+        too_large = max_size is not None and total_size > max_size
+        if not (too_old or too_large):
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= size
+        removed += 1
+
+    if removed:
+        print(f'Removed {removed} entries from the cache')
+    return removed
@@ -0,0 +1,165 @@
+#import modules
+import os.path as osp
+import numpy as np
+import medit
+import mmg_runner
+import profiling
+
+"""
+Calibration of the meshing parameters of a geometry to an element budget, before the full volume meshing (setting
+calibration, see main_workflow). Two cheap surrogates of the final mmg3d mesh are used:
+    volume  : the number of elements that the size map predicts, integrated over a coarse TetGen seed mesh of the
+              surface (sizing.predict_elements for a graded size map; for the two-value size map, which a coarse mesh
+              can not resolve, the boundary layer estimate of preflight.predict_elements)
+    surface : mmgs runs of the surface with the hausd candidates and the boundary layer edge length as maximum edge
+              length, the surface that mmg3d would make at the wall. They run at the same time (mmg_runner.run_many)
+The edge lengths of the size map (bl_edgelength and edgelength) are scaled by the same factor until the volume
+prediction is margin * target_elements (bisection on the scale). Only larger edge lengths are used, unless refine is
+set, then a geometry that is well within the budget gets a finer mesh as well. The hausd of mmg3d is the smallest
+candidate for which the surface surrogate has at most (1 + surface_excess) times the triangles of a wall meshed with
+bl_edgelength, so refinement at curvature does not take more than that share of the budget. If every mmgs run fails
+the hausd is left as it is.
+"""
+
+#Default calibration options (the setting calibration only needs to contain the changed ones)
+DEFAULTS = dict(target_elements=None, margin=0.9, refine=False, hausd_factors=(0.5, 1, 2, 4), surface_excess=0.25,
+                n_workers=None)
+
+#Number of equilateral triangles with unit edge length per unit area
+TRIANGLES_PER_AREA = 4 / np.sqrt(3)
+
+def predictor(seed, wall, sol_parameters):
+    '''
+    Prepares the volume surrogate of a geometry
+    :arg1 seed: pyvista UnstructuredGrid, coarse volume mesh of the geometry
+    :arg2 wall: pyvista surface of the wall
+    :arg3 sol_parameters: mmg3d_sol_parameters
+
+    returns function that predicts the number of elements of the size map with both edge lengths scaled by a factor
+    '''
+    import sizing
+    import preflight
+
+    if sol_parameters.get('gradation') is None:
+        volume = seed.volume
+        wall_area = wall.extract_surface().area
+        return lambda scale: preflight.predict_elements(volume, wall_area, scaled(sol_parameters, scale))
+
+    points = np.asarray(seed.points, dtype=float)
+    parameters = dict(sizing.DEFAULTS, **sol_parameters)
+    distance = sizing.wall_distance(points, wall)
+    radius = sizing.local_radius(points, distance, min_radius=parameters['bl_thickness']) if parameters['radius_cells'] else None
+    return lambda scale: sizing.predict_elements(seed, sizing.graded_size(distance, radius, scaled(parameters, scale)))
+
+def scaled(sol_parameters, scale):
+    '''
+    returns mmg3d_sol_parameters with bl_edgelength and edgelength multiplied by scale
+    '''
+    return dict(sol_parameters, bl_edgelength=sol_parameters['bl_edgelength'] * scale,
+                edgelength=sol_parameters['edgelength'] * scale)
+
+def fit_scale(predict, target, low=1/8, high=8, iterations=30):
+    '''
+    Finds the scale of the edge lengths at which predict(scale) is the target (bisection, the number of elements
+    decreases with the scale)
+
+    returns the scale, limited to [low, high]
+    '''
+    if predict(low) <= target:
+        return low
+    if predict(high) > target:
+        return high
+    for _ in range(iterations):
+        middle = (low * high)**0.5
+        if predict(middle) > target:
+            low = middle
+        else:
+            high = middle
+    return high
+
+def surface_triangles(surface, temp_dir, mmg3d_parameters, hausd_values, bl_edgelength, limits=None, n_workers=None):
+    '''
+    Surface surrogate: remeshes the surface with mmgs for every hausd value, with bl_edgelength as maximum edge length
+    :arg1 surface: pyvista PolyData of the closed surface (input of the volume meshing)
+    :arg2 temp_dir: path to directory used for temporary files
+    :arg3 mmg3d_parameters: mmg3d parameters (detection angle)
+    :arg4 hausd_values: list with the hausd values
+    :arg5 bl_edgelength: edge length at the wall
+    :opt arg6 limits: dict with the timeout (s) and memory (MB) of every mmgs run (see mmg_runner.py)
+    :opt arg7 n_workers: number of mmgs runs at the same time, default as mmg_runner.run_many
+
+    returns list with the number of triangles for every hausd value, None for runs that failed
+    '''
+    in_path = osp.join(temp_dir, r'calibration_surface.meshb')
+    medit.write_mesh(in_path, medit.from_pyvista(surface))
+
+    jobs = []
+    for k, hausd in enumerate(hausd_values):
+        options = ['-ar', mmg3d_parameters['detection angle'], '-hausd', f'{hausd:g}', '-hmax', f'{bl_edgelength:g}']
+        jobs.append(dict(program='mmgs', in_path=in_path, out_path=osp.join(temp_dir, f'calibration_surface_{k}.meshb'),
+                         options=options, **(limits or {})))
+    results = mmg_runner.run_many(jobs, n_workers)
+
+    triangles = []
+    for stats in results:
+        if isinstance(stats, mmg_runner.MmgError):
+            print('Calibration: surface remesh failed,', stats)
+            triangles.append(None)
+        else:
+            triangles.append(stats.get('triangles'))
+    return triangles
+
+def calibrate(surface, wall, temp_dir, sol_parameters, mmg3d_parameters, tetgen_parameters, options, max_elements, limits=None):
+    '''
+    Calibrates the size map and the hausd of mmg3d of a geometry to the element budget (see the top of this file)
+    :arg1 surface: pyvista PolyData of the remeshed closed surface (input of the volume meshing)
+    :arg2 wall: pyvista surface of the cut wall
+    :arg3 temp_dir: path to directory used for temporary files
+    :arg4 sol_parameters: mmg3d_sol_parameters
+    :arg5 mmg3d_parameters: mmg3d parameters
+    :arg6 tetgen_parameters: parameters of the initial volume mesh, the seed is meshed without a maximum volume
+    :arg7 options: calibration options (see DEFAULTS)
+    :arg8 max_elements: element budget if options has no target_elements
+    :opt arg9 limits: dict with the timeout (s) and memory (MB) of the mmgs runs (see mmg_runner.py)
+
+    returns the calibrated mmg3d_sol_parameters and mmg3d parameters, and dict with the calibration report
+    '''
+    import volume_mesh
+
+    options = dict(DEFAULTS, **options)
+    target = options['margin'] * (options['target_elements'] or max_elements)
+
+    with profiling.stage('calibration') as record:
+        #Volume surrogate, scale of the edge lengths that fits the budget
+        seed_parameters = volume_mesh.single_pass_parameters(tetgen_parameters, sol_parameters)[0]
+        seed = volume_mesh.tetgen(surface, seed_parameters)
+        predict = predictor(seed, wall, sol_parameters)
+        initial = predict(1.0)
+        scale = fit_scale(predict, target, low=1/8 if options['refine'] else 1)
+        sol_parameters = scaled(sol_parameters, scale)
+        predicted = predict(scale)
+
+        #Surface surrogate, smallest hausd of which the refinement at curvature stays within the surface_excess
+        hausd_values = [float(mmg3d_parameters['hausd']) * factor for factor in sorted(options['hausd_factors'])]
+        triangles = surface_triangles(surface, temp_dir, mmg3d_parameters, hausd_values, sol_parameters['bl_edgelength'],
+                                      limits, options['n_workers'])
+        uniform = TRIANGLES_PER_AREA * surface.area / sol_parameters['bl_edgelength']**2
+        limit = (1 + options['surface_excess']) * uniform
+        fitting = [hausd for hausd, n in zip(hausd_values, triangles) if n is not None and n <= limit]
+        if all(n is None for n in triangles):
+            print('Calibration: every surface remesh failed, hausd calibration skipped, the configured hausd is used')
+            hausd = float(mmg3d_parameters['hausd'])
+        elif fitting:
+            hausd = fitting[0]
+        else:
+            print('Calibration: no hausd candidate keeps the surface within the budget, the largest is used')
+            hausd = hausd_values[-1]
+        mmg3d_parameters = dict(mmg3d_parameters, hausd=f'{hausd:g}')
+
+        report = dict(target_elements=target, initial_prediction=initial, predicted_elements=predicted, scale=scale,
+                      hausd=hausd, surface_triangles=triangles, uniform_triangles=uniform, seed_cells=seed.n_cells)
+        record.update(report)
+
+    print(f'Calibration: edge lengths scaled by {scale:.3g}, hausd {hausd:g}, predicted elements {int(predicted)} '
+          f'(target {int(target)})')
+    return sol_parameters, mmg3d_parameters, report
@@ -4,8 +4,8 @@ import os.path as osp
 from glob import glob
 import numpy as np
 import pyvista as pv
-import tetgen as tet
 import utils as ut
+import profiling
 
 
 
@@ -18,23 +18,25 @@ def cap(wall, inlet_center, outlet_center, plot=False):
     :returns : (inlet, outlet)
     '''
     print('Start cap generation from cutted wall')
-    # Clear data arrays (somehow breaks the function if not done)
-    wall.clear_data()
-    
-    # Extract edges to cap
-    edges = wall.extract_feature_edges(boundary_edges=True, non_manifold_edges=False, manifold_edges=False, feature_edges=False)
-    
-    #Plot extracted edges
-    if plot==True:
-        edges.plot(color='red', text='Perimeters to cap')
-    
-    # Split edges into separate data
-    inlet_edges = edges.connectivity('closest', inlet_center)
-    outlet_edges = edges.connectivity('closest', outlet_center)
-
-    #Create a solid spiderweb-like surface mesh
-    inlet = ut.make_spiderweb(pv.UnstructuredGrid(inlet_edges))
-    outlet = ut.make_spiderweb(pv.UnstructuredGrid(outlet_edges))
+    with profiling.stage('capping') as record:
+        # Clear data arrays (somehow breaks the function if not done)
+        wall.clear_data()
+
+        # Extract edges to cap
+        edges = wall.extract_feature_edges(boundary_edges=True, non_manifold_edges=False, manifold_edges=False, feature_edges=False)
+
+        #Plot extracted edges
+        if plot==True:
+            edges.plot(color='red', text='Perimeters to cap')
+
+        # Split edges into separate data
+        inlet_edges = edges.connectivity('closest', inlet_center)
+        outlet_edges = edges.connectivity('closest', outlet_center)
+
+        #Create a solid spiderweb-like surface mesh
+        inlet = ut.make_spiderweb(pv.UnstructuredGrid(inlet_edges))
+        outlet = ut.make_spiderweb(pv.UnstructuredGrid(outlet_edges))
+        record['cells'] = inlet.n_cells + outlet.n_cells
 
     #Plot final result of capping function 
     if plot==True:
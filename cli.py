@@ -0,0 +1,113 @@
+#import modules
+import os
+import os.path as osp
+import argparse
+import config as cfg
+
+"""
+Command line interface of the workflow, an alternative to main_workflow that runs without dialogs or plots (e.g. on
+compute nodes without a display). All parameters are read from a configuration file, see config.py.
+
+    python cli.py init-config run.json     write a configuration file with the default parameters
+    python cli.py mesh run.json            cut, cap, mesh and identify every geometry in input_dir
+    python cli.py map run.json             map the velocity profiles on the meshed inlets
+    python cli.py write-feb run.json       write simulation.feb for every mapped case
+    python cli.py simulate run.json        run FEBio for every case in output_dir
+
+Every command only imports the workflow modules it needs, e.g. write-feb does not load the meshing tools.
+"""
+
+COMMAND_STAGES = {'mesh': ('mesh',), 'map': ('map',), 'write-feb': ('feb',)}
+
+def prepare(config, command):
+    '''
+    Creates the output, temporary, log and cache directories of a configuration
+
+    returns dict with the settings of pipeline.preprocess_case and the directories
+    '''
+    file_dir = osp.dirname(osp.realpath(__file__))
+    work_dir = config['work_dir'] if config['work_dir'] is not None else file_dir
+
+    dirs = dict(file_dir=file_dir, output_dir=config['output_dir'], temp_dir=osp.join(work_dir, r'temp'), log_dir=osp.join(work_dir, r'log'))
+    os.makedirs(dirs['output_dir'], exist_ok=True)
+    os.makedirs(dirs['temp_dir'], exist_ok=True)
+    os.makedirs(osp.join(dirs['log_dir'], r'failed'), exist_ok=True)
+
+    cache_dir = osp.join(work_dir, r'cache') if config['use_cache'] else None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    #Every command keeps its own ledger, so e.g. a finished mesh run does not mark the mapping as done. A case is only
+    #skipped when it is done with the same settings and the same results of the earlier commands (ledger.case_inputs),
+    #so e.g. write-feb writes every point of a sweep over FEBio_parameters
+    ledger_path = osp.join(dirs['log_dir'], f'ledger_{command}.sqlite') if config['use_ledger'] else None
+
+    keys = ['FEBio_parameters', 'mmg_parameters', 'mmg3d_parameters', 'mmg3d_sol_parameters', 'tetgen_parameters',
+            'volume_meshing', 'calibration', 'mmg_limits', 'intp_options', 'max_retry', 'max_elements', 'min_jacobian',
+            'max_aspect', 'preflight', 'cut_search', 'cut_proxy_error', 'id_angle', 'show_plot']
+    settings = {key: config[key] for key in keys}
+    settings.update(cache_dir=cache_dir, ledger_path=ledger_path)
+    return settings, dirs
+
+def run_preprocessing(config, command, n_workers=None):
+    '''
+    Runs the mesh, map or write-feb command for every geometry in the input directory
+    '''
+    import shutil
+    import batch
+    import cache
+
+    settings, dirs = prepare(config, command)
+    input_list = sorted(os.listdir(config['input_dir']))
+    n_workers = n_workers if n_workers is not None else config['n_workers']
+
+    results = batch.run_batch(config['input_dir'], input_list, config['vel_profile_dir'], dirs['output_dir'], dirs['temp_dir'],
+                              dirs['log_dir'], dirs['file_dir'], settings, n_workers, config['resume'], COMMAND_STAGES[command])
+
+    shutil.rmtree(dirs['temp_dir'], ignore_errors=True)
+    cache.evict(settings['cache_dir'], config['cache_max_size'], config['cache_max_age'])
+
+    failed = [result['case'] for result in results if result['status'] not in ['done', 'skipped']]
+    print(f'{command}: {len(results) - len(failed)} of {len(results)} geometries done')
+    if failed:
+        print('Failed, see log files:', failed)
+    return results
+
+def run_simulate(config):
+    '''
+    Runs the simulate command, FEBio for every case in the output directory
+    '''
+    import simulation
+
+    statuses = simulation.run_simulations(config['FEBio_path'], config['output_dir'], config['FEBio_cores'],
+                                          config['FEBio_threads'], config['FEBio_rerun'])
+    failed = [status['case'] for status in statuses if status['status'] != 'done']
+    if failed:
+        print(f'{len(failed)} simulations failed, see febio_output.txt in the case folders:', failed)
+    return statuses
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Automatic aortic CFD workflow')
+    parser.add_argument('command', choices=['init-config', 'mesh', 'map', 'write-feb', 'simulate'])
+    parser.add_argument('config', help='path to the .json configuration file')
+    parser.add_argument('--workers', type=int, default=None, help='number of geometries processed at the same time (overrides n_workers)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'init-config':
+        cfg.save_config(cfg.default_config(), args.config)
+        print('Default configuration written to', args.config)
+        return
+
+    config = cfg.load_config(args.config)
+    if args.command == 'simulate':
+        run_simulate(config)
+    else:
+        required = ['input_dir', 'vel_profile_dir'] if args.command == 'map' else ['input_dir']
+        for key in required:
+            if config[key] is None:
+                parser.error(f"'{key}' is not set in {args.config}")
+        run_preprocessing(config, args.command, args.workers)
+    print('Done!')
+
+if __name__ == '__main__':
+    main()
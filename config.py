@@ -0,0 +1,143 @@
+#import modules
+import os.path as osp
+import json
+
+"""
+Configuration files for the command line interface (cli.py). A configuration file is a .json file with the same
+parameters as the Setup part of main_workflow plus the directories that main_workflow asks for. Parameters that are
+not in the file keep their default value, for the parameter dicts (FEBio_parameters, mmg_parameters, ...) this holds
+per key, so a file that only contains {"FEBio_parameters": {"hr": 80}} changes only the heart rate.
+Relative paths in the file are relative to the location of the file.
+
+Write a file with all defaults to start from with:  python cli.py init-config <file>.json
+"""
+
+PATH_KEYS = ['input_dir', 'vel_profile_dir', 'output_dir', 'work_dir']
+
+def default_config():
+    '''
+    returns dict with the default configuration, the parameters have the same values as in main_workflow
+    '''
+    return dict(
+        #Directories, work_dir contains the temp, log and cache folders (default is the directory of the workflow)
+        input_dir = None,
+        vel_profile_dir = None,
+        output_dir = 'output',
+        work_dir = None,
+
+        FEBio_parameters = dict(
+            hr = 100,
+            displacement = False,
+            fluid_pressure = False,
+            nodal_fluid_velocity = False,
+            fluid_stress = True,
+            fluid_velocity = True,
+            fluid_acceleration = False,
+            fluid_vorticity = False,
+            fluid_rate_of_deformation = False,
+            fluid_dilatation = False,
+            fluid_volume_ratio = False,
+            vtk = True,
+            materialtype = 'fluid',
+            density = 1000,
+            k = 2200000,
+            viscoustype = "Newtonian fluid",
+            kappa = 1,
+            mu = 0.056,
+            time_steps = 600,
+            step_size = 0.001,
+            dtmin = 0,
+            dtmax = 0.01,
+            interpolate = 'LINEAR'),
+
+        FEBio_path = r"C:/Program Files/bin/febio4.exe",
+        FEBio_cores = None,
+        FEBio_threads = 4,
+        FEBio_rerun = 'unfinished',
+
+        max_retry = 2,
+        mmg_parameters = {
+            'mesh_density': '0.1',
+            'sizing': '1',
+            'detection angle': '45'},
+        mmg3d_parameters = {
+            'hausd': '0.1',
+            'detection angle': '45'},
+        mmg3d_sol_parameters = {
+            'bl_thickness': 1,
+            'bl_edgelength': 1,
+            'edgelength': 15,
+            'gradation': None,
+            'radius_cells': None,
+            'target_elements': None},
+        tetgen_parameters = dict(
+            order=1,
+            mindihedral=20,
+            minratio=1.5,
+            nobisect=True,
+            fixedvolume=True,
+            maxvolume=1),
+        volume_meshing = 'two_stage',
+        calibration = None,
+        mmg_limits = dict(
+            timeout=3600,
+            memory=None),
+
+        max_elements = 1000000,
+        min_jacobian = 0.1,
+        max_aspect = 5,
+        preflight = 'rescale',
+        cut_search = None,
+        cut_proxy_error = None,
+        id_angle = 35,
+
+        intp_options = {
+            'zero_boundary_dist': 0.2,
+            'zero_backflow': False,
+            'kernel': 'linear',
+            'smoothing': 0.5,
+            'degree': 0,
+            'neighbors': None,
+            'hard_noslip': False},
+
+        #Plots need a display, so they are off by default on the command line
+        show_plot = False,
+        n_workers = 1,
+        use_cache = True,
+        cache_max_size = 20e9,
+        cache_max_age = 30,
+        use_ledger = True,
+        resume = True)
+
+def load_config(path):
+    '''
+    Reads a configuration file and completes it with the defaults
+    :arg1 path: path to the .json configuration file
+
+    returns dict with the full configuration
+    '''
+    with open(path) as file:
+        user_config = json.load(file)
+
+    config = default_config()
+    for key, value in user_config.items():
+        if key not in config:
+            raise KeyError(f"Unknown parameter '{key}' in {path}")
+        if isinstance(config[key], dict) and isinstance(value, dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+
+    #Make paths relative to the location of the configuration file
+    config_dir = osp.dirname(osp.abspath(path))
+    for key in PATH_KEYS:
+        if config[key] is not None:
+            config[key] = osp.join(config_dir, config[key])
+    return config
+
+def save_config(config, path):
+    '''
+    Writes a configuration to a .json file
+    '''
+    with open(path, 'w') as file:
+        json.dump(config, file, indent=4)
@@ -1,22 +1,35 @@
 import numpy as np
 import pyvista as pv
 import utils as ut
+import slicing
+import profiling
+import cache
 
 
 #main function that runs the cutter script
-def main_cutter(inlet, wall, plot=False):
+def main_cutter(inlet, wall, plot=False, search=None, proxy=None):
     '''
     Function that is the main for the cutting of the aorta geometry. It calls centerline, areaselection and
     cutting functions to perform the cut
     :arg1 inlet: pyvista Polydata
     :arg2 wall: pyvista PolyData
+    :opt arg3 plot: show plots, default is False
+    :opt arg4 search: None to trace the centerline in steps of 1 mm, or dict with the 'step' (mm) and the number of
+                      'evaluations' of the coarse-to-fine search (see search_cut)
+    :opt arg5 proxy: decimated proxy of the wall (see wall_proxy) to trace the centerline on, the cut itself is
+                     always made in the wall. Default is None (trace on the wall)
 
     returns pyvista PolyData of the wall after the cut
     '''
     print('Start cutting')
+    if search is not None:
+        return search_cut(inlet, wall, search['step'], search['evaluations'], plot=plot, proxy=proxy)
+
     #Calculates areas along the centerline of the aorta (only first 40 mm). Also outputs nodes/normals and
     #edge profiles for the final cut and visualisation
-    centernodes, centernormals, edgeprofiles, slice_areas = centerline(inlet, wall)
+    with profiling.stage('centerline') as record:
+        centernodes, centernormals, edgeprofiles, slice_areas = centerline(inlet, wall if proxy is None else proxy)
+        record['points'] = len(centernodes)
 
     #Plots the centerline
     if plot:
@@ -45,8 +58,8 @@ def main_cutter(inlet, wall, plot=False):
 
 def centerline(inlet, wall, dist=40, flip_norm=False):
     '''
-    Function that calculates an approximation of the centerline of the wall geometry
-    Known shortcoming: Function does not automatically end at end of geometry but gives an error when reaching the end
+    Function that calculates an approximation of the centerline of the wall geometry. The sections of the wall are
+    calculated with the slicing engine (slicing.py), tracing stops early when a section misses the wall
     :arg1 inlet: pyvista Polydata
     :arg2 wall: pyvista PolyData
     :opt arg3: the distance from the inlet at which the function stops calculating
@@ -78,9 +91,12 @@ def centerline(inlet, wall, dist=40, flip_norm=False):
     #Use the inlet information calculated above as initial values in the storage variables (append) and and make the centernode and normal equal to a calculation variable
     centernodes = np.vstack([centernodes, inlet_centerpoint])
     centernormals = np.vstack([centernormals, inlet_normal])
-    edgeprofiles = inlet_boundary
+    profiles = []
     slice_areas = np.append(slice_areas, inlet_area)
 
+    #Precompute the edges of the wall, every section only uses the triangles that cross its plane
+    sliceable = slicing.prepare(wall)
+
     #Calculation variables
     center = inlet_centerpoint
     normal = inlet_normal
@@ -95,26 +111,30 @@ def centerline(inlet, wall, dist=40, flip_norm=False):
         inter_center = np.add(center, normal)
         #Use this new point and the previous directional vector to make a cut of the wall mesh
 
-        inter_profile = get_clip_perimeter(inter_center, normal, wall) #Extract the edge profile (temporary) and isolate the profile (with connectivity) which we want to continue working with
+        inter_profile = slicing.section(sliceable, inter_center, normal) #Extract the edge profile (temporary) closest to the new point which we want to continue working with
+        if inter_profile is None:
+            print('End of geometry reached')
+            break
         #From the isolated profile (temporary), calculate the new center point
-        inter_profile_points = inter_profile.points
-        new_center = inter_profile_points.mean(0)    
+        new_center = inter_profile['center']
         #Calculate the normalised relative vector from the centernode of the previous edgeprofile (previous iteration) and the new center point
         A = np.subtract(inter_center, center)
         B =  0.1 * np.subtract(new_center, inter_center)
         new_normal = ut.normalise(np.add(A, B))
 
         #Make a new cut of the wall mesh with the new center point and the new normalised directional vector (also isolate this edgeprofile again)
-        new_profile = get_clip_perimeter(new_center, new_normal, wall)
+        new_profile = slicing.section(sliceable, new_center, new_normal)
+        if new_profile is None:
+            print('End of geometry reached')
+            break
 
-        #Calculate the area of the new profile
-        new_profile_closed = new_profile.delaunay_2d()
-        new_area = new_profile_closed.area
+        #Area of the new profile (vector area of the section polygon)
+        new_area = new_profile['area']
 
         #Store the new center point, the normalised directional vector, the last (second) edge profile and the area of the last edge profile in the storage variables
         centernodes = np.vstack([centernodes, new_center])
         centernormals = np.vstack([centernormals, new_normal])
-        edgeprofiles += new_profile
+        profiles.append(new_profile['points'])
         slice_areas = np.append(slice_areas, new_area)
 
         #Calculate the distance of the new center point and the center point of the inlet, if the distance is larger than a certain threshold. We break the while loop
@@ -127,10 +147,158 @@ def centerline(inlet, wall, dist=40, flip_norm=False):
 
         count += 1
 
+    #Combine the inlet and all sections for visualisation
+    edgeprofiles = inlet_boundary + slicing.loops_to_polydata(profiles) if profiles else inlet_boundary
+
     print('Centerline generated')
     
     return centernodes, centernormals, edgeprofiles, slice_areas
 
+def search_cut(inlet, wall, step=5, evaluations=8, dist=40, plot=False, proxy=None):
+    '''
+    Coarse-to-fine version of main_cutter. The area profile is sampled along the vessel every step mm with a single
+    section per sample (the section through the predicted center, which also gives the next center). areaselection
+    selects the cut on the area profile resampled every mm, as on the 1 mm trace it was tuned for, after which a
+    golden-section search within a step around it (along the interpolated centerline) refines the location of the
+    smallest area.
+    Every area is a slice of the wall, the search needs about dist/step + evaluations + 1 slices instead of the
+    2*dist slices of the 1 mm trace
+    :arg1 inlet: pyvista Polydata
+    :arg2 wall: pyvista PolyData
+    :opt arg3 step: distance between the coarse samples (mm)
+    :opt arg4 evaluations: number of slices of the golden-section search
+    :opt arg5 dist: the distance from the inlet at which the coarse sampling stops
+    :opt arg6 plot: show plots, default is False
+    :opt arg7 proxy: decimated proxy of the wall to slice instead of the wall, default is None
+
+    returns pyvista PolyData of the wall after the cut and the center of the cut
+    '''
+    with profiling.stage('centerline') as record:
+        sliceable = slicing.prepare(wall if proxy is None else proxy)
+
+        #Start at the inlet, like centerline
+        inlet_boundary = inlet.extract_feature_edges(boundary_edges=True, non_manifold_edges=False, manifold_edges=False, feature_edges=False)
+        inlet_centerpoint = inlet_boundary.points.mean(0)
+        center = inlet_centerpoint
+        normal = ut.normalise(inlet.compute_normals()['Normals'].mean(0))
+        centernodes = [center]
+        centernormals = [normal]
+        slice_areas = [inlet.area]
+
+        #Coarse sampling, every section gives the area of the sample and the center of the next step
+        while np.linalg.norm(center - inlet_centerpoint) < dist:
+            inter_center = center + step * normal
+            profile = slicing.section(sliceable, inter_center, normal)
+            if profile is None:
+                print('End of geometry reached')
+                break
+            new_center = profile['center']
+            centernodes.append(new_center)
+            centernormals.append(normal)
+            slice_areas.append(profile['area'])
+            normal = ut.normalise(normal + 0.1 * (new_center - inter_center))
+            center = new_center
+
+        centernodes = np.array(centernodes)
+        centernormals = np.array(centernormals)
+        slice_areas = np.array(slice_areas)
+
+        #Centerline interpolated along its length
+        length = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(centernodes, axis=0), axis=1))])
+        def plane(position):
+            point = np.array([np.interp(position, length, centernodes[:, i]) for i in range(3)])
+            normal = ut.normalise(np.array([np.interp(position, length, centernormals[:, i]) for i in range(3)]))
+            return point, normal
+
+        def area(position):
+            profile = slicing.section(sliceable, *plane(position))
+            return np.inf if profile is None else profile['area']
+
+        #The heuristics of areaselection are tuned on the 1 mm trace, so they select on the area profile resampled
+        #every mm (linear between the coarse samples). The search is refined within a step around the selection
+        fine_length = np.arange(0, length[-1] + 1e-9, 1.0)
+        fine_areas = np.interp(fine_length, length, slice_areas)
+        fine_index = int(areaselection(fine_areas)[1][0])
+        selected = fine_length[fine_index]
+        smallest_area = area(selected)
+
+        #Only a selected narrowest part is refined. Without a narrowing after the aortic root areaselection selects the
+        #start of the steepest decrease of the area, which a search for the smallest area would move away from
+        neighbours = fine_areas[max(fine_index - 1, 0):fine_index + 2]
+        refine = fine_areas[fine_index] <= neighbours.min()
+
+        position = selected
+        if refine:
+            golden = (np.sqrt(5) - 1) / 2
+            a = max(selected - step, 0)
+            b = min(selected + step, length[-1])
+            c = b - golden * (b - a)
+            d = a + golden * (b - a)
+            area_c, area_d = area(c), area(d)
+            for _ in range(evaluations - 2):
+                if area_c < area_d:
+                    b, d, area_d = d, c, area_c
+                    c = b - golden * (b - a)
+                    area_c = area(c)
+                else:
+                    a, c, area_c = c, d, area_d
+                    d = a + golden * (b - a)
+                    area_d = area(d)
+            position, refined_area = (c, area_c) if area_c < area_d else (d, area_d)
+
+            #Keep the selected position if the refinement did not find a smaller area (e.g. the inlet itself)
+            if refined_area < smallest_area:
+                smallest_area = refined_area
+            else:
+                position = selected
+
+        point, normal_final = plane(position)
+        profile = slicing.section(sliceable, point, normal_final)
+        center_final = point if profile is None else profile['center']
+        record['points'] = len(centernodes) + evaluations + 1
+
+    print('Smallest cross-section calculated')
+    print('Smallest cross-section: ', smallest_area)
+
+    #Plots the coarse samples and the cut location
+    if plot:
+        plt = pv.Plotter()
+        plt.add_mesh(wall, style ='wireframe')
+        plt.add_points(centernodes, color = 'red')
+        plt.add_points(center_final, color = 'blue')
+        plt.add_text('Coarse samples and cut location')
+        plt.show()
+
+    new_geometry = cut(center_final, normal_final, wall, plot=plot)
+
+    print('Cutting done')
+    return (new_geometry, center_final)
+
+def wall_proxy(wall, max_error, cache_dir=None, parent_key=None):
+    '''
+    Decimated proxy of the wall for tracing the centerline (see slicing.proxy). The proxy is stored in the cache under
+    a key of the input geometry, so retries and postprocessing of the same geometry reuse it
+    :arg1 wall: pyvista PolyData
+    :arg2 max_error: maximum Hausdorff distance between the proxy and the wall (mm)
+    :opt arg3 cache_dir: path to the cache directory, default is None (no caching)
+    :opt arg4 parent_key: key of the input geometry (e.g. cache.hash_files of the input files), default is None
+
+    returns pyvista PolyData of the proxy
+    '''
+    key = cache.stage_key('proxy', parent_key, dict(max_error=max_error)) if parent_key is not None else None
+    entry = cache.load(cache_dir, key) if key is not None else None
+    if entry is not None:
+        print('Wall proxy loaded from cache')
+        return entry['proxy']
+
+    with profiling.stage('proxy') as record:
+        proxy, error = slicing.proxy(wall, max_error)
+        record['cells'] = wall.n_cells
+    print(f'Wall proxy created: {proxy.n_cells} of {wall.n_cells} cells, Hausdorff distance {error:.3g}')
+    if key is not None:
+        cache.store(cache_dir, key, dict(proxy=proxy))
+    return proxy
+
 def areaselection(areas):
     '''
     Function that selects the minimal area after the aortic root along the centerline
@@ -154,25 +322,9 @@ def areaselection(areas):
     if len(narrow_segments) > 1:
         smallest_area = min(narrow_segments[1]) #Gives out of bound error when there is no constriction
     else:
-        counter = 0 
+        # Moving average (window of 3) of the area differences, rounded to 2 decimals
         window_size = 3
-        moving_averages = []
-
-        while counter < len(diff_areas) - window_size + 1:
-   
-            # Store elements from i to i+window_size
-            # in list to get the current window
-            window = diff_areas[counter : counter + window_size]
-        
-            # Calculate the average of current window
-            window_average = round(sum(window) / window_size, 2)
-            
-            # Store the average of current
-            # window in moving average list
-            moving_averages.append(window_average)
-            
-            # Shift window to right by one position
-            counter += 1
+        moving_averages = np.round(np.convolve(diff_areas, np.ones(window_size), 'valid') / window_size, 2)
         transition_index = np.argmin(moving_averages)
         smallest_area = areas[transition_index]
 
@@ -182,7 +334,7 @@ def areaselection(areas):
 
     return smallest_area, smallest_area_index
 
-def post_cutter(inlet, wall, plot=False, flip_norm=False):
+def post_cutter(inlet, wall, plot=False, flip_norm=False, proxy=None):
     '''
     Cuts a vessel at the point where the centerline is horizontal, returns downstream geomtetry. 
 
@@ -190,10 +342,13 @@ def post_cutter(inlet, wall, plot=False, flip_norm=False):
     :arg2 wall: pyvista PolyData
     :arg3 opt plot: show plots, default is False
     :arg4 opt flip_norm: flips normals of the inlet, neccessary if centerline doesn't perform well
+    :arg5 opt proxy: decimated proxy of the wall to trace the centerline on (see wall_proxy), default is None
     '''
     print('Start cutting')
     #Calculates areas along the centerline of the aorta (only first 40 mm). Also outputs nodes/normals and edge profiles for the final cut and visualisation
-    centernodes, centernormals, edgeprofiles, slice_areas = centerline(inlet, wall, dist = 150, flip_norm=flip_norm)
+    with profiling.stage('centerline') as record:
+        centernodes, centernormals, edgeprofiles, slice_areas = centerline(inlet, wall if proxy is None else proxy, dist = 150, flip_norm=flip_norm)
+        record['points'] = len(centernodes)
 
     #Plots the centerline
     if plot:
@@ -256,27 +411,3 @@ def cut(point, normal, wall, plot=False):
     if plot==True:
         clipped.plot(text='Cut geometry')
     return(clipped)
-
-def get_clip_perimeter(point, normal, wall, plot=False):
-    '''
-    Function that cuts a vessel geometry along a plane defined by a point & vector, and returns the resulting perimeter
-    :arg1 point: numpy array, xyz
-    :arg2 normal: vector
-    :arg3 wall: pyvista PolyData
-
-    returns pyvista PolyData of the perimeter resulting from the cut
-    '''
-    # Clip geometry
-    normal=np.array(normal)
-    clipped = wall.clip(normal=(normal * -1), origin=point) 
-
-    # Extract edges
-    edges = clipped.extract_feature_edges(boundary_edges=True, non_manifold_edges=False, manifold_edges=False, feature_edges=False)
-
-    # Extract edge closest to point
-    edge = edges.connectivity('closest', point)
-
-    if plot==True:
-        edges.plot()
-        edge.plot()
-    return(edge)
\ No newline at end of file
@@ -0,0 +1,194 @@
+#import modules
+import os
+import numpy as np
+import pyvista as pv
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Distance of a large number of points (the vertices of a volume mesh) to a triangulated surface (the wall), used for
+the size maps of mmg3d (volume_mesh.write_sol, sizing.py). Only points near the wall need an exact distance for the
+size maps, so the surface is prepared for a cutoff distance (prepare):
+    grid      : a uniform grid of cubic cells. Every triangle is registered in the cells within the cutoff of it (the
+                cells in its bounding box grown by the cutoff, of which the plane of the triangle is within the cutoff).
+                All triangles within the cutoff of a point are then registered in the cell of the point, which is
+                found by hashing its coordinates, without any tree search
+    centroids : KD-tree of the centroids of the triangles. For the points without a triangle within the cutoff the
+                distance to the triangles of the NEAREST nearest centroids is used
+The distance to the candidate triangles is computed with the closest point on a triangle (Ericson, Real-Time
+Collision Detection, 5.1.5), vectorized over all point-triangle pairs. The distance is exact up to the cutoff (up to
+rounding, for triangles that are not degenerate). Beyond the cutoff it is only known to be beyond the cutoff: the
+distance to the triangles near the point, which is not the nearest triangle for points far from the wall or near
+sharp folds of it. This is all the two-value size map needs (volume_mesh.write_sol), the graded size map of sizing.py
+grows with the distance beyond the boundary layer and uses the exact distance (sizing.wall_distance without cutoff).
+The points are processed in chunks on a thread pool, NumPy and the KD-tree release the GIL.
+The signed distance takes the sign of the normal of the closest triangle (negative inside for outward normals), of
+the triangles at the same distance the one that faces the point most directly.
+"""
+
+#Number of points per chunk (a chunk is the unit of work of a thread)
+CHUNK = 50000
+
+#Number of nearest centroids of which the triangles give the distance beyond the cutoff
+NEAREST = 4
+
+def prepare(surface, cutoff, cell=None):
+    '''
+    Precomputes the data of a surface that is needed for distance queries
+    :arg1 surface: pyvista PolyData or UnstructuredGrid, cells other than triangles are triangulated
+    :arg2 cutoff: distance up to which the distances are exact
+    :opt arg3 cell: edge length of the cells of the grid, default is the cutoff (at least half the median edge
+                    length of the triangles, smaller cells give fewer candidates per point but more registrations)
+
+    returns dict with the corners (m x 3 x 3) and unit normals of the triangles, the grid (origin, cell size, shape,
+    sorted keys of the occupied cells with the start of their triangles in the triangle list) and the KD-tree of the
+    centroids
+    '''
+    from scipy.spatial import cKDTree
+
+    if not isinstance(surface, pv.PolyData):
+        surface = surface.extract_surface()
+    surface = surface.triangulate()
+    corners = np.asarray(surface.points, dtype=float)[surface.regular_faces]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-300)[:, None]
+    if cell is None:
+        edges = np.linalg.norm(corners - np.roll(corners, 1, axis=1), axis=2)
+        cell = max(cutoff, float(np.median(edges)) / 2)
+
+    #Grid around the surface grown by the cutoff, cells in the grown bounding box of every triangle
+    origin = corners.reshape(-1, 3).min(0) - cutoff
+    shape = np.floor((corners.reshape(-1, 3).max(0) + cutoff - origin) / cell).astype(np.int64) + 1
+    low = np.floor((corners.min(1) - cutoff - origin) / cell).astype(np.int64)
+    size = np.floor((corners.max(1) + cutoff - origin) / cell).astype(np.int64) - low + 1
+    counts = size.prod(1)
+    triangles = np.repeat(np.arange(len(corners)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    sx, sy = size[triangles, 0], size[triangles, 1]
+    ijk = low[triangles] + np.column_stack([local % sx, (local // sx) % sy, local // (sx * sy)])
+
+    #Only cells of which the plane of the triangle passes within the cutoff (from the cell center)
+    centers = origin + (ijk + 0.5) * cell
+    plane = np.abs(np.einsum('ij,ij->i', centers - corners[triangles, 0], normals[triangles]))
+    keep = plane <= cutoff + cell * np.sqrt(3) / 2
+    keys = (ijk[keep, 0] * shape[1] + ijk[keep, 1]) * shape[2] + ijk[keep, 2]
+    order = np.argsort(keys, kind='stable')
+    cells, starts = np.unique(keys[order], return_index=True)
+    return dict(corners=corners, normals=normals, cutoff=cutoff, origin=origin, cell=cell, shape=shape,
+                cells=cells, starts=np.append(starts, len(order)), triangles=triangles[keep][order],
+                centroids=cKDTree(corners.mean(1)))
+
+def closest_points(p, a, b, c):
+    '''
+    Closest points on triangles abc to points p (vectorized version of Ericson, 5.1.5)
+    :arg1 p: array (n x 3) with the points
+    :arg2-4 a, b, c: arrays (n x 3) with the corners of the triangles
+
+    returns array (n x 3) with the closest points
+    '''
+    ab, ac, ap = b - a, c - a, p - a
+    d1 = np.einsum('ij,ij->i', ab, ap)
+    d2 = np.einsum('ij,ij->i', ac, ap)
+    bp = p - b
+    d3 = np.einsum('ij,ij->i', ab, bp)
+    d4 = np.einsum('ij,ij->i', ac, bp)
+    cp = p - c
+    d5 = np.einsum('ij,ij->i', ab, cp)
+    d6 = np.einsum('ij,ij->i', ac, cp)
+
+    #Inside the face region by default
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = va + vb + vc
+        v = vb / denominator
+        w = vc / denominator
+        result = a + ab * v[:, None] + ac * w[:, None]
+
+        #Edge regions, the regions are tested from the last to the first so the first match wins
+        edge_bc = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        result[edge_bc] = (b + (c - b) * t[:, None])[edge_bc]
+        edge_ac = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        t = d2 / (d2 - d6)
+        result[edge_ac] = (a + ac * t[:, None])[edge_ac]
+        edge_ab = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        t = d1 / (d1 - d3)
+        result[edge_ab] = (a + ab * t[:, None])[edge_ab]
+
+    #Vertex regions
+    vertex_c = (d6 >= 0) & (d5 <= d6)
+    result[vertex_c] = c[vertex_c]
+    vertex_b = (d3 >= 0) & (d4 <= d3)
+    result[vertex_b] = b[vertex_b]
+    vertex_a = (d1 <= 0) & (d2 <= 0)
+    result[vertex_a] = a[vertex_a]
+    return result
+
+def _pair_distance(field, points, first, second):
+    '''
+    returns the vectors from the closest points on the triangles second to the points first, and their lengths
+    '''
+    vectors = points[first] - closest_points(points[first], *field['corners'][second].transpose(1, 0, 2))
+    return vectors, np.linalg.norm(vectors, axis=1)
+
+def _chunk_distance(field, points, signed):
+    '''
+    returns the (signed) distance of a chunk of points to the prepared surface field, see distance
+    '''
+    corners = field['corners']
+    n = len(points)
+
+    #Triangles registered in the cell of every point (points outside the grid are beyond the cutoff)
+    ijk = np.floor((points - field['origin']) / field['cell']).astype(np.int64)
+    inside = np.all((ijk >= 0) & (ijk < field['shape']), axis=1)
+    keys = (ijk[:, 0] * field['shape'][1] + ijk[:, 1]) * field['shape'][2] + ijk[:, 2]
+    index = np.minimum(np.searchsorted(field['cells'], keys), len(field['cells']) - 1)
+    found = inside & (field['cells'][index] == keys)
+    start = field['starts'][index[found]]
+    counts = field['starts'][index[found] + 1] - start
+    first = np.repeat(np.where(found)[0], counts)
+    second = field['triangles'][np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+
+    #Exact distance to the candidates, the minimum per point
+    vectors, pair_distance = _pair_distance(field, points, first, second)
+    result = np.full(n, np.inf)
+    np.minimum.at(result, first, pair_distance)
+
+    #Points without a triangle within the cutoff (none or only farther ones in their cell), the triangles of the
+    #nearest centroids
+    ids = np.where(result > field['cutoff'])[0]
+    if len(ids):
+        k = min(NEAREST, len(corners))
+        far_first = np.repeat(ids, k)
+        far_second = field['centroids'].query(points[ids], k)[1].reshape(-1)
+        far_vectors, far_distance = _pair_distance(field, points, far_first, far_second)
+        np.minimum.at(result, far_first, far_distance)
+        first, second = np.concatenate([first, far_first]), np.concatenate([second, far_second])
+        vectors, pair_distance = np.concatenate([vectors, far_vectors]), np.concatenate([pair_distance, far_distance])
+    if not signed:
+        return result
+
+    #Sign from the closest triangle, of the triangles at the same distance the one that faces the point the most
+    facing = np.einsum('ij,ij->i', vectors, field['normals'][second])
+    alignment = np.abs(facing) / np.maximum(pair_distance, 1e-300)
+    tied = pair_distance <= result[first] * (1 + 1e-9) + 1e-12
+    order = np.lexsort((-alignment, ~tied, first))
+    starts = np.unique(first[order], return_index=True)[1]
+    return np.where(facing[order][starts] < 0, -1, 1) * result
+
+def distance(field, points, signed=False, n_threads=None):
+    '''
+    Distance of points to a surface, exact up to the cutoff of the field and beyond the cutoff (not exact) for the others
+    :arg1 field: dict returned by prepare
+    :arg2 points: array (n x 3) with the points
+    :opt arg3 signed: return the signed distance, negative on the side opposite to the normals. Default is False
+    :opt arg4 n_threads: number of threads, default is the number of cores
+
+    returns array (n) with the distances
+    '''
+    points = np.asarray(points, dtype=float)
+    chunks = [points[start:start + CHUNK] for start in range(0, len(points), CHUNK)]
+    with ThreadPoolExecutor(max_workers=n_threads or os.cpu_count()) as pool:
+        results = list(pool.map(lambda chunk: _chunk_distance(field, chunk, signed), chunks))
+    return np.concatenate(results) if results else np.zeros(0)
@@ -5,9 +5,7 @@ from pathlib import Path
 from glob import glob
 import numpy as np
 import pyvista as pv
-import tetgen as tet
 import xml.etree.ElementTree as ET
-import subprocess
 
 def xml_creator(tetmesh, id_inlet, id_outlet, id_wall, velocity_profile, file_dir, output_dir, FEBio_parameters):
     #-------------------------------------------------------------------------------------------------------------------------
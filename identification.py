@@ -1,12 +1,69 @@
 import numpy as np
 import pyvista as pv
+from scipy import sparse
+from scipy.sparse import csgraph
 
+# Medit references of the boundary triangles. The pipeline labels the triangles of the caps and the cut wall before
+# meshing, mmgs, TetGen (volume_mesh.tetgen) and mmg3d carry them to the boundary of the volume mesh
+INLET = 1
+OUTLET = 2
+WALL = 3
 
+def identify_by_reference(mesh):
+    '''
+    Splits the boundary of a volume mesh in inlet, outlet and wall using the references of its boundary triangles
+    (field data 'boundary_triangles' and 'boundary_refs', see volume_mesh.mmg3d). Every boundary face is looked up by
+    its sorted vertex triple in a single vectorized pass. The output is the same as that of identify_surfaces with the
+    inlet and outlet as seeds.
+
+    :mesh   : pyvista UnstructuredGrid volume mesh
+    :returns: pv.MultiBlock containing the inlet, outlet and wall, or None if a boundary face has no reference or a
+              surface is missing (use identify_surfaces instead)
+    '''
+    if 'boundary_triangles' not in mesh.field_data:
+        return None
+
+    # Add original point data and extract surface
+    mesh['orig_point_indices'] = np.arange(mesh.n_points, dtype=np.int32)
+    surf = mesh.extract_surface()
+    faces = surf['orig_point_indices'][surf.faces.reshape(-1, 4)[:,[1,2,3]]]
+
+    # A single integer key per sorted vertex triple
+    n = np.int64(mesh.n_points)
+    def keys(triangles):
+        triangles = np.sort(triangles, axis=1).astype(np.int64)
+        return (triangles[:, 0] * n + triangles[:, 1]) * n + triangles[:, 2]
+
+    boundary_keys = keys(mesh.field_data['boundary_triangles'])
+    order = np.argsort(boundary_keys)
+    boundary_keys = boundary_keys[order]
+    boundary_refs = mesh.field_data['boundary_refs'][order]
+
+    face_keys = keys(faces)
+    position = np.minimum(np.searchsorted(boundary_keys, face_keys), len(boundary_keys) - 1)
+    if not np.all(boundary_keys[position] == face_keys):
+        return None
+    refs = boundary_refs[position]
+
+    surf_block = pv.MultiBlock()
+    for ref in [INLET, OUTLET, WALL]:
+        if not np.any(refs == ref):
+            return None
+        new_surf = surf.extract_cells(refs == ref)
+        new_surf_faces = new_surf.cells.reshape(-1, 4)[:,[1,2,3]]
+        new_surf.cell_data['original_connectivity'] = new_surf['orig_point_indices'][new_surf_faces]
+        surf_block.append(new_surf)
+
+    # Faces with another reference (e.g. 0 if a mesher dropped the references) are not assigned
+    if sum(block.n_cells for block in surf_block) != len(faces):
+        return None
+    return surf_block
 
 def identify_surfaces (mesh, angle, seeds=[], plot=False, include_original_connectivity=True):
     '''
     This function identifies surfaces of a pyvista 3D or surface mesh using the pv.edge_mask filter to determine
-    edges. It returns a pv MultiBlock containing the surfaces as separate blocks. Also included as point and cell
+    edges. The surfaces are the connected components of a sparse graph of the faces and nodes, without the faces
+    that touch an edge, so any number of surfaces is found in a single pass. It returns a pv MultiBlock containing the surfaces as separate blocks. Also included as point and cell
     data embedded in the MultiBlock are the original point indices (point_data['orig_point_indices']) and the faces of the identified surfaces
     defined by the original point indices (cell_data['original_connectivity']).
 
@@ -42,74 +99,64 @@ def identify_surfaces (mesh, angle, seeds=[], plot=False, include_original_conne
 
     # Extract np arrays
     faces = surf.faces.reshape(-1, 4)[:,[1,2,3]]
+    n_faces = len(faces)
+    n_points = surf.n_points
 
-    # Create array of edge faces
-    edgenode_indices = np.where(edgenodes)[0] # Converts bool array to array of indices
-    edgefaces = np.any(np.isin(faces, edgenode_indices), axis=1) # Creates bool array of rows containing edgepoints
+    # Create array of edge faces (faces with a node on a sharp edge)
+    edgefaces = np.any(edgenodes[faces], axis=1)
 
     if plot==True:
         boolplot(surf, edgefaces, text='Edges')
 
-    # Create surfaces array, first column is edges:
-    surfaces = edgefaces.reshape(-1,1)
+    # Sparse face-node graph of the faces that are not edge faces. Faces that share a node are connected through it,
+    # so one connected components pass gives the interior of every surface
+    interior = np.where(~edgefaces)[0]
+    rows = np.repeat(interior, 3)
+    cols = n_faces + faces[interior].flatten()
+    graph = sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_faces + n_points, n_faces + n_points))
+    labels = csgraph.connected_components(graph, directed=False)[1][:n_faces]
+
+    def touching(facemask):
+        # Faces that share a node with the faces in facemask
+        nodemask = np.zeros(n_points, dtype=bool)
+        nodemask[faces[facemask].flatten()] = True
+        return np.any(nodemask[faces], axis=1)
 
     # Create PyVista PolyData block
     surf_block = pv.MultiBlock()
 
-    # Start of identification loop
+    # Faces that are part of a surface
+    listed = np.zeros(n_faces, dtype=bool)
     num_surfaces = 1
 
     print('Start surface identification')
 
-    while num_surfaces < 10:
-        # Create a new surface
-        surfaces = np.hstack((surfaces, np.full((len(faces), 1), False)))
-        
-        # Check if there are unlisted faces
-        if np.any(~np.any(surfaces, axis=1)) == False:
-            surfaces = np.delete(surfaces, num_surfaces, 1)
-            print(num_surfaces-1, 'surfaces found in total')
-            break
+    # Every surface is grown from a seed face: the faces around the seed, the interiors they belong to and the edge faces
+    # that touch these interiors. Edge faces that only touch other edge faces are not part of a surface
+    while np.any(~(listed | edgefaces)):
         print('Unidentified surface found')
 
         # Pick a nonlisted face
-        front = np.argmax(~np.any(surfaces, axis=1)) # Front contains indices, not bools
+        seed = np.argmax(~(listed | edgefaces))
         if len(seeds) >= num_surfaces:
-            front = surf.find_closest_cell(seeds[num_surfaces-1, :])
-
-        # Add face to surface
-        surfaces[front, num_surfaces] = True
+            seed = surf.find_closest_cell(seeds[num_surfaces-1, :])
+        seedmask = np.zeros(n_faces, dtype=bool)
+        seedmask[seed] = True
 
         if plot==True:
-            boolplot(surf, surfaces[:, num_surfaces], text = 'Seed')
-
-        counter = 0
-        while counter < 10000:
-            # Find neigbouring faces that arent part of a surface, add to surface
-            frontnodes = faces[front].flatten() # Node indices
-            neighbours = np.any(np.isin(faces, frontnodes), axis=1) # All neighbouring faces to front faces
-
-            #boolplot(surf, neighbours, text = 'All neighbours')
+            boolplot(surf, seedmask, text = 'Seed')
 
-            neighbours[front | np.any(surfaces[:, 1:], axis=1)] = False # Removes front faces and faces part of a surface
-
-            #boolplot(surf, neighbours, text = 'Cleaned neighbours')
-
-            surfaces[:,num_surfaces] = surfaces[:,num_surfaces] | neighbours # Adds neighbours to surface
-            neighbours[edgefaces] = False # Removes edges
-            front = neighbours # Creates new front
-
-
-            # Check if the front is empty
-            if np.any(front) == False:
-                break
-            counter += 1
+        # Neighbours of the seed that aren't part of a surface, the interiors among them grow the surface
+        surface = (touching(seedmask) & ~listed) | seedmask
+        grown = np.isin(labels, labels[surface & ~edgefaces]) & ~edgefaces & ~listed
+        surface |= grown | (touching(grown) & ~listed)
+        listed |= surface
 
         if plot==True:
-            boolplot(surf, surfaces[:, num_surfaces], text = f'Identified surface no. {num_surfaces}')
+            boolplot(surf, surface, text = f'Identified surface no. {num_surfaces}')
 
         # Create new surface as Polydata
-        new_surf = surf.extract_cells(surfaces[:, num_surfaces])
+        new_surf = surf.extract_cells(surface)
 
         # Get original node data and add as cell data
         if include_original_connectivity == True:
@@ -121,6 +168,8 @@ def identify_surfaces (mesh, angle, seeds=[], plot=False, include_original_conne
         surf_block.append(new_surf)
 
         num_surfaces += 1
+
+    print(num_surfaces-1, 'surfaces found in total')
     return surf_block
 
 #-- for debugging & writing --#
@@ -0,0 +1,183 @@
+#import modules
+import os
+import os.path as osp
+import json
+import hashlib
+import time
+import sqlite3
+import contextlib
+from glob import glob
+
+"""
+Run ledger of the preprocessing workflow, stored in a local SQLite file. For every case it records how often it was
+started and its final status. For every stage of every attempt it records the status, the cache key of the stage
+(a hash of its inputs and parameters), timings and quality metrics.
+
+Every change is committed immediately, so after a crash the ledger shows which cases finished and which stage was
+running. Every case also stores a hash of the settings and inputs it ran with (case_hash, case_inputs). Cases that are 'done' with the same
+settings are skipped when a batch is restarted, the other cases start again and load their finished stages from the
+cache (the cache key in the ledger points to the stored result), so only the stages of changed parameters run again.
+
+Useful queries on the ledger (e.g. with the sqlite3 command line tool):
+    slowest stages:  SELECT stage, AVG(walltime), MAX(walltime) FROM stages WHERE status='done' GROUP BY stage
+    flaky cases:     SELECT name, runs FROM cases WHERE runs > 1 OR status != 'done'
+"""
+
+#Settings that do not change the results of a case
+RUNTIME_SETTINGS = ['cache_dir', 'ledger_path', 'show_plot']
+
+def case_hash(settings, stages, inputs=()):
+    '''
+    Hash of everything a case depends on besides its geometry, stored in the ledger to decide if a done case can be
+    skipped
+    :arg1 settings: dict with the settings of pipeline.preprocess_case
+    :arg2 stages: parts of the workflow that run (see pipeline.preprocess_case)
+    :opt arg3 inputs: other inputs, e.g. the velocity profile directory (json compatible)
+
+    returns hex string
+    '''
+    relevant = {key: value for key, value in settings.items() if key not in RUNTIME_SETTINGS}
+    text = json.dumps(dict(settings=relevant, stages=list(stages), inputs=list(inputs)), sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def case_inputs(input_folder, output_folder, vel_profile_dir, stages):
+    '''
+    Inputs of a case besides its settings: the content of the input geometry (wall, inlet and outlet) and of the
+    velocity profiles, and, for runs of a part of the workflow (the map and write-feb commands), the size and
+    modification time of the results of the earlier parts that it reads from the output folder. A case is then done
+    again after e.g. it was segmented again, the profiles were replaced or its mesh was made again
+    :arg1 input_folder: path to the geometry folder of the case
+    :arg2 output_folder: path to the output folder of the case
+    :arg3 vel_profile_dir: path to the directory containing the velocity profiles, None if they are not used
+    :arg4 stages: parts of the workflow that run (see pipeline.preprocess_case)
+
+    returns list with the inputs (json compatible)
+    '''
+    import cache
+
+    inputs = [vel_profile_dir]
+    geometry = [osp.join(input_folder, r'meshes', f'{name}.stl') for name in ['inlet', 'wall', 'outlet']]
+    if all(osp.isfile(path) for path in geometry):
+        inputs.append(cache.hash_files(geometry))
+    if vel_profile_dir and 'map' in stages:
+        inputs.append(cache.hash_files(sorted(glob(osp.join(vel_profile_dir, '*.vtp')))))
+
+    folders = []
+    if 'mesh' not in stages:
+        folders.append('mesh')
+    if 'map' not in stages and 'feb' in stages:
+        folders.append('Mapped_Velocity_Profiles')
+
+    for folder in folders:
+        for root, _, files in os.walk(osp.join(output_folder, folder)):
+            for file in sorted(files):
+                path = osp.join(root, file)
+                stat = os.stat(path)
+                inputs.append([osp.relpath(path, output_folder), stat.st_size, stat.st_mtime])
+    return inputs
+
+def connect(path):
+    '''
+    Opens (and if needed creates) the ledger
+    :arg1 path: path to the SQLite file
+
+    returns sqlite3 connection
+    '''
+    con = sqlite3.connect(path, timeout=60)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('''CREATE TABLE IF NOT EXISTS cases (
+                       name TEXT PRIMARY KEY, status TEXT, runs INTEGER, started REAL, finished REAL, runtime REAL,
+                       params_hash TEXT)''')
+    #Ledgers of earlier versions have no settings hash of the cases, their cases run again once
+    if 'params_hash' not in [row[1] for row in con.execute('PRAGMA table_info(cases)')]:
+        con.execute('ALTER TABLE cases ADD COLUMN params_hash TEXT')
+    con.execute('''CREATE TABLE IF NOT EXISTS stages (
+                       id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, stage TEXT, run INTEGER, attempt INTEGER,
+                       status TEXT, params_hash TEXT, started REAL, finished REAL, walltime REAL, metrics TEXT)''')
+    con.commit()
+    return con
+
+def start_case(con, name, params_hash=None):
+    '''
+    Registers the start of a case, stages that were still running from an interrupted earlier run are marked as such
+    :arg1 con: ledger connection
+    :arg2 name: case name
+    :opt arg3 params_hash: hash of the settings of the case (see case_hash)
+
+    returns number of this run of the case (1 for the first run)
+    '''
+    row = con.execute('SELECT runs FROM cases WHERE name=?', (name,)).fetchone()
+    run = 1 if row is None else row[0] + 1
+    with con:
+        con.execute("UPDATE stages SET status='interrupted' WHERE name=? AND status='running'", (name,))
+        con.execute('INSERT OR REPLACE INTO cases (name, status, runs, started, finished, runtime, params_hash) VALUES (?, ?, ?, ?, NULL, NULL, ?)',
+                    (name, 'running', run, time.time(), params_hash))
+    return run
+
+def finish_case(con, name, status, runtime=None):
+    '''
+    Registers the end of a case
+    :arg1 con: ledger connection
+    :arg2 name: case name
+    :arg3 status: str, 'done' or 'failed'
+    :opt arg4 runtime: preprocessing time in seconds
+    '''
+    with con:
+        con.execute('UPDATE cases SET status=?, finished=?, runtime=? WHERE name=?', (status, time.time(), runtime, name))
+
+def case_status(con, name):
+    '''
+    returns the status of a case ('done', 'failed', 'running') or None if the case was never started
+    '''
+    row = con.execute('SELECT status FROM cases WHERE name=?', (name,)).fetchone()
+    return None if row is None else row[0]
+
+def finished_cases(con, params_hashes=None):
+    '''
+    returns dict with the name and runtime of all cases that are done, with params_hashes (dict with the hash of
+    every case name, see case_hash) only the cases that are done with the same settings and inputs
+    '''
+    rows = con.execute("SELECT name, runtime, params_hash FROM cases WHERE status='done'").fetchall()
+    return {name: runtime for name, runtime, params_hash in rows
+            if params_hashes is None or params_hashes.get(name) == params_hash}
+
+def failed_stage(con, name):
+    '''
+    returns name of the last stage of a case that did not finish (failed or interrupted), or None
+    '''
+    row = con.execute("SELECT stage FROM stages WHERE name=? AND status IN ('failed', 'interrupted') ORDER BY id DESC LIMIT 1",
+                      (name,)).fetchone()
+    return None if row is None else row[0]
+
+@contextlib.contextmanager
+def stage(con, name, stage, run, attempt, params_hash=None):
+    '''
+    Context manager that records a stage in the ledger. The stage is stored as 'running' when entered and as 'done'
+    (or 'failed' if an exception is raised) when left. The yielded dict can be used to add metrics (json compatible),
+    setting its 'status' key overrides the final status (e.g. 'cached').
+    If con is None nothing is recorded.
+    :arg1 con: ledger connection or None
+    :arg2 name: case name
+    :arg3 stage: stage name
+    :arg4 run: run number of the case (see start_case)
+    :arg5 attempt: meshing attempt within the run
+    :opt arg6 params_hash: cache key of the stage
+    '''
+    record = {}
+    if con is None:
+        yield record
+        return
+
+    start = time.time()
+    with con:
+        row_id = con.execute('INSERT INTO stages (name, stage, run, attempt, status, params_hash, started) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (name, stage, run, attempt, 'running', params_hash, start)).lastrowid
+    status = 'failed'
+    try:
+        yield record
+        status = record.pop('status', 'done')
+    finally:
+        end = time.time()
+        with con:
+            con.execute('UPDATE stages SET status=?, finished=?, walltime=?, metrics=? WHERE id=?',
+                        (status, end, end - start, json.dumps(record, default=float), row_id))
@@ -1,28 +1,11 @@
-
 #import modules
-import sys
 import os
 import os.path as osp
-from pathlib import Path
-from glob import glob
-import numpy as np
-import pyvista as pv
-import tetgen as tet
-import remesh
-import utils as ut
-import cutting
-import volume_mesh
-from capping import cap
-import identification as id
-from tkinter import Tk
 from tkinter.filedialog import askdirectory
-import time
-import mapping
-import xml.etree.ElementTree as ET
-import subprocess
-import febioxml as feb
-import quality_control
 import shutil
+import batch
+import simulation
+import cache
 #----------------------------------------------------------------------------------------------------------------------------
 # Setup
 #----------------------------------------------------------------------------------------------------------------------------
@@ -64,11 +47,16 @@ FEBio_parameters = dict(
 #Path for FEBio solver executable
 FEBio_path = r"C:/Program Files/bin/febio4.exe"                 #Path 1
 #FEBio_path = r"C:/Program Files/FEBioStudio2/bin/febio4.exe"   #Path 2
+
+#FEBio run settings, several simulations run at the same time within the core budget
+FEBio_cores = os.cpu_count()    #Total number of cores for all simulations together
+FEBio_threads = 4               #Number of threads per simulation
+FEBio_rerun = 'unfinished'      #Which cases to run: 'all', 'unfinished' (skip cases that are done) or 'failed'
     
 #additional FEBio parameters can be changed in febioxml.py if needed
 
 #Meshing parameters
-max_retry = 2               #Maximum number of retries for wall surface remeshing if quality is too low after volume mesh
+max_retry = 2               #Maximum number of meshing retries, a retry restarts from the failing stage with adjusted parameters (see retry.py)
 
 mmg_parameters = {          #Surface meshing parameters
     'mesh_density': '0.1',  #hausdorf parameter of mmg, defines amount of added detail at curvature
@@ -82,7 +70,10 @@ mmg3d_parameters = {        #Volume meshing parameters
 mmg3d_sol_parameters = {    #Paremeters for local mesh refinement (used to create an extra fine boundary layer)
     'bl_thickness': 1,
     'bl_edgelength': 1,     #Max edgelength within the boundary layer
-    'edgelength': 15}       #Max edgelength in the interior
+    'edgelength': 15,       #Max edgelength in the interior
+    'gradation': None,      #Growth of the edgelength away from the boundary layer (see sizing.py), None: two-value size map
+    'radius_cells': None,   #Minimum number of elements across the local vessel radius (graded size map), None: no minimum
+    'target_elements': None}#Element budget of the graded size map, None: no budget
 
 tetgen_parameters = dict(   #Parameters for initial volume mesh, not very important, as long as the mesh is finer than the bl_thickness
     order=1, 
@@ -92,11 +83,40 @@ tetgen_parameters = dict(   #Parameters for initial volume mesh, not very import
     fixedvolume=True,
     maxvolume=1)            #Controlls the density
 
+#'two_stage': dense initial TetGen mesh that mmg3d meshes again with the size map, 'single_pass': coarse TetGen seed
+#mesh that mmg3d meshes with the graded size map (fixedvolume and maxvolume are not used, see volume_mesh.py)
+volume_meshing = 'two_stage'
+
+#Calibration of the size map and the hausd of mmg3d to an element budget before the volume meshing (see calibration.py)
+#None: the parameters above are used as they are
+calibration = None          #e.g. dict(target_elements=500000, margin=0.9, hausd_factors=(0.5, 1, 2, 4))
+
+#Limits of every mmg run (see mmg_runner.py), a run that exceeds them counts as a meshing failure (see retry.py)
+mmg_limits = dict(
+    timeout=3600,           #Maximum wall time in seconds, None: no limit
+    memory=None)            #Maximum memory in MB, None: no limit
+
 #Run qualifications (case will be discarded if not met)
 max_elements = 1000000
 min_jacobian = 0.1
 max_aspect   = 5
 
+#Pre-flight check of the wall and caps before meshing (watertight, manifold, self-intersections, predicted elements)
+#'rescale': scale the size map when more than max_elements are predicted, 'reject': skip the case, None: no check
+preflight = 'rescale'
+
+#Search of the narrowest cross-section for the cut
+#None: trace the centerline in steps of 1 mm
+#dict(step=5, evaluations=8): sample the area every step mm and refine with a number of evaluations (coarse-to-fine),
+#faster but the cut can move: with a narrowing after the aortic root it is within about 2 mm of the 1 mm trace, without
+#one it is placed at the start of the decrease of the area, which depends more on the step (within 3 mm for step=5 on
+#test geometries)
+cut_search = None
+#Maximum Hausdorff distance (mm) of the decimated wall on which the centerline is traced, None: trace on the wall itself
+#Building the proxy costs more than it saves on the first run of a geometry, it only pays off for large walls that are
+#cut again (e.g. 0.1 with retries from the cut stage or parameter studies, the proxy is cached)
+cut_proxy_error = None
+
 #Angle for identification of surfaces
 id_angle = 35
 
@@ -107,315 +127,118 @@ intp_options = {
     'kernel': 'linear',         # RBF interpolation kernel (linear is recommended)
     'smoothing': 0.5,           # interpolation smoothing, range recommended [0, 2]
     'degree': 0,                # degree of polynomial added to the RBF interpolation matrix
+    'neighbors': None,          # None: global RBF, k: local RBF per point on its k nearest neighbours (fine inlets)
     'hard_noslip': False}       # check if no-slip condition on walls is met
 
 #Plotting boolean, when True: code generates intermediate plots of workflow
 show_plot = True
 
-#--------------------------------------------------------------------------------------------------------------------------
-# End of setup
-#--------------------------------------------------------------------------------------------------------------------------
-
-#Create file environment before looping
-#Get directory of main_workflow file
-file_dir = osp.dirname(osp.realpath(__file__))  
-
-#Ask user input, velocity profile and output directory. If output directory is not given it creates an output directory in file_dir
-input_dir = askdirectory(title='Select Folder Containing Geometries') # shows dialog box and return the path 
-vel_profile_dir = askdirectory(title='Select Velocity Profile Folder') # shows dialog box and return the path
-output_dir = askdirectory(title='Select Output Folder')
-
-if output_dir == '':
-    output_dir = osp.join(file_dir, r'output')
-    os.makedirs(output_dir, exist_ok=True)
+#Number of geometries that are preprocessed at the same time (each in its own process and temporary directory)
+#With n_workers > 1 plotting is disabled and the output of every case is written to log/log_<case>.txt
+n_workers = 1
 
-#Create a temporary directory
-temp_dir = osp.join(file_dir, r'temp')
-os.makedirs(temp_dir, exist_ok=True)
+#Cache of intermediate results (cut wall, caps, surface and volume meshes, mapped profiles) in the cache folder
+#Stages are skipped when their input geometry and parameters did not change since an earlier run
+use_cache = True
+cache_max_size = 20e9       #Maximum size of the cache in bytes, least recently used results are removed first
+cache_max_age = 30          #Results that have not been used for this number of days are removed
 
-#Create log directory with a directory inside for the reports of bad quality meshes
-log_dir = osp.join(file_dir, r'log')
-os.makedirs(log_dir, exist_ok=True)
-
-os.makedirs(osp.join(log_dir, r'failed'), exist_ok=True)
-
-#Select input folder names and count the amount of input geometries
-input_list = os.listdir(input_dir)
-n_geometries = len(input_list)
-
-print('Setup done')
-
-#-----------------------------------------Start automatic meshing workflow-------------------------------------------------
+#Run ledger (log/ledger.sqlite) with the status, timings and quality metrics of every case and stage
+#With resume = True, cases that are done with the same settings according to the ledger are skipped when the workflow
+#is started again
+use_ledger = True
+resume = True
 
 #--------------------------------------------------------------------------------------------------------------------------
-# Environment creation
+# End of setup
 #--------------------------------------------------------------------------------------------------------------------------
 
-i = 0
-retry = 0
-runtimes = []
-while i <= (n_geometries - 1):    #Creates an output folder for specific case, based on the input folder name
-    try:   
-        start = time.time()
-        input_folder = osp.join(input_dir, input_list[i])
-        output_name = f'0{i}_Result_{input_list[i]}'
-        output_folder = osp.join(output_dir, output_name)
-
-        #Grab the path of the geometry files
-        inlet_path = osp.join(input_folder, osp.join(r'meshes', r'inlet.stl'))
-        wall_path = osp.join(input_folder, osp.join(r'meshes', r'wall.stl'))
-        outlet_path = osp.join(input_folder, osp.join(r'meshes', r'outlet.stl'))
-
-        print('Created necessary files and directories')
-
-        #Reading the files with pyvista
-        inlet = pv.read(inlet_path)
-        if retry > 0:
-            remesh.remesh(wall_path, temp_dir, mmg_parameters, show_plot)
-            wall = pv.read(osp.join(temp_dir, r'wall_remeshed.vtk'))
-            wall = wall.extract_surface().triangulate()
-        else:
-            wall = pv.read(wall_path)
-        outlet = pv.read(outlet_path)
-
-        print('import of geometry done')
-
-        #--------------------------------------------------------------------------------------------------------------------------
-        # 3D-meshing algorithm
-        #--------------------------------------------------------------------------------------------------------------------------
-
-        #Cut the wall geometry after the aortic root
-        wall_cut, inlet_new_center = cutting.main_cutter(inlet, wall, plot=show_plot)
-        pv.save_meshio(osp.join(temp_dir, r'wall_cut.mesh'), wall_cut)
-
-        #Create caps
-        inlet_cap, outlet_cap = cap(wall_cut, inlet_new_center, outlet.points.mean(0), plot=show_plot)
-        pv.save_meshio(osp.join(temp_dir, r'inlet_cap.mesh'), inlet_cap)
-        pv.save_meshio(osp.join(temp_dir, r'outlet_cap.mesh'), outlet_cap)
-
-        #Combine cutted wall and inlet/outlet caps
-        combined = (wall_cut + inlet_cap + outlet_cap).clean()
-        combined.clear_data()
-        print('Meshes succesfully combined')
-
-        #Plot result of mesh combining.
-        if show_plot:
-            plt = pv.Plotter()
-            plt.add_mesh(combined, style='wireframe')
-            plt.add_text('Wall and caps')
-            edgetest = combined.extract_feature_edges(boundary_edges=True, non_manifold_edges=True, manifold_edges=False, feature_edges=False)
-            plt.show()
-
-        pv.save_meshio(osp.join(temp_dir, r'combined_mesh.mesh'), combined)
-
-
-        #Run remesh (takes predetermined internally defined file path as input, DON'T CHANGE)
-        combined_remeshed = remesh.remesh_edge_detect(osp.join(temp_dir, r'combined_mesh.mesh'), osp.join(temp_dir, r'combined_mmg.mesh'), temp_dir, mmg_parameters, plot=show_plot)
-        
-        #triangulation step to make sure Tetgen only gets triangles as input
-        combined_remeshed = combined_remeshed.extract_surface().triangulate()
-
-        #Report quality
-        report_text_2D = quality_control.meshreport(combined_remeshed, 'Surface mesh quality report')[1]
-
-        #Check mesh validity
-        if not combined_remeshed.is_manifold:
-            if retry < max_retry:
-                print('Non-manifold surface due to initial geometry error, perform retry')
-                retry += 1
-            else: 
-                print('Terminating, unable to create 3D mesh')
-                print('See log files for quality rapport')
-                log_folder = osp.join(file_dir, r'log\failed')
-                ut.save_string_to_file(report_text_2D, osp.join(log_folder, f'Qualityreport_failed_geometry_{input_list[i]}'))
-                i += 1
-                retry = 0
-            continue
-
-        #Make an initial 3D mesh from the combined mesh using TetGen
-        combined_remeshed = combined_remeshed
-        try:
-            tetmesh = volume_mesh.tetgen(combined_remeshed, tetgen_parameters, plot=show_plot)
-        except:
-            retry += 1
-            if retry > max_retry:
-                print('Terminating, unable to create 3D mesh')
-                print('See log files for quality rapport')
-                log_folder = osp.join(file_dir, r'log\failed')
-                ut.save_string_to_file(report_text_2D, osp.join(log_folder, f'Qualityreport_failed_geometry_{input_list[i]}'))
-                i += 1
-                retry = 0
-                continue
-            print('Non-manifold surface due to initial geometry error or other tetgen error, perform retry')
-            continue
-
-        #Plot bisection
-        if show_plot:
-            quality_control.clip_plot(tetmesh, 'Initial 3D mesh')
-
-        #Report quality
-        quality_control.meshreport(tetmesh, 'Initial 3D mesh quality report')
-
-        #Create a .sol file for mmg3d
-        volume_mesh.write_sol(tetmesh, wall_cut, mmg3d_sol_parameters, osp.join(temp_dir, r'initial_volume_mesh.sol'), plot=show_plot)
-
-        #Save initial mesh
-        tetmesh.point_data.clear()
-        tetmesh.cell_data.clear()
-        pv.save_meshio(osp.join(temp_dir, r'initial_volume_mesh.mesh'), tetmesh)
-
-        #Refine 3D mesh with mmg3d
-        tetmesh = volume_mesh.mmg3d(osp.join(temp_dir, r'initial_volume_mesh.mesh'), osp.join(temp_dir, r'mmg3d_mesh.mesh'), temp_dir, mmg3d_parameters, plot=show_plot)
-
-        #Report quality
-        report, report_text = quality_control.meshreport(tetmesh, f'Refined 3D mesh quality report {input_list[i]}')
-
-        #Plot bad cells
-        jac = report['jac']
-        if show_plot:
-            jac = report['jac']
-            if np.any(jac<0.3):
-                plt = pv.Plotter()
-                plt.add_mesh(tetmesh, style='wireframe')
-                plt.add_mesh(tetmesh.extract_cells(jac<0.3), color='red', show_edges=True)
-                plt.add_text('Bad cells')
-                plt.show()
-            else: print('No bad cells')
-
-        #Plot bisection
-        if show_plot:
-            quality_control.clip_plot(tetmesh, 'Final 3D mesh clipped view')
-
-        #Save 3D mesh
-        tetmesh.save(osp.join(temp_dir, r'3D_output_mesh.vtk'))
-
-        #Run qualification
-        numcells = report['cells']
-        aspect = report['aspect']
-        if numcells > max_elements or any(aspect > max_aspect) or any(jac < min_jacobian): run = False
-        else: run=True
-
-        #Plot 3D_mesh
-        if show_plot:
-            if run:text='Final 3D mesh'
-            else:text='Final 3D mesh - insufficient quality or too many nodes'
-            tetmesh.plot(show_edges = True, text=text)
-
-        #Write a log file of the mesh quality and continue to next geometry if quality is not sufficient.
-        if run==False and retry < max_retry:
-            print('Mesh quality insufficient, starting new meshing attempt')
-            retry += 1
-            continue
-        elif run==False and retry >= max_retry:
-            print('Terminating, 3D mesh insufficient quality or too many nodes')
-            print('See log files for quality rapport')
-            log_folder = osp.join(file_dir, r'log\failed')
-            ut.save_string_to_file(report_text, osp.join(log_folder, f'Qualityreport_failed_geometry_{input_list[i]}'))
-            i += 1
-            retry = 0
-            continue
-        else:
-            print('Quality is sufficient')
-            log_folder = osp.join(file_dir, r'log')
-            ut.save_string_to_file(report_text, osp.join(log_folder, f'Qualityreport_geometry_{input_list[i]}'))
-            retry = 0
-
-
-        #----------------------------------------------------------------------------------------------------------------------------
-        # Identification
-        #----------------------------------------------------------------------------------------------------------------------------
-
-        #Create the seeds for the surface identification based on the center points. INLET FIRST!, OUTLET SECOND!
-        seeds = np.array([inlet_cap.points.mean(0),outlet_cap.points.mean(0)])
-
-        #Detect the surfaces of the 3D mesh whilst keeping the original ID's, if there is a seed delivered
-        if len(seeds) > 0:
-            surface_identification = id.identify_surfaces(tetmesh, id_angle, seeds, show_plot)
-
-        #Check if three surfaces are id'ed
-        num_surfaces = len(surface_identification)
-        if num_surfaces != 3:
-            reportstring = f'Incorrect number of surfaces found ({num_surfaces}) , skipped geometry'
-            print(reportstring)
-            print('See log files for error')
-            log_folder = osp.join(file_dir, r'log\failed')
-            ut.save_string_to_file(reportstring, osp.join(log_folder, f'Logreport_failed_geometry_{input_list[i]}'))
-            i += 1
-            retry = 0
-            continue
-
-        #Seperate the indentified surfaces in inlet/outlet/wall
-        id_inlet = surface_identification[0]
-        id_outlet = surface_identification[1]
-        id_wall = surface_identification[2]
-
-        print('Surface identification done')
-        #Plot the identified surfaces for general overview
-        if show_plot:
-            plt = pv.Plotter()
-            plt.add_mesh(id_inlet, color = 'red', label = 'Inlet')
-            plt.add_mesh(id_outlet, color = 'blue', label = 'Outlet')
-            plt.add_mesh(id_wall, color = 'green', label = 'Wall')
-            plt.add_legend()
-            plt.add_text('Identified surfaces')
-            plt.show()
-
-        #At this point meshing is succesfull and output files are written, geometry specific output folder is created.
-        os.makedirs(output_folder, exist_ok=True)
-        #----------------------------------------------------------------------------------------------------------------------------
-        # Mapping
-        #----------------------------------------------------------------------------------------------------------------------------
-
-        #Perform the mapping of the velocity profiles on the inlet
-        #Output is a point cloud on every inlet node with the respective velocity data and the amount of mapped velocity profiles
-
-        velocity_mapped, n_maps = mapping.vel_mapping(vel_profile_dir, id_inlet, output_folder, intp_options, show_plot)
-        #----------------------------------------------------------------------------------------------------------------------------
-        # FEBio Creation
-        #----------------------------------------------------------------------------------------------------------------------------
-
-        #Create a solver compatible file based on the 3D-mesh and meshing parameters
-        feb.xml_creator(tetmesh, id_inlet, id_outlet, id_wall, velocity_mapped, file_dir, output_folder, FEBio_parameters)
-
-        #Add preprocessing runtime to runtime array
-        runtimes.append(time.time()-start)
-        print('Preprocessing took:', runtimes[-1], 's')
-        i += 1
-
-
-    except Exception as e:
-        if "ERROR:root:Unsupported data type: vtktypeint32" in str(e):         #python gives an error here but it doesnt matter
-            print("Ignoring unsupported data type error.")
-        else:
-            print('an error has occured:')                           #all the other errors
-            print(e)
-            log_folder = osp.join(file_dir, r'log\failed')
-            ut.save_string_to_file('an unknown error has occured. Check if directories and input are set up correctly', osp.join(log_folder, f'unknown_error_{input_list[i]}'))
-            i += 1
-            continue
-
-print('Preprocessing per case took [s]:')
-print(runtimes)
-#-----------------------------------------Start automatic simulation workflow-------------------------------------------------
-#Deletes the temporary folder (might want to modify it to only delete the files)
-shutil.rmtree(temp_dir)
-#----------------------------------------------------------------------------------------------------------------------------
-# FEBio Run
-#----------------------------------------------------------------------------------------------------------------------------
-
-#Grab the names of the output folders
-output_list = os.listdir(output_dir)
-
-#Run for every geometry a simulation
-for sim in sorted(output_list):
-    try:
-        #Run FEBio
-        sim_folder = osp.join(output_dir, sim)
-        #Use the current
-        FEBio_inputfile = osp.join(sim_folder, r'simulation.feb')
-        subprocess.run([FEBio_path, FEBio_inputfile], check = True)
-    except:
-        continue
-
-print('Done!')
-
+#Workers of the batch import this file again, only the process that is started by the user runs the workflow
+if __name__ == '__main__':
+    #Create file environment before looping
+    #Get directory of main_workflow file
+    file_dir = osp.dirname(osp.realpath(__file__))  
+
+    #Ask user input, velocity profile and output directory. If output directory is not given it creates an output directory in file_dir
+    input_dir = askdirectory(title='Select Folder Containing Geometries') # shows dialog box and return the path 
+    vel_profile_dir = askdirectory(title='Select Velocity Profile Folder') # shows dialog box and return the path
+    output_dir = askdirectory(title='Select Output Folder')
+
+    if output_dir == '':
+        output_dir = osp.join(file_dir, r'output')
+        os.makedirs(output_dir, exist_ok=True)
+
+    #Create a temporary directory
+    temp_dir = osp.join(file_dir, r'temp')
+    os.makedirs(temp_dir, exist_ok=True)
+
+    #Create log directory with a directory inside for the reports of bad quality meshes
+    log_dir = osp.join(file_dir, r'log')
+    os.makedirs(log_dir, exist_ok=True)
+
+    os.makedirs(osp.join(log_dir, r'failed'), exist_ok=True)
+
+    #Select input folder names and count the amount of input geometries
+    input_list = os.listdir(input_dir)
+    n_geometries = len(input_list)
+
+    #Create the cache directory
+    cache_dir = osp.join(file_dir, r'cache') if use_cache else None
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    #Collect the setup parameters, these are passed to every case
+    settings = dict(
+        FEBio_parameters = FEBio_parameters,
+        mmg_parameters = mmg_parameters,
+        mmg3d_parameters = mmg3d_parameters,
+        mmg3d_sol_parameters = mmg3d_sol_parameters,
+        tetgen_parameters = tetgen_parameters,
+        volume_meshing = volume_meshing,
+        calibration = calibration,
+        mmg_limits = mmg_limits,
+        intp_options = intp_options,
+        max_retry = max_retry,
+        max_elements = max_elements,
+        min_jacobian = min_jacobian,
+        max_aspect = max_aspect,
+        preflight = preflight,
+        cut_search = cut_search,
+        cut_proxy_error = cut_proxy_error,
+        id_angle = id_angle,
+        show_plot = show_plot,
+        cache_dir = cache_dir,
+        ledger_path = osp.join(log_dir, r'ledger.sqlite') if use_ledger else None)
+
+    print('Setup done')
+
+    #-----------------------------------------Start automatic meshing workflow-------------------------------------------------
+
+    #Preprocess every geometry, every case creates its own output folder based on the input folder name
+    results = batch.run_batch(input_dir, input_list, vel_profile_dir, output_dir, temp_dir, log_dir, file_dir, settings, n_workers, resume)
+    runtimes = [result['runtime'] for result in results if result['status'] == 'done']
+
+    print('Preprocessing per case took [s]:')
+    print(runtimes)
+    skipped = [result['case'] for result in results if result['status'] == 'skipped']
+    if skipped:
+        print(f'{len(skipped)} geometries were skipped, done in an earlier run:', skipped)
+    failed = [result['case'] for result in results if result['status'] not in ('done', 'skipped')]
+    if failed:
+        print(f'{len(failed)} of {n_geometries} geometries failed, see log files:', failed)
+    #-----------------------------------------Start automatic simulation workflow-------------------------------------------------
+    #Deletes the temporary folder (might want to modify it to only delete the files), intermediate results stay in the cache
+    shutil.rmtree(temp_dir)
+    cache.evict(cache_dir, cache_max_size, cache_max_age)
+    #----------------------------------------------------------------------------------------------------------------------------
+    # FEBio Run
+    #----------------------------------------------------------------------------------------------------------------------------
+
+    #Run a simulation for every geometry, several at a time within the core budget
+    #Cases that finished in an earlier run with the same simulation.feb are skipped, see simulation_status.json in the case folders
+    statuses = simulation.run_simulations(FEBio_path, output_dir, FEBio_cores, FEBio_threads, FEBio_rerun)
+    failed = [status['case'] for status in statuses if status['status'] != 'done']
+    if failed:
+        print(f'{len(failed)} simulations failed, see febio_output.txt in the case folders:', failed)
+
+    print('Done!')
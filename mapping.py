@@ -3,8 +3,15 @@ import os
 import os.path as osp 
 import numpy as np 
 from glob import glob 
+from concurrent.futures import ThreadPoolExecutor
 import pyvista as pv   
+import re
+import hashlib
 import utils as ut   
+import profiling
+import cache
+import rbf
+import profile_store
 
 """
 Initial parameters for the software (slightly tweaked already)
@@ -29,65 +36,116 @@ Initial parameters for the software (slightly tweaked already)
 #NOTE: .vtp files are Paraview file formats
 #NOTE: This code based on the code from 'Data-driven generation of 4D velocity profiles in the aneurysmal ascending aorta' Saitta et al.
 
+#Geometry dependent part of the mapping, can be reused for every set of velocity profiles mapped on the same inlet
+def target_operator(target_plane, intp_options, cache_dir=None):
+    '''
+    Prepares the target side of the mapping: the centred cell centers of the inlet and their normalization, the
+    orientation of the inlet, the triangulation of the output plane and the factorized RBF system (see rbf.py).
+    The result is stored in the cache under a hash of the cell centers and intp_options, so mapping other velocity
+    profiles on the same inlet skips all of this
+    :arg1 target_plane: pyvista mesh of the inlet
+    :arg2 intp_options: dict with the interpolation options
+    :opt arg3 cache_dir: path to the cache directory, default is None (no caching)
+
+    returns dict with the target points (centred), their center, maximum norm, leftmost index and normal, the faces
+    of the output plane and the RBF factorization (lu, piv, n, smoothing; None in the local mode)
+    '''
+    target_plane = target_plane.extract_surface()
+    target_pts = target_plane.cell_centers(vertex = False).points
+    key = cache.stage_key('mapping_operator', hashlib.sha256(np.ascontiguousarray(target_pts).tobytes()).hexdigest(), intp_options)
+    entry = cache.load(cache_dir, key)
+    if entry is not None:
+        print('Mapping operator loaded from cache')
+        return entry
+
+    with profiling.stage('mapping_operator') as record:
+        #Index of the point that is most negative on the y-plane, center and normal of the target
+        leftmost_idx_on_target = int(np.argmin(target_pts[:, 1]))
+        target_com = target_pts.mean(0)
+        target_normal = target_plane.compute_normals()['Normals'].mean(0)
+
+        #Centre at the origin and the maximum distance to it (normalization of the source points)
+        target_pts = target_pts - target_com
+        targetmax = float(np.max(np.sqrt(np.sum(target_pts ** 2, axis=1))))
+
+        #Triangulation of the output plane, the same for every frame
+        faces = pv.PolyData(target_pts).delaunay_2d().regular_faces
+
+        operator = dict(target_pts=target_pts, target_com=target_com, targetmax=targetmax,
+                        leftmost_idx=leftmost_idx_on_target, target_normal=target_normal, faces=faces)
+        if not intp_options.get('neighbors'):
+            operator.update(rbf.factorize(target_pts, kernel=intp_options['kernel'], smoothing=intp_options['smoothing'],
+                                          epsilon=1, degree=intp_options['degree']))
+        record['points'] = len(target_pts)
+
+    cache.store(cache_dir, key, operator)
+    return operator
+
 #Mapping function that stores the profiles in the output folder and returns the mappend Polydata as well as the velocities
-def vel_mapping(source_profile_dir, target_plane, outputDir, intp_options, plot=False):
+def vel_mapping(source_profile_dir, target_plane, outputDir, intp_options, plot=False, cache_dir=None, n_threads=None, period=None):
+    '''
+    Maps the source velocity profiles on the cell centers of the target plane and saves them with save_profiles
+    (period is the cycle duration of the time axis, see save_profiles). The frames are aligned and interpolated on a
+    pool of n_threads threads (default as ThreadPoolExecutor)
+    '''
 
     ## Options
-    saveName = 'Mapped_velocity_profile'     # filename of mapped .vtp files
     flip_normals = False                      # usually set to True, but might have to change depending on target plane orientation (how to check this?)
-    vel_outputDir = osp.join(outputDir, r'Mapped_Velocity_Profiles')
 
     print('Start velocity profile mapping')
 
     ## Read data
-    #Loads the source profiles and calculates points and COM
-    source_profiles = [pv.read(i) for i in sorted(glob(osp.join(source_profile_dir, '*.vtp')))]
+    #Loads the source profiles from the compiled store (see profile_store.py) and calculates points and COM
+    source_profiles = profile_store.frames(profile_store.open_store(source_profile_dir, cache_dir))
     num_frames = len(source_profiles)
-    source_pts = [source_profiles[k].points for k in range(num_frames)] 
-    source_coms = [source_pts[k].mean(0) for k in range(num_frames)]
+    source_coms = [source_profiles[k]['points'].mean(0) for k in range(num_frames)]
 
-    #Calculate the target cell_centers and COM. Extract the index of the points that is most negative on the y-plane
+    #Target cell_centers centred at the origin, their COM, normalization, leftmost point (most negative in y direction)
+    #and normal, the triangulation of the output and the RBF factorization (cached per inlet and intp_options)
+    operator = target_operator(target_plane, intp_options, cache_dir)
     target_plane = target_plane.extract_surface()
-    target_pts = target_plane.cell_centers(vertex = False).points
-    leftmost_idx_on_target = min(range(len(target_pts[: ,0])), key = target_pts[: ,1].__getitem__) # index of the leftmost point (most negative in y direction) in the target plane w.r.t the subject
-    target_com = target_pts.mean(0)
-    
+    target_pts = operator['target_pts']
+    target_com = operator['target_com']
+    targetmax = operator['targetmax']
+    leftmost_idx_on_target = operator['leftmost_idx']
+    target_normal = operator['target_normal']
 
     #Calculate the normals and flip if necessary (flip_normals is defined in the function as it is a veriable crucial for correct operation)
-    target_normal = target_plane.compute_normals()['Normals'].mean(0)
-    normals = [source_profiles[k].compute_normals()['Normals'].mean(0) for k in range(num_frames)]
+    normals = [source_profiles[k]['normal'] for k in range(num_frames)]
     if flip_normals: normals = [normals[k] * -1 for k in range(num_frames)] #Flips the normals if flip_normals is true
 
-    ## Align source to target
-
-    # center at origin for simplicity (centers everything at their respective origins)
-    target_pts -= target_com
-    source_pts = [source_pts[k] - source_coms[k] for k in range(num_frames)]
+    ## Align source to target, every frame on a thread of the pool (NumPy releases the GIL in the heavy kernels)
+    def align(k):
+        # center at origin for simplicity (centers everything at their respective origins)
+        source_pts = source_profiles[k]['points'] - source_coms[k]
 
-    # normalize w.r.t. max coordinate norm
-    targetmax = np.max(np.sqrt(np.sum(target_pts ** 2, axis=1))) #Euclidian norm to calculate the maximum distance to the origin
-    pts = [source_pts[k] * targetmax for k in range(num_frames)] #Normalises the points with respect to the maximum distance to the target origin
+        # normalize w.r.t. max coordinate norm (targetmax)
+        pts = source_pts * targetmax #Normalises the points with respect to the maximum distance to the target origin
 
+        # rotate to align normals
+        Rot = ut.rotation_matrix_from_vectors(normals[k], target_normal)
+        pts = Rot.dot(pts.T).T                                   #rotates source points to target
+        vel = Rot.dot(source_profiles[k]['velocity'].T).T        #rotates velocity vectors to target
 
-    # rotate to align normals
-    Rots = [ut.rotation_matrix_from_vectors(normals[k], target_normal) for k in range(num_frames)] 
-    pts = [Rots[k].dot(pts[k].T).T for k in range(num_frames)]                         #rotates source points to target
-    vel = [Rots[k].dot(source_profiles[k]['Velocity'].T).T for k in range(num_frames)] #rotates velocity vectors to target
+        # second rotation to ensure consistent in-plane alignment
+        lm_id = np.argmax(source_pts[:, 0]) #Grabs the index of the point that is the furthest away (as stuff is now in plane this represents the angle on which source and target are rotated)
+        Rot_final = ut.rotation_matrix_from_vectors(pts[lm_id, :], target_pts[leftmost_idx_on_target, :]) #Calculates the second (final) rotation matrix for in plane rotation
+        pts = Rot_final.dot(pts.T).T #Does the final rotation of points
+        vel = Rot_final.dot(vel.T).T #Does the final rotation of velocity
 
-    # second rotation to ensure consistent in-plane alignment
-    lm_ids = [np.argmax(source_pts[k][:, 0]) for k in range(num_frames)] #Grabs the indeces of the points that are the furthest away (as stuff is now in plane this represents the angle on which source and target are rotated)
-    Rots_final = [ut.rotation_matrix_from_vectors(pts[k][lm_ids[k], :], target_pts[leftmost_idx_on_target, :]) for k in range(num_frames)] #Calculates the second (final) rotation matrix for in plane rotation
-    pts = [Rots_final[k].dot(pts[k].T).T for k in range(num_frames)] #Does the final rotation of points
-    vel = [Rots_final[k].dot(vel[k].T).T for k in range(num_frames)] #Does the final rotation of velocity
+        # create new polydata with the faces of the source profile and inserts the rotated points/velocity
+        aligned_plane = pv.PolyData(pts, np.asarray(source_profiles[k]['faces']))
+        aligned_plane['Velocity'] = vel
+        return aligned_plane
 
-    # create new polydatas and inserts the rotated points/velocity
-    aligned_planes = [source_profiles[k].copy() for k in range(num_frames)] #Creates new same shaped profiles from the source profiles
-    for k in range(num_frames): 
-        aligned_planes[k].points = pts[k]
-        aligned_planes[k]['Velocity'] = vel[k]
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        aligned_planes = list(pool.map(align, range(num_frames)))
 
     # spatial interpolation 
-    interp_planes = ut.interpolate_profiles(aligned_planes, target_pts, intp_options)
+    with profiling.stage('interpolate_profiles') as record:
+        interp_planes = ut.interpolate_profiles(aligned_planes, target_pts, intp_options, operator, n_threads)
+        record['frames'] = num_frames
+        record['points'] = num_frames * len(target_pts)
 
     # recenters the velocity profiles at the target profile origin for further modifications
     for k in range(num_frames):
@@ -96,20 +154,19 @@ def vel_mapping(source_profile_dir, target_plane, outputDir, intp_options, plot=
     #Currently unused but returns an array for each flow profile containing the 3D velocities
     vel_final = [interp_planes[k]['Velocity'] for k in range(num_frames)]
 
-    ## Save profiles to .vtp (may be removed from final)
-    os.makedirs(vel_outputDir, exist_ok=True) #Makes the output directory according to the path. If this one already exists there is no error raised.
-    for k in range(num_frames):
-        interp_planes[k].save(osp.join(vel_outputDir, saveName + '_{:02d}.vtp'.format(k)))
+    ## Save profiles, all frames on the triangulation of the operator in a single .vtp (may be removed from final)
+    save_profiles(target_plane, vel_final, outputDir, operator['faces'], period)
 
     print('Velocity profile mapping done')
 
 
     #Plotting the mapped velocity profiles
     if plot:
+        profile_names = sorted(osp.basename(path) for path in glob(osp.join(source_profile_dir, '*.vtp')))
         n = 0
         for i in interp_planes:
             i = i.extract_surface()
-            source_profiles[n].plot(text='Source profile')
+            pv.read(osp.join(source_profile_dir, profile_names[n])).plot(text='Source profile')
             if True:
                 plt = pv.Plotter()
                 plt.add_mesh(target_plane, show_edges = True, color = 'black')
@@ -122,6 +179,60 @@ def vel_mapping(source_profile_dir, target_plane, outputDir, intp_options, plot=
 
     return vel_final, num_frames
 
+#Name of the file with the mapped velocity profiles in <outputDir>/Mapped_Velocity_Profiles
+SAVE_NAME = 'Mapped_velocity_profiles.vtp'
+
+#Saves mapped velocities (from vel_mapping or e.g. loaded from the cache), all frames on a single triangulation
+def save_profiles(target_plane, vel_final, outputDir, faces=None, period=None):
+    '''
+    Writes mapped velocity profiles to outputDir/Mapped_Velocity_Profiles/Mapped_velocity_profiles.vtp, a single
+    triangulation of the cell centers of the inlet with the velocity of frame k as point array 'Velocity_<k>'
+    :arg1 target_plane: pyvista mesh of the inlet the velocities are mapped on (one velocity per cell)
+    :arg2 vel_final: list or array with the velocity array (cells x 3) of every frame
+    :arg3 outputDir: path to the output folder of the case
+    :opt arg4 faces: triangles of the cell centers (see mapping.target_operator), default is None (Delaunay triangulation)
+    :opt arg5 period: duration of the cycle, the start time of every frame is stored as field data 'time'. Default is
+    None (no time axis)
+    '''
+    vel_outputDir = osp.join(outputDir, r'Mapped_Velocity_Profiles')
+    os.makedirs(vel_outputDir, exist_ok=True) #Makes the output directory according to the path. If this one already exists there is no error raised.
+
+    target_pts = target_plane.extract_surface().cell_centers(vertex = False).points
+    if faces is None:
+        plane = pv.PolyData(target_pts).delaunay_2d()
+    else:
+        plane = pv.PolyData.from_regular_faces(target_pts, faces)
+    for k in range(len(vel_final)):
+        plane.point_data['Velocity_{:02d}'.format(k)] = vel_final[k]
+    if period is not None:
+        plane.field_data['time'] = period * np.arange(len(vel_final)) / len(vel_final)
+    plane.save(osp.join(vel_outputDir, SAVE_NAME))
+    return
+
+#Loads the velocities written by vel_mapping or save_profiles
+def load_profiles(outputDir):
+    '''
+    Reads the mapped velocity profiles from outputDir/Mapped_Velocity_Profiles. Output folders of older versions with
+    a .vtp file per frame (Mapped_velocity_profile_<k>.vtp) are read as well
+    :arg1 outputDir: path to the output folder of the case
+
+    returns list with the velocity array (cells x 3) of every frame
+    '''
+    path = osp.join(outputDir, r'Mapped_Velocity_Profiles', SAVE_NAME)
+    if osp.exists(path):
+        plane = pv.read(path)
+        names = [name for name in plane.point_data.keys() if name.startswith('Velocity_')]
+        return [plane.point_data[name] for name in sorted(names, key=frame_number)]
+    paths = glob(osp.join(outputDir, r'Mapped_Velocity_Profiles', 'Mapped_velocity_profile_*.vtp'))
+    return [pv.read(path)['Velocity'] for path in sorted(paths, key=frame_number)]
+
+def frame_number(name):
+    '''
+    returns the frame number at the end of an array or file name (e.g. 'Velocity_07' or 'Mapped_velocity_profile_12.vtp'),
+    frames are ordered by it instead of by name, 'Velocity_100' sorts before 'Velocity_11' as text
+    '''
+    return int(re.search(r'(\d+)(\.vtp)?$', name).group(1))
+
 #velocity_map, n_maps, source_profiles = vel_mapping(r'C:\Users\lmorr\Documents\TU\23-24\BEP\Velocity_profiles', pv.read('test_inlet.vtk'), r'C:\Users\lmorr\Documents\TU\23-24\BEP\Git_repository\Aortic_CFD_workflow-3', intp_options)
 
 
@@ -0,0 +1,214 @@
+#import modules
+import numpy as np
+import pyvista as pv
+
+"""
+Exchange of meshes with mmg in the (binary) Medit format, without intermediate files in other formats.
+Meshes are converted between pyvista and a dict with numpy arrays in memory (from_pyvista / to_pyvista), and
+written and read as .meshb/.solb files (write_mesh, read_mesh, write_sol, read_sol).
+
+Binary Medit files start with the integer 1 (to detect the byte order) and the version of the file. Version 1
+stores reals as float32, version 2 as float64, version 3 also uses 64 bit file positions and version 4 uses 64 bit
+integers everywhere. The header is followed by keywords (e.g. Vertices), each stored as its code, the position of
+the next keyword in the file, the number of lines and the lines. Keywords that are not known here (e.g. Ridges,
+Corners or Normals written by mmg) are skipped using the position of the next keyword.
+Indices of vertices start at 1 in the file and at 0 in the dicts of this module.
+"""
+
+#Keyword codes of the Medit format
+DIMENSION = 3
+VERTICES = 4
+EDGES = 5
+TRIANGLES = 6
+TETRAHEDRA = 8
+END = 54
+SOL_AT_VERTICES = 62
+
+#Element keywords: name in the mesh dict, keyword code, number of vertices, vtk cell type
+ELEMENTS = [('edges', EDGES, 2, pv.CellType.LINE),
+            ('triangles', TRIANGLES, 3, pv.CellType.TRIANGLE),
+            ('tetrahedra', TETRAHEDRA, 4, pv.CellType.TETRA)]
+
+def formats(version, byteorder='<'):
+    '''
+    returns the numpy types of reals, integers and file positions of a Medit file version
+    '''
+    real = 'f4' if version == 1 else 'f8'
+    integer = 'i8' if version >= 4 else 'i4'
+    position = 'i8' if version >= 3 else 'i4'
+    return np.dtype(byteorder + real), np.dtype(byteorder + integer), np.dtype(byteorder + position)
+
+def from_pyvista(mesh):
+    '''
+    Converts a pyvista mesh to a Medit mesh dict. Other surface cells (e.g. the quads of a cut wall) are split in
+    triangles, only lines, triangles and tetrahedra are kept. A cell array 'ref' is used as Medit reference of the
+    cells (0 otherwise)
+    :arg1 mesh: pyvista PolyData or UnstructuredGrid
+
+    returns dict with the points and the elements ('edges', 'triangles', 'tetrahedra') as index arrays, and the
+    references of the points and elements in dict 'refs'
+    '''
+    grid = mesh if isinstance(mesh, pv.UnstructuredGrid) else mesh.cast_to_unstructured_grid()
+    if np.any(np.isin(grid.celltypes, [pv.CellType.QUAD, pv.CellType.POLYGON, pv.CellType.PIXEL, pv.CellType.TRIANGLE_STRIP])):
+        grid = grid.triangulate()
+    cell_refs = grid.cell_data['ref'] if 'ref' in grid.cell_data else np.zeros(grid.n_cells, dtype=int)
+    point_refs = grid.point_data['ref'] if 'ref' in grid.point_data else np.zeros(grid.n_points, dtype=int)
+
+    medit = dict(points=np.asarray(grid.points, dtype=float), refs=dict(vertices=np.asarray(point_refs)))
+    celltypes = grid.celltypes
+    for name, code, size, celltype in ELEMENTS:
+        mask = celltypes == celltype
+        if np.any(mask):
+            medit[name] = grid.cells_dict[celltype]
+            medit['refs'][name] = np.asarray(cell_refs)[mask]
+    return medit
+
+def to_pyvista(medit, element='tetrahedra'):
+    '''
+    Converts a Medit mesh dict to pyvista. The references are stored as point and cell array 'ref'
+    :arg1 medit: Medit mesh dict (see from_pyvista)
+    :opt arg2 element: elements that form the mesh, 'tetrahedra' (UnstructuredGrid) or 'triangles' (PolyData)
+
+    returns pyvista UnstructuredGrid or PolyData
+    '''
+    points = medit['points']
+    cells = medit[element]
+    if element == 'triangles':
+        mesh = pv.PolyData.from_regular_faces(points, cells)
+    else:
+        mesh = pv.UnstructuredGrid({pv.CellType.TETRA: cells}, points)
+    mesh.point_data['ref'] = medit['refs']['vertices']
+    mesh.cell_data['ref'] = medit['refs'][element]
+    return mesh
+
+def write_block(file, code, block, position_type, count=None, integer_type=None):
+    '''
+    Writes a keyword with the position of the next keyword, its number of lines (if given) and the data
+    '''
+    header_size = 4 + position_type.itemsize + (integer_type.itemsize if count is not None else 0)
+    next_position = file.tell() + header_size + len(block)
+    file.write(np.array(code, dtype='<i4').tobytes())
+    file.write(np.array(next_position, dtype=position_type).tobytes())
+    if count is not None:
+        file.write(np.array(count, dtype=integer_type).tobytes())
+    file.write(block)
+
+def write_mesh(path, medit, version=2):
+    '''
+    Writes a Medit mesh dict to a binary .meshb file
+    :arg1 path: path of the .meshb file
+    :arg2 medit: Medit mesh dict (see from_pyvista), refs are optional
+    :opt arg3 version: Medit file version, default is 2 (float64 coordinates)
+    '''
+    real, integer, position = formats(version)
+    points = np.asarray(medit['points'])
+    n_points, dim = points.shape
+    refs = medit.get('refs', {})
+
+    with open(path, 'wb') as file:
+        file.write(np.array([1, version], dtype='<i4').tobytes())
+        write_block(file, DIMENSION, np.array(dim, dtype='<i4').tobytes(), position)
+
+        vertices = np.empty(n_points, dtype=[('coordinates', real, dim), ('ref', integer)])
+        vertices['coordinates'] = points
+        vertices['ref'] = refs.get('vertices', 0)
+        write_block(file, VERTICES, vertices.tobytes(), position, n_points, integer)
+
+        for name, code, size, celltype in ELEMENTS:
+            if name not in medit or len(medit[name]) == 0:
+                continue
+            elements = np.empty((len(medit[name]), size + 1), dtype=integer)
+            elements[:, :size] = np.asarray(medit[name]) + 1
+            elements[:, size] = refs.get(name, 0)
+            write_block(file, code, elements.tobytes(), position, len(elements), integer)
+
+        file.write(np.array([END], dtype='<i4').tobytes())
+        file.write(np.array(0, dtype=position).tobytes())
+
+def read_keywords(path):
+    '''
+    Reads the keywords of a binary Medit file (.meshb or .solb)
+
+    returns the file content (bytes), the file version, the byte order and a dict with the data offset of every keyword
+    '''
+    with open(path, 'rb') as file:
+        content = file.read()
+
+    #The first integer is 1, in the other byte order the file was written on a machine with a different endianness
+    byteorder = '<' if np.frombuffer(content, '<i4', 1)[0] == 1 else '>'
+    version = int(np.frombuffer(content, byteorder + 'i4', 1, 4)[0])
+    position_type = formats(version, byteorder)[2]
+
+    keywords = {}
+    offset = 8
+    while offset < len(content):
+        code = int(np.frombuffer(content, byteorder + 'i4', 1, offset)[0])
+        next_position = int(np.frombuffer(content, position_type, 1, offset + 4)[0])
+        if code == END or next_position == 0:
+            break
+        keywords[code] = offset + 4 + position_type.itemsize
+        offset = next_position
+    return content, version, byteorder, keywords
+
+def read_mesh(path):
+    '''
+    Reads a binary .meshb file
+
+    returns Medit mesh dict (see from_pyvista)
+    '''
+    content, version, byteorder, keywords = read_keywords(path)
+    real, integer, position = formats(version, byteorder)
+    dim = int(np.frombuffer(content, byteorder + 'i4', 1, keywords[DIMENSION])[0]) if DIMENSION in keywords else 3
+
+    offset = keywords[VERTICES]
+    n_points = int(np.frombuffer(content, integer, 1, offset)[0])
+    vertices = np.frombuffer(content, [('coordinates', real, dim), ('ref', integer)], n_points, offset + integer.itemsize)
+    medit = dict(points=vertices['coordinates'].astype(float), refs=dict(vertices=vertices['ref'].astype(int)))
+
+    for name, code, size, celltype in ELEMENTS:
+        if code not in keywords:
+            continue
+        offset = keywords[code]
+        count = int(np.frombuffer(content, integer, 1, offset)[0])
+        elements = np.frombuffer(content, integer, count * (size + 1), offset + integer.itemsize).reshape(count, size + 1)
+        medit[name] = elements[:, :size].astype(int) - 1
+        medit['refs'][name] = elements[:, size].astype(int)
+    return medit
+
+def write_sol(path, values, dim=3, version=2):
+    '''
+    Writes a solution at the vertices of a mesh to a binary .solb file (e.g. the size map of mmg)
+    :arg1 path: path of the .solb file
+    :arg2 values: array with a scalar (n) or vector (n x dim) per vertex
+    :opt arg3 dim: dimension of the mesh
+    :opt arg4 version: Medit file version, default is 2
+    '''
+    real, integer, position = formats(version)
+    values = np.asarray(values, dtype=real)
+    sol_type = 1 if values.ndim == 1 else 2 #1 scalar, 2 vector
+
+    with open(path, 'wb') as file:
+        file.write(np.array([1, version], dtype='<i4').tobytes())
+        write_block(file, DIMENSION, np.array(dim, dtype='<i4').tobytes(), position)
+        block = np.array([1, sol_type], dtype=integer).tobytes() + values.tobytes()
+        write_block(file, SOL_AT_VERTICES, block, position, len(values), integer)
+        file.write(np.array([END], dtype='<i4').tobytes())
+        file.write(np.array(0, dtype=position).tobytes())
+
+def read_sol(path):
+    '''
+    Reads the first solution of a binary .solb file
+
+    returns array with a scalar (n) or vector (n x dim) per vertex
+    '''
+    content, version, byteorder, keywords = read_keywords(path)
+    real, integer, position = formats(version, byteorder)
+    dim = int(np.frombuffer(content, byteorder + 'i4', 1, keywords[DIMENSION])[0]) if DIMENSION in keywords else 3
+
+    offset = keywords[SOL_AT_VERTICES]
+    count, n_types = np.frombuffer(content, integer, 2, offset)
+    types = np.frombuffer(content, integer, n_types, offset + 2 * integer.itemsize)
+    sizes = [{1: 1, 2: dim, 3: dim * (dim + 1) // 2}[t] for t in types]
+    values = np.frombuffer(content, real, count * sum(sizes), offset + (2 + n_types) * integer.itemsize)
+    values = values.reshape(count, sum(sizes))[:, :sizes[0]].astype(float)
+    return values[:, 0] if types[0] == 1 else values
@@ -0,0 +1,164 @@
+#import modules
+import os
+import os.path as osp
+import re
+import sys
+import time
+import signal
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import resource
+except ImportError:
+    resource = None
+
+"""
+Execution of the mmg remeshers (mmgs for surfaces, mmg3d for volumes), used by remesh.py and volume_mesh.py.
+mmg runs as 'python -m <program>' of the interpreter that runs the workflow, with the arguments as a list (no shell,
+so paths with spaces work). Every run is limited by
+    timeout : wall time in seconds, the process is killed when it is exceeded
+    memory  : memory in MB, passed to mmg as -m (mmg stops with an error when the mesh does not fit) and, on Linux,
+              also set as the address space limit of the process (with MEMORY_MARGIN MB for the interpreter)
+The output of mmg is written to a log file next to the output mesh and parsed into a dict with the mesh statistics
+(see parse_stats). A run that times out, exits with an error or writes no output raises MmgError, which the pipeline
+handles as a meshing failure (retry.py). run_many runs several jobs at the same time on a thread pool.
+"""
+
+#Memory (MB) that the python interpreter may use on top of the memory limit of mmg
+MEMORY_MARGIN = 512
+
+class MmgError(RuntimeError):
+    '''
+    Raised when a mmg run times out, fails or writes no output. The parsed statistics of the run (see run) are
+    stored in the stats attribute
+    '''
+    def __init__(self, message, stats=None):
+        super().__init__(message)
+        self.stats = stats if stats is not None else {}
+
+def command(program, in_path, out_path, options=(), sol_path=None, memory=None):
+    '''
+    Builds the argument list of a mmg run
+    :arg1 program: 'mmgs' or 'mmg3d'
+    :arg2 in_path: path to the input mesh (.mesh/.meshb)
+    :arg3 out_path: path to the output mesh
+    :opt arg4 options: list with the options, e.g. ['-hausd', '0.1', '-ar', '45']
+    :opt arg5 sol_path: path to a size map (.sol/.solb), default is None
+    :opt arg6 memory: maximum memory of mmg in MB, default is None (no limit)
+
+    returns list with the arguments
+    '''
+    args = [sys.executable, '-m', program] + [str(option) for option in options]
+    if sol_path is not None:
+        args += ['-sol', sol_path]
+    if memory is not None:
+        args += ['-m', str(int(memory))]
+    return args + ['-in', in_path, '-out', out_path]
+
+def parse_stats(log):
+    '''
+    Parses the statistics that mmg prints at the end of a run (the values of the output mesh are printed last)
+    :arg1 log: text output of mmg
+
+    returns dict with the number of vertices, triangles and tetrahedra, the best, average and worst element quality,
+    the time mmg reports and the number of warnings, keys of values that are not in the log are left out
+    '''
+    stats = {}
+    patterns = dict(vertices=r'NUMBER OF VERTICES\s+(\d+)', triangles=r'NUMBER OF TRIANGLES\s+(\d+)',
+                    tetrahedra=r'NUMBER OF TETRAHEDRA\s+(\d+)', elapsed=r'ELAPSED TIME\s+([\d.]+)s')
+    for name, pattern in patterns.items():
+        values = re.findall(pattern, log)
+        if values:
+            stats[name] = float(values[-1]) if name == 'elapsed' else int(values[-1])
+
+    quality = re.findall(r'BEST\s+([\d.]+)\s+AVRG\.\s+([\d.]+)\s+WRST\.\s+([\d.]+)', log)
+    if quality:
+        stats['quality_best'], stats['quality_avg'], stats['quality_worst'] = [float(value) for value in quality[-1]]
+    stats['warnings'] = len(re.findall(r'## Warning', log))
+    return stats
+
+def _limit_memory(pid, memory):
+    '''
+    Sets the address space limit of a running process (Linux only, other systems only get the -m option of mmg)
+    '''
+    if memory is None or not hasattr(resource, 'prlimit'):
+        return
+    size = int(memory + MEMORY_MARGIN) * 1024**2
+    try:
+        resource.prlimit(pid, resource.RLIMIT_AS, (size, size))
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def _kill(process):
+    '''
+    Kills a process and everything it started (its process group on POSIX systems, see run)
+    '''
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+
+def run(program, in_path, out_path, options=(), sol_path=None, timeout=None, memory=None, log_path=None):
+    '''
+    Runs mmg with a wall time and memory limit and captures its output
+    :arg1-5: program, in_path, out_path, options and sol_path, see command
+    :opt arg6 timeout: maximum wall time in seconds, default is None (no limit)
+    :opt arg7 memory: maximum memory in MB, default is None (no limit)
+    :opt arg8 log_path: path of the log file, default is the output path with the extension .log
+
+    returns dict with the statistics of the run (see parse_stats), the return code, the wall time and the log path
+    '''
+    log_path = log_path if log_path is not None else osp.splitext(out_path)[0] + '.log'
+    args = command(program, in_path, out_path, options, sol_path, memory)
+
+    #An old output would hide a failed run
+    if osp.exists(out_path):
+        os.remove(out_path)
+
+    #mmg runs in its own process group, so a timeout also stops the mmg binary that the python wrapper starts. The memory
+    #limit is set on the started process (not in a preexec_fn, which is not safe with the threads of run_many)
+    start = time.time()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+    _limit_memory(process.pid, memory)
+    try:
+        output = process.communicate(timeout=timeout)[0]
+        returncode = process.returncode
+    except subprocess.TimeoutExpired:
+        _kill(process)
+        output = process.communicate()[0]
+        returncode = None
+    log = (output or b'').decode(errors='ignore')
+    walltime = time.time() - start
+
+    with open(log_path, 'w') as file:
+        file.write(' '.join(args) + '\n\n' + log)
+
+    stats = parse_stats(log)
+    stats.update(returncode=returncode, walltime=walltime, log=log_path)
+    if returncode is None:
+        raise MmgError(f'{program} timed out after {timeout} s, see {log_path}', stats)
+    if returncode != 0:
+        raise MmgError(f'{program} failed with exit code {returncode}, see {log_path}', stats)
+    if not osp.exists(out_path):
+        raise MmgError(f'{program} wrote no output, see {log_path}', stats)
+    return stats
+
+def run_many(jobs, n_workers=None):
+    '''
+    Runs several mmg jobs at the same time
+    :arg1 jobs: list of dicts with the arguments of run
+    :opt arg2 n_workers: number of jobs that run at the same time, default is the default of ThreadPoolExecutor
+
+    returns list with the statistics (see run) of every job, in the order of jobs, or the MmgError of a failed job
+    '''
+    def run_job(job):
+        try:
+            return run(**job)
+        except MmgError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(run_job, jobs))
@@ -0,0 +1,569 @@
+#import modules
+import os
+import os.path as osp
+import time
+from glob import glob
+import numpy as np
+import pyvista as pv
+import utils as ut
+import cache
+import ledger
+import profiling
+import retry as retry_plan
+
+"""
+Preprocessing workflow of a single geometry, split in three parts that can also run separately:
+    mesh : cutting, capping, surface and volume meshing, qualification and surface identification. The volume mesh
+           and the identified surfaces are saved in <output folder>/mesh
+    map  : mapping of the velocity profiles on the inlet, saved in <output folder>/Mapped_Velocity_Profiles
+    feb  : creation of the FEBio input file <output folder>/simulation.feb
+The workflow modules of every part are imported when the part runs, so e.g. creating .feb files for a parameter
+sweep does not load the meshing tools.
+"""
+
+STAGES = ('mesh', 'map', 'feb')
+
+def preprocess_case(case_name, output_name, input_dir, vel_profile_dir, output_dir, temp_dir, log_dir, file_dir, settings, stages=STAGES):
+    '''
+    Runs the preprocessing workflow (cutting, capping, meshing, identification, mapping and FEBio file creation)
+    for a single geometry. All intermediate files are written to temp_dir, so every case that runs at the same time
+    needs its own temp_dir. If settings contains a 'ledger_path', the case and all its stages are recorded in the
+    run ledger.
+    :arg1 case_name: name of the geometry folder inside input_dir
+    :arg2 output_name: name of the output folder that is created inside output_dir
+    :arg3 input_dir: path to the directory containing the geometry folders
+    :arg4 vel_profile_dir: path to the directory containing the velocity profiles
+    :arg5 output_dir: path to the output directory
+    :arg6 temp_dir: path to the (case specific) directory used for temporary files
+    :arg7 log_dir: path to the log directory, failed cases are reported in log_dir/failed
+    :arg8 file_dir: path to the directory of the workflow (location of template_xml.feb)
+    :arg9 settings: dict with the parameters of the Setup part of main_workflow
+    :opt arg10 stages: parts of the workflow to run, any of 'mesh', 'map' and 'feb'. Parts that are not run load
+                       their results from the output folder of an earlier run
+
+    returns dict with the case name, status ('done' or 'failed'), number of retries, runtime in seconds and the
+    timing profile of the stages (see profiling.py), which is also written to log_dir/profiles
+    '''
+    ledger_path = settings.get('ledger_path')
+    con = ledger.connect(ledger_path) if ledger_path else None
+    output_folder = osp.join(output_dir, output_name)
+    params_hash = ledger.case_hash(settings, stages, ledger.case_inputs(osp.join(input_dir, case_name), output_folder, vel_profile_dir, stages))
+    run_number = ledger.start_case(con, case_name, params_hash) if con else None
+    if con and run_number > 1:
+        print(f'Run {run_number} of case {case_name}, last unfinished stage: {ledger.failed_stage(con, case_name)}')
+
+    start = time.time()
+    result = dict(case=case_name, output=output_name, status='failed', retries=0, runtime=None, profile=None)
+    profiling.start(case_name)
+    try:
+        #Meshing and identification
+        if 'mesh' in stages:
+            meshes = mesh_case(result, case_name, input_dir, output_folder, temp_dir, log_dir, settings, con, run_number)
+            if meshes is None:
+                return result
+        else:
+            meshes = load_meshes(output_folder)
+
+        #Mapping of the velocity profiles
+        if 'map' in stages:
+            velocity_mapped, mapping_key = map_case(case_name, meshes, vel_profile_dir, output_folder, settings, con, run_number, result['retries'])
+        else:
+            import mapping
+            velocity_mapped = mapping.load_profiles(output_folder)
+            mapping_key = cache.stage_key('mapping', meshes['mesh_key'])
+
+        #FEBio file creation
+        if 'feb' in stages:
+            write_feb_case(case_name, meshes, velocity_mapped, mapping_key, output_folder, file_dir, settings, con, run_number, result['retries'])
+
+        result['status'] = 'done'
+        result['runtime'] = time.time() - start
+        print('Preprocessing took:', result['runtime'], 's')
+    finally:
+        if con:
+            ledger.finish_case(con, case_name, result['status'], result['runtime'])
+            con.close()
+        #Runs of a part of the workflow get their own profile, so they do not overwrite the profile of the other parts
+        suffix = '' if tuple(stages) == STAGES else '_' + '_'.join(stages)
+        profile_path = osp.join(log_dir, r'profiles', f'profile_{case_name}{suffix}.json')
+        result['profile'] = profiling.finish(profile_path, status=result['status'], retries=result['retries'])
+    return result
+
+def mesh_case(result, case_name, input_dir, output_folder, temp_dir, log_dir, settings, con=None, run_number=None):
+    '''
+    Meshing part of preprocess_case (see there for the arguments): cuts and caps the geometry, creates the surface
+    and volume mesh (with retries), checks the quality and identifies the inlet, outlet and wall. The volume mesh and
+    surfaces are saved in output_folder/mesh. The number of retries is written to the result dict.
+    con and run_number are the ledger connection and run number of the case (or None).
+
+    returns dict with the volume mesh ('tetmesh'), the surfaces ('inlet', 'outlet', 'wall') and the cache key of the
+    mesh ('mesh_key'), or None if meshing failed
+    '''
+    import remesh
+    import cutting
+    import volume_mesh
+    from capping import cap
+    import identification as id
+    import quality_control
+    import preflight
+    import mmg_runner
+    import calibration
+
+    #Unpack settings
+    max_retry = settings['max_retry']
+    max_elements = settings['max_elements']
+    min_jacobian = settings['min_jacobian']
+    max_aspect = settings['max_aspect']
+    id_angle = settings['id_angle']
+    show_plot = settings['show_plot']
+    preflight_mode = settings.get('preflight')
+    cut_search = settings.get('cut_search')
+    cut_proxy_error = settings.get('cut_proxy_error')
+    cache_dir = settings.get('cache_dir')
+    mmg_limits = settings.get('mmg_limits')
+    single_pass = settings.get('volume_meshing') == 'single_pass'
+    calibration_options = settings.get('calibration')
+
+    os.makedirs(temp_dir, exist_ok=True)
+    failed_dir = osp.join(log_dir, r'failed')
+    input_folder = osp.join(input_dir, case_name)
+
+    #Grab the path of the geometry files
+    inlet_path = osp.join(input_folder, osp.join(r'meshes', r'inlet.stl'))
+    wall_path = osp.join(input_folder, osp.join(r'meshes', r'wall.stl'))
+    outlet_path = osp.join(input_folder, osp.join(r'meshes', r'outlet.stl'))
+
+    print('Created necessary files and directories')
+
+    #Stage results are cached under a key derived from the input geometry and the parameters of every stage
+    geometry_key = cache.hash_files([inlet_path, wall_path, outlet_path])
+
+    #Failed attempts restart from the failing stage with adjusted parameters, see retry.py
+    parameters = retry_plan.initial_parameters(settings)
+    failures = []
+    resume = 'cut'
+    initial_tetmesh = None
+    wall_proxy = None
+    retry = 0
+
+    def mmg_failed(record, error, failure):
+        '''
+        Records a failed mmg run (see mmg_runner.py) in the ledger record and plans the next attempt
+        '''
+        print('mmg error:', error)
+        record['status'] = 'failed'
+        record['failure'] = failure
+        record['mmg'] = error.stats
+        return plan_retry(failure, str(error))
+
+    def plan_retry(failure, report_text):
+        '''
+        Sets the stage and parameters of the next attempt after a failure, returns False if no retry is left
+        '''
+        nonlocal resume, parameters, retry
+        failures.append(failure)
+        plan = retry_plan.next_attempt(failure, failures, parameters) if retry < max_retry else None
+        if plan is None:
+            print('Terminating, unable to create a 3D mesh of sufficient quality')
+            print('See log files for quality rapport')
+            ut.save_string_to_file(report_text, osp.join(failed_dir, f'Qualityreport_failed_geometry_{case_name}'))
+            return False
+        resume, new_parameters = plan
+        print(f'Retry from stage {resume} with', retry_plan.changes(parameters, new_parameters))
+        parameters = new_parameters
+        retry += 1
+        return True
+
+    while True:
+        result['retries'] = retry
+        mmg_parameters = parameters['mmg_parameters']
+        tetgen_parameters = parameters['tetgen_parameters']
+        mmg3d_parameters = parameters['mmg3d_parameters']
+        mmg3d_sol_parameters = parameters['mmg3d_sol_parameters']
+
+        #--------------------------------------------------------------------------------------------------------------------------
+        # 3D-meshing algorithm
+        #--------------------------------------------------------------------------------------------------------------------------
+
+        #Cut the wall geometry after the aortic root (the last retry for a non-manifold surface starts from a remeshed wall)
+        cut_key = cache.stage_key('cut', geometry_key, dict(wall_remesh=mmg_parameters if parameters['wall_remesh'] else None,
+                                                            search=cut_search, proxy_error=cut_proxy_error))
+        cap_key = cache.stage_key('cap', cut_key)
+        if resume == 'cut':
+            with ledger.stage(con, case_name, 'cut', run_number, retry, cut_key) as record:
+                entry = cache.load(cache_dir, cut_key)
+                if entry is None:
+                    #Reading the files with pyvista
+                    inlet = pv.read(inlet_path)
+                    if parameters['wall_remesh']:
+                        try:
+                            wall = remesh.remesh(wall_path, temp_dir, mmg_parameters, show_plot, mmg_limits)
+                        except mmg_runner.MmgError as e:
+                            if mmg_failed(record, e, 'mmgs_error'):
+                                continue
+                            return None
+                    else:
+                        wall = pv.read(wall_path)
+
+                    print('import of geometry done')
+
+                    #The centerline is traced on a decimated proxy of the input wall, shared by all attempts
+                    if cut_proxy_error is not None and wall_proxy is None:
+                        wall_proxy = cutting.wall_proxy(pv.read(wall_path), cut_proxy_error, cache_dir, geometry_key)
+
+                    wall_cut, inlet_new_center = cutting.main_cutter(inlet, wall, plot=show_plot, search=cut_search, proxy=wall_proxy)
+                    cache.store(cache_dir, cut_key, dict(wall_cut=wall_cut, inlet_new_center=inlet_new_center))
+                else:
+                    print('Cut geometry loaded from cache')
+                    record['status'] = 'cached'
+                    wall_cut, inlet_new_center = entry['wall_cut'], entry['inlet_new_center']
+
+            #Create caps
+            with ledger.stage(con, case_name, 'cap', run_number, retry, cap_key) as record:
+                entry = cache.load(cache_dir, cap_key)
+                if entry is None:
+                    outlet = pv.read(outlet_path)
+                    inlet_cap, outlet_cap = cap(wall_cut, inlet_new_center, outlet.points.mean(0), plot=show_plot)
+                    cache.store(cache_dir, cap_key, dict(inlet_cap=inlet_cap, outlet_cap=outlet_cap))
+                else:
+                    print('Caps loaded from cache')
+                    record['status'] = 'cached'
+                    inlet_cap, outlet_cap = entry['inlet_cap'], entry['outlet_cap']
+
+            #Combine cutted wall and inlet/outlet caps, the triangles keep a reference of their surface (identification.py)
+            for part, ref in [(wall_cut, id.WALL), (inlet_cap, id.INLET), (outlet_cap, id.OUTLET)]:
+                part.cell_data['ref'] = np.full(part.n_cells, ref)
+            combined = (wall_cut + inlet_cap + outlet_cap).clean()
+            refs = combined.cell_data['ref']
+            combined.clear_data()
+            combined.cell_data['ref'] = refs
+            print('Meshes succesfully combined')
+
+            #Plot result of mesh combining.
+            if show_plot:
+                plt = pv.Plotter()
+                plt.add_mesh(combined, style='wireframe')
+                plt.add_text('Wall and caps')
+                plt.show()
+
+            #Pre-flight screening of the combined surface, before the expensive meshing stages
+            if preflight_mode:
+                with ledger.stage(con, case_name, 'preflight', run_number, retry, cap_key) as record:
+                    preflight_report, preflight_text = preflight.check(combined, wall_cut, mmg3d_sol_parameters, max_elements,
+                                                                        tetgen_parameters=tetgen_parameters)
+                    record.update(preflight_report)
+                    geometry_failures = [failure for failure in preflight_report['failures'] if failure in preflight.GEOMETRY_FAILURES]
+                    too_many_elements = 'too_many_elements' in preflight_report['failures']
+                    if geometry_failures or (too_many_elements and preflight_mode == 'reject'):
+                        record['status'] = 'failed'
+
+                if geometry_failures:
+                    print('Pre-flight: geometry can not be meshed', geometry_failures)
+                    if plan_retry('geometry_error', preflight_text):
+                        continue
+                    return None
+
+                if too_many_elements and preflight_mode == 'reject':
+                    print('Pre-flight: too many elements predicted, geometry skipped')
+                    ut.save_string_to_file(preflight_text, osp.join(failed_dir, f'Preflightreport_failed_geometry_{case_name}'))
+                    return None
+                elif too_many_elements:
+                    mmg3d_sol_parameters = preflight.rescale_sizing(mmg3d_sol_parameters, preflight_report['predicted_elements'], max_elements)
+                    parameters['mmg3d_sol_parameters'] = mmg3d_sol_parameters
+                    print('Pre-flight: too many elements predicted, size map scaled to', mmg3d_sol_parameters)
+        else:
+            print('Reusing cut wall and caps of the previous attempt')
+
+        #Surface remesh of the combined wall and caps
+        remesh_key = cache.stage_key('remesh', cap_key, mmg_parameters)
+        if resume in ['cut', 'remesh']:
+            with ledger.stage(con, case_name, 'remesh', run_number, retry, remesh_key) as record:
+                entry = cache.load(cache_dir, remesh_key)
+                if entry is None:
+                    #Run remesh, the result only contains triangles (input for Tetgen)
+                    try:
+                        combined_remeshed = remesh.remesh_edge_detect(combined, temp_dir, mmg_parameters, plot=show_plot, limits=mmg_limits)
+                    except mmg_runner.MmgError as e:
+                        if mmg_failed(record, e, 'mmgs_error'):
+                            continue
+                        return None
+                    cache.store(cache_dir, remesh_key, dict(combined_remeshed=combined_remeshed))
+                else:
+                    print('Remeshed surface loaded from cache')
+                    record['status'] = 'cached'
+                    combined_remeshed = entry['combined_remeshed']
+
+                #Report quality
+                report_text_2D = quality_control.meshreport(combined_remeshed, 'Surface mesh quality report')[1]
+                record['points'] = combined_remeshed.n_points
+                record['cells'] = combined_remeshed.n_cells
+                record['manifold'] = bool(combined_remeshed.is_manifold)
+                if not record['manifold']:
+                    record['status'] = 'failed'
+                    record['failure'] = 'non_manifold'
+
+            #Check mesh validity
+            if not combined_remeshed.is_manifold:
+                print('Non-manifold surface due to initial geometry error')
+                if plan_retry('non_manifold', report_text_2D):
+                    continue
+                return None
+
+        #Calibrate the size map and the hausd of mmg3d to the element budget with cheap surrogates of the volume mesh
+        #(calibration.py), once for every new surface mesh. Retries of the later stages start from the calibrated values
+        if calibration_options is not None and resume in ['cut', 'remesh']:
+            calibration_key = cache.stage_key('calibration', remesh_key,
+                                              dict(options=calibration_options, sol=mmg3d_sol_parameters, mmg3d=mmg3d_parameters,
+                                                   tetgen=tetgen_parameters, max_elements=max_elements))
+            with ledger.stage(con, case_name, 'calibration', run_number, retry, calibration_key) as record:
+                entry = cache.load(cache_dir, calibration_key)
+                if entry is None:
+                    mmg3d_sol_parameters, mmg3d_parameters, calibration_report = calibration.calibrate(
+                        combined_remeshed, wall_cut, temp_dir, mmg3d_sol_parameters, mmg3d_parameters, tetgen_parameters,
+                        calibration_options, max_elements, mmg_limits)
+                    cache.store(cache_dir, calibration_key, dict(sol=mmg3d_sol_parameters, mmg3d=mmg3d_parameters,
+                                                                 report=calibration_report))
+                else:
+                    print('Calibration loaded from cache')
+                    record['status'] = 'cached'
+                    mmg3d_sol_parameters, mmg3d_parameters, calibration_report = entry['sol'], entry['mmg3d'], entry['report']
+                record.update(calibration_report)
+            parameters['mmg3d_sol_parameters'] = mmg3d_sol_parameters
+            parameters['mmg3d_parameters'] = mmg3d_parameters
+
+        #In the single-pass mode TetGen only makes a coarse seed mesh that mmg3d meshes with a graded size map, instead
+        #of a dense initial mesh that is meshed again by mmg3d (see volume_mesh.single_pass_parameters)
+        if single_pass:
+            tetgen_parameters, mmg3d_sol_parameters = volume_mesh.single_pass_parameters(tetgen_parameters, mmg3d_sol_parameters)
+
+        #Make an initial 3D mesh from the combined mesh using TetGen and refine it with mmg3d
+        tetgen_key = cache.stage_key('tetgen', remesh_key, tetgen_parameters)
+        mmg3d_key = cache.stage_key('mmg3d', tetgen_key, dict(sol=mmg3d_sol_parameters, mmg3d=mmg3d_parameters))
+        entry = cache.load(cache_dir, mmg3d_key)
+        if entry is None and (resume != 'mmg3d' or initial_tetmesh is None):
+            try:
+                with ledger.stage(con, case_name, 'tetgen', run_number, retry, tetgen_key) as record:
+                    initial_tetmesh = volume_mesh.tetgen(combined_remeshed, tetgen_parameters, plot=show_plot)
+                    record['points'] = initial_tetmesh.n_points
+                    record['cells'] = initial_tetmesh.n_cells
+            except Exception as e:
+                print('TetGen error:', e)
+                if plan_retry('tetgen_error', report_text_2D):
+                    continue
+                return None
+
+        with ledger.stage(con, case_name, 'mmg3d', run_number, retry, mmg3d_key) as record:
+            if entry is None:
+                #Every attempt starts from a copy, a retry from this stage reuses the initial mesh
+                tetmesh = initial_tetmesh.copy()
+
+                #Plot bisection
+                if show_plot:
+                    quality_control.clip_plot(tetmesh, 'Initial 3D mesh')
+
+                #Report quality
+                quality_control.meshreport(tetmesh, 'Initial 3D mesh quality report')
+
+                #Create a binary .solb size map for mmg3d
+                sol_path = osp.join(temp_dir, r'initial_volume_mesh.solb')
+                volume_mesh.write_sol(tetmesh, wall_cut, mmg3d_sol_parameters, sol_path, plot=show_plot)
+
+                #Refine 3D mesh with mmg3d (the mesh is passed as binary .meshb), a graded size map (sizing.py) is
+                #followed without the gradation of mmg3d
+                graded = mmg3d_sol_parameters.get('gradation') is not None
+                mmg3d_options = dict(mmg3d_parameters, hgrad=-1) if graded else mmg3d_parameters
+                try:
+                    tetmesh = volume_mesh.mmg3d(tetmesh, temp_dir, mmg3d_options, sol_path, plot=show_plot, limits=mmg_limits)
+                except mmg_runner.MmgError as e:
+                    if mmg_failed(record, e, 'mmg3d_error'):
+                        continue
+                    return None
+                cache.store(cache_dir, mmg3d_key, dict(tetmesh=tetmesh))
+            else:
+                print('3D mesh loaded from cache')
+                record['status'] = 'cached'
+                tetmesh = entry['tetmesh']
+
+        with ledger.stage(con, case_name, 'qualification', run_number, retry, mmg3d_key) as record:
+            #Report quality
+            report, report_text = quality_control.meshreport(tetmesh, f'Refined 3D mesh quality report {case_name}')
+
+            #Plot bad cells
+            jac = report['jac']
+            if show_plot:
+                if np.any(jac<0.3):
+                    plt = pv.Plotter()
+                    plt.add_mesh(tetmesh, style='wireframe')
+                    plt.add_mesh(tetmesh.extract_cells(jac<0.3), color='red', show_edges=True)
+                    plt.add_text('Bad cells')
+                    plt.show()
+                else: print('No bad cells')
+
+            #Plot bisection
+            if show_plot:
+                quality_control.clip_plot(tetmesh, 'Final 3D mesh clipped view')
+
+            #Run qualification
+            numcells = report['cells']
+            aspect = report['aspect']
+            if numcells > max_elements: failure = 'too_many_elements'
+            elif any(aspect > max_aspect) or any(jac < min_jacobian): failure = 'bad_quality'
+            else: failure = None
+            run = failure is None
+
+            record.update(points=report['points'], cells=numcells, min_jacobian=jac.min(), mean_jacobian=jac.mean(),
+                          max_aspect=aspect.max(), mean_aspect=aspect.mean())
+            if not run:
+                record['status'] = 'failed'
+                record['failure'] = failure
+
+        #Plot 3D_mesh
+        if show_plot:
+            if run:text='Final 3D mesh'
+            else:text='Final 3D mesh - insufficient quality or too many nodes'
+            tetmesh.plot(show_edges = True, text=text)
+
+        #Write a log file of the mesh quality and start a new attempt if quality is not sufficient.
+        if not run:
+            print('Mesh quality insufficient' if failure == 'bad_quality' else 'Too many elements')
+            if plan_retry(failure, report_text):
+                continue
+            return None
+
+        print('Quality is sufficient')
+        ut.save_string_to_file(report_text, osp.join(log_dir, f'Qualityreport_geometry_{case_name}'))
+        break
+
+    #----------------------------------------------------------------------------------------------------------------------------
+    # Identification
+    #----------------------------------------------------------------------------------------------------------------------------
+
+    with ledger.stage(con, case_name, 'identification', run_number, retry, mmg3d_key) as record:
+        #Create the seeds for the surface identification based on the center points. INLET FIRST!, OUTLET SECOND!
+        seeds = np.array([inlet_cap.points.mean(0),outlet_cap.points.mean(0)])
+
+        #Split the boundary of the 3D mesh by the references of the triangles whilst keeping the original ID's, detect
+        #the surfaces by angle if the references did not survive the meshing
+        with profiling.stage('identify_surfaces') as profile_record:
+            surface_identification = id.identify_by_reference(tetmesh)
+            record['method'] = 'reference'
+            if surface_identification is None:
+                print('Boundary references incomplete, surfaces are detected by angle')
+                surface_identification = id.identify_surfaces(tetmesh, id_angle, seeds, show_plot)
+                record['method'] = 'angle'
+            profile_record['cells'] = tetmesh.n_cells
+
+        #Check if three surfaces are id'ed
+        num_surfaces = len(surface_identification)
+        record['surfaces'] = num_surfaces
+        if num_surfaces != 3:
+            record['status'] = 'failed'
+
+    if num_surfaces != 3:
+        reportstring = f'Incorrect number of surfaces found ({num_surfaces}) , skipped geometry'
+        print(reportstring)
+        print('See log files for error')
+        ut.save_string_to_file(reportstring, osp.join(failed_dir, f'Logreport_failed_geometry_{case_name}'))
+        return None
+
+    #Seperate the indentified surfaces in inlet/outlet/wall
+    id_inlet = surface_identification[0]
+    id_outlet = surface_identification[1]
+    id_wall = surface_identification[2]
+
+    print('Surface identification done')
+    #Plot the identified surfaces for general overview
+    if show_plot:
+        plt = pv.Plotter()
+        plt.add_mesh(id_inlet, color = 'red', label = 'Inlet')
+        plt.add_mesh(id_outlet, color = 'blue', label = 'Outlet')
+        plt.add_mesh(id_wall, color = 'green', label = 'Wall')
+        plt.add_legend()
+        plt.add_text('Identified surfaces')
+        plt.show()
+
+    #At this point meshing is succesfull and output files are written, geometry specific output folder is created.
+    meshes = dict(tetmesh=tetmesh, inlet=id_inlet, outlet=id_outlet, wall=id_wall, mesh_key=mmg3d_key)
+    save_meshes(meshes, output_folder)
+    return meshes
+
+def save_meshes(meshes, output_folder):
+    '''
+    Saves the volume mesh and identified surfaces of mesh_case in output_folder/mesh
+    '''
+    mesh_folder = osp.join(output_folder, r'mesh')
+    os.makedirs(mesh_folder, exist_ok=True)
+    meshes['tetmesh'].save(osp.join(mesh_folder, r'volume_mesh.vtk'))
+    for name in ['inlet', 'outlet', 'wall']:
+        meshes[name].save(osp.join(mesh_folder, f'{name}.vtk'))
+    ut.save_string_to_file(meshes['mesh_key'], osp.join(mesh_folder, r'mesh_key.txt'))
+
+def load_meshes(output_folder):
+    '''
+    Loads the volume mesh and identified surfaces that mesh_case saved in output_folder/mesh
+
+    returns dict in the same format as mesh_case
+    '''
+    mesh_folder = osp.join(output_folder, r'mesh')
+    meshes = dict(tetmesh=pv.read(osp.join(mesh_folder, r'volume_mesh.vtk')))
+    for name in ['inlet', 'outlet', 'wall']:
+        meshes[name] = pv.read(osp.join(mesh_folder, f'{name}.vtk'))
+    with open(osp.join(mesh_folder, r'mesh_key.txt')) as file:
+        meshes['mesh_key'] = file.read().strip()
+    return meshes
+
+def map_case(case_name, meshes, vel_profile_dir, output_folder, settings, con=None, run_number=None, retry=0):
+    '''
+    Mapping part of preprocess_case: maps the velocity profiles on the inlet of the meshes of mesh_case
+
+    returns list with the mapped velocities of every frame and the cache key of the mapping
+    '''
+    import mapping
+
+    intp_options = settings['intp_options']
+    cache_dir = settings.get('cache_dir')
+    os.makedirs(output_folder, exist_ok=True)
+
+    #----------------------------------------------------------------------------------------------------------------------------
+    # Mapping
+    #----------------------------------------------------------------------------------------------------------------------------
+
+    #Perform the mapping of the velocity profiles on the inlet
+    #Output is a point cloud on every inlet node with the respective velocity data and the amount of mapped velocity profiles
+    profile_key = cache.hash_files(sorted(glob(osp.join(vel_profile_dir, '*.vtp'))))
+    mapping_key = cache.stage_key('mapping', meshes['mesh_key'], dict(profiles=profile_key, id_angle=settings['id_angle'], intp_options=intp_options))
+    period = 60 / settings['FEBio_parameters']['hr'] #cycle time in seconds, time axis of the saved profiles
+    with ledger.stage(con, case_name, 'mapping', run_number, retry, mapping_key) as record:
+        entry = cache.load(cache_dir, mapping_key)
+        if entry is None:
+            velocity_mapped, n_maps = mapping.vel_mapping(vel_profile_dir, meshes['inlet'], output_folder, intp_options, settings['show_plot'], cache_dir, period=period)
+            cache.store(cache_dir, mapping_key, dict(velocity_mapped=np.array(velocity_mapped)))
+        else:
+            print('Mapped velocity profiles loaded from cache')
+            record['status'] = 'cached'
+            velocity_mapped = list(entry['velocity_mapped'])
+            mapping.save_profiles(meshes['inlet'], velocity_mapped, output_folder, period=period)
+        record['frames'] = len(velocity_mapped)
+
+    return velocity_mapped, mapping_key
+
+def write_feb_case(case_name, meshes, velocity_mapped, mapping_key, output_folder, file_dir, settings, con=None, run_number=None, retry=0):
+    '''
+    FEBio part of preprocess_case: writes output_folder/simulation.feb for the meshes of mesh_case and the
+    velocities of map_case
+    '''
+    import febioxml as feb
+
+    FEBio_parameters = settings['FEBio_parameters']
+    os.makedirs(output_folder, exist_ok=True)
+
+    #----------------------------------------------------------------------------------------------------------------------------
+    # FEBio Creation
+    #----------------------------------------------------------------------------------------------------------------------------
+
+    #Create a solver compatible file based on the 3D-mesh and meshing parameters
+    with ledger.stage(con, case_name, 'febio_file', run_number, retry, cache.stage_key('febio_file', mapping_key, FEBio_parameters)):
+        with profiling.stage('xml_creator') as record:
+            feb.xml_creator(meshes['tetmesh'], meshes['inlet'], meshes['outlet'], meshes['wall'], velocity_mapped, file_dir, output_folder, FEBio_parameters)
+            record['cells'] = meshes['tetmesh'].n_cells
+            record['frames'] = len(velocity_mapped)
@@ -6,14 +6,18 @@ import identification as id
 from tkinter import Tk
 from tkinter.filedialog import askopenfilenames
 import cutting
+import cache
 import utils as ut
 
-def wss_cut_and_hist(maxrange=50):
+def wss_cut_and_hist(maxrange=50, proxy_error=None, cache_dir=None):
     '''
     Asks the user to select vtk files to process. For each file, geometry is cut where the artery is horizontal,
     wss data is added and the result is plotted. Also prints a histogram of wss for each .vtk
 
     :maxrange   : float, maximum value for the color plot
+    :proxy_error: float, trace the centerline on a decimated wall with this maximum Hausdorff distance (mm), default
+                  is None (trace on the wall itself)
+    :cache_dir  : path to the cache directory in which the decimated walls are kept, default is None
     :return     :pyvista MultiBlock with cut geometry
     '''
     # Read vtk
@@ -42,7 +46,8 @@ def wss_cut_and_hist(maxrange=50):
         inlet = split_surf[int(inlet_index)].extract_surface()
 
         # Cut at horizontal point
-        wall = cutting.post_cutter(inlet, wall, flip_norm=True).extract_surface()
+        proxy = cutting.wall_proxy(wall, proxy_error, cache_dir, cache.hash_files([filepath])) if proxy_error is not None else None
+        wall = cutting.post_cutter(inlet, wall, flip_norm=True, proxy=proxy).extract_surface()
 
         """# Add array containing max. wss
         tensors = wall['fluid_stress'].reshape((wall['fluid_stress'].shape[0],3,3))
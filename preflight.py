@@ -0,0 +1,200 @@
+#import modules
+import numpy as np
+import profiling
+
+"""
+Pre-flight screening of the combined surface (cut wall and caps) before the expensive meshing stages. The checks use
+only the triangles of the surface:
+    watertight        : every edge is shared by at least two triangles (no holes, e.g. from failed capping)
+    manifold          : no edge is shared by more than two triangles
+    self intersection : no edge of a triangle crosses a triangle it does not share a vertex with
+    tiny edges        : edges shorter than a fraction of the median edge length (reported, mmg removes them)
+
+The number of elements of the final mesh is predicted from the size map of write_sol: a boundary layer of thickness
+bl_thickness along the wall meshed with edge length bl_edgelength, and the rest of the volume with edgelength.
+A regular tetrahedron with edge length h has a volume of h^3/(6*sqrt(2)), so a volume V meshed with edge length h
+contains about 8.49*V/h^3 elements:
+    elements = 8.49 * (A*t / h_bl^3 + (V - A*t) / h^3)
+with A the wall area, t the boundary layer thickness and V the enclosed volume. A graded size map (mmg3d_sol_parameters
+with a gradation, see sizing.py) is integrated over a coarse TetGen mesh of the surface instead (predict_graded).
+"""
+
+#Number of regular tetrahedra with unit edge length per unit volume
+TETS_PER_VOLUME = 6 * np.sqrt(2)
+
+#Geometry failures that can't be solved by other meshing parameters
+GEOMETRY_FAILURES = ['not_watertight', 'non_manifold', 'self_intersection']
+
+def edges_of(faces):
+    '''
+    returns the unique edges (sorted vertex pairs) of triangles and the number of triangles that share every edge
+    '''
+    edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+    return np.unique(edges, axis=0, return_counts=True)
+
+def segments_cross_triangles(p, q, a, b, c, tol=1e-9):
+    '''
+    Tests if segments pq cross triangles abc (Moller-Trumbore), touching within tol does not count
+    :arg1-2 p, q: arrays (n x 3) with the end points of the segments
+    :arg3-5 a, b, c: arrays (n x 3) with the corners of the triangles
+
+    returns bool array (n)
+    '''
+    direction = q - p
+    e1 = b - a
+    e2 = c - a
+    h = np.cross(direction, e2)
+    det = np.einsum('ij,ij->i', e1, h)
+    parallel = np.abs(det) < tol * np.linalg.norm(e1, axis=1) * np.linalg.norm(e2, axis=1) * np.linalg.norm(direction, axis=1)
+    inv = 1 / np.where(parallel, 1, det)
+    s = p - a
+    u = np.einsum('ij,ij->i', s, h) * inv
+    qv = np.cross(s, e1)
+    v = np.einsum('ij,ij->i', direction, qv) * inv
+    t = np.einsum('ij,ij->i', e2, qv) * inv
+    return ~parallel & (u > tol) & (v > tol) & (u + v < 1 - tol) & (t > tol) & (t < 1 - tol)
+
+def self_intersections(points, faces):
+    '''
+    Finds pairs of triangles that intersect and do not share a vertex. Candidate pairs are triangles whose bounding
+    spheres (around the centroid) overlap, found with a KD-tree
+    :arg1 points: array (n x 3) with the points of the surface
+    :arg2 faces: array (m x 3) with the triangles
+
+    returns array (k x 2) with the intersecting triangle pairs
+    '''
+    from scipy.spatial import cKDTree
+
+    corners = points[faces]
+    centroids = corners.mean(1)
+    radius = np.linalg.norm(corners - centroids[:, None, :], axis=2).max(1)
+
+    #Every pair is found from its triangle with the largest radius: a ball with twice its radius contains the
+    #centroid of every smaller triangle that can touch it
+    tree = cKDTree(centroids)
+    neighbours = tree.query_ball_point(centroids, 2 * radius)
+    first = np.repeat(np.arange(len(faces)), [len(n) for n in neighbours])
+    second = np.concatenate(neighbours).astype(int) if len(first) else np.zeros(0, dtype=int)
+    keep = (radius[second] < radius[first]) | ((radius[second] == radius[first]) & (second > first))
+    first, second = first[keep], second[keep]
+    distance = np.linalg.norm(centroids[first] - centroids[second], axis=1)
+    keep = distance < radius[first] + radius[second]
+    first, second = first[keep], second[keep]
+
+    #Triangles that share a vertex touch by construction
+    shared = (faces[first][:, :, None] == faces[second][:, None, :]).any(axis=(1, 2))
+    first, second = first[~shared], second[~shared]
+
+    #Two triangles intersect if an edge of one of them crosses the other
+    crossing = np.zeros(len(first), dtype=bool)
+    for tri, other in [(first, second), (second, first)]:
+        a, b, c = corners[tri, 0], corners[tri, 1], corners[tri, 2]
+        for i, j in [(0, 1), (1, 2), (2, 0)]:
+            crossing |= segments_cross_triangles(corners[other, i], corners[other, j], a, b, c)
+    return np.column_stack([first[crossing], second[crossing]])
+
+def predict_elements(volume, wall_area, sol_parameters):
+    '''
+    Predicts the number of elements of the refined volume mesh (see the formula at the top of this file)
+    :arg1 volume: enclosed volume of the geometry
+    :arg2 wall_area: area of the wall
+    :arg3 sol_parameters: mmg3d_sol_parameters (bl_thickness, bl_edgelength, edgelength)
+
+    returns predicted number of elements
+    '''
+    bl_volume = min(wall_area * sol_parameters['bl_thickness'], volume)
+    return TETS_PER_VOLUME * (bl_volume / sol_parameters['bl_edgelength']**3 + (volume - bl_volume) / sol_parameters['edgelength']**3)
+
+def predict_graded(combined, wall, sol_parameters, tetgen_parameters):
+    '''
+    Predicts the number of elements of the refined volume mesh for a graded size map, integrated over a coarse TetGen
+    mesh of the surface (see sizing.size_field)
+    :arg1 combined: pyvista mesh of the closed surface
+    :arg2 wall: pyvista mesh of the cut wall
+    :arg3 sol_parameters: mmg3d_sol_parameters with a gradation
+    :arg4 tetgen_parameters: parameters of the initial volume mesh, the coarse mesh is made without a maximum volume
+
+    returns predicted number of elements
+    '''
+    import sizing
+    import volume_mesh
+
+    seed = volume_mesh.tetgen(combined, volume_mesh.single_pass_parameters(tetgen_parameters, sol_parameters)[0])
+    return sizing.size_field(seed, wall, sol_parameters)[1]['predicted_elements']
+
+def check(combined, wall, sol_parameters, max_elements, tiny_edge=0.01, tetgen_parameters=None):
+    '''
+    Screens the combined surface before meshing
+    :arg1 combined: pyvista mesh of the wall and caps
+    :arg2 wall: pyvista mesh of the cut wall (for the boundary layer area)
+    :arg3 sol_parameters: mmg3d_sol_parameters
+    :arg4 max_elements: maximum number of elements of the final mesh
+    :opt arg5 tiny_edge: edges shorter than this fraction of the median edge length are reported as tiny
+    :opt arg6 tetgen_parameters: parameters of the initial volume mesh, needed for the prediction of a graded size map
+
+    returns dict with the results of the checks, the predicted number of elements and the list of failures
+    (empty if the case can be meshed), and the report text
+    '''
+    with profiling.stage('preflight') as record:
+        surface = combined.extract_surface().triangulate()
+        points = np.asarray(surface.points)
+        faces = surface.regular_faces
+
+        edges, counts = edges_of(faces)
+        lengths = np.linalg.norm(points[edges[:, 0]] - points[edges[:, 1]], axis=1)
+        open_edges = int(np.sum(counts == 1))
+        non_manifold_edges = int(np.sum(counts > 2))
+        tiny_edges = int(np.sum(lengths < tiny_edge * np.median(lengths)))
+        intersections = len(self_intersections(points, faces))
+        record['cells'] = len(faces)
+
+    failures = []
+    if open_edges:
+        failures.append('not_watertight')
+    if non_manifold_edges:
+        failures.append('non_manifold')
+    if intersections:
+        failures.append('self_intersection')
+
+    #The enclosed volume is only meaningful for a closed surface
+    volume = surface.volume if open_edges == 0 else np.nan
+    wall_area = wall.extract_surface().area
+    if failures:
+        predicted = np.nan
+    elif sol_parameters.get('gradation') is not None and tetgen_parameters is not None:
+        predicted = predict_graded(surface, wall, sol_parameters, tetgen_parameters)
+    else:
+        predicted = predict_elements(volume, wall_area, sol_parameters)
+    if predicted > max_elements:
+        failures.append('too_many_elements')
+
+    report = dict(open_edges=open_edges, non_manifold_edges=non_manifold_edges, self_intersections=intersections,
+                  tiny_edges=tiny_edges, min_edge=lengths.min(), volume=volume, wall_area=wall_area,
+                  predicted_elements=predicted, failures=failures)
+
+    report_text = f'''
+    --------------------------------------------------------------
+    Pre-flight report
+    open edges: {open_edges}
+    non-manifold edges: {non_manifold_edges}
+    self-intersecting triangle pairs: {intersections}
+    tiny edges: {tiny_edges} (shortest edge {lengths.min()})
+    volume: {volume}
+    wall area: {wall_area}
+    predicted elements: {predicted} (maximum {max_elements})
+    failures: {failures}
+    --------------------------------------------------------------
+    '''
+    print(report_text)
+    return report, report_text
+
+def rescale_sizing(sol_parameters, predicted, max_elements, margin=0.9):
+    '''
+    Scales the edge lengths of the size map so that the predicted number of elements is margin*max_elements
+    (the number of elements scales with the edge length to the power -3)
+
+    returns dict with the scaled mmg3d_sol_parameters
+    '''
+    factor = float((predicted / (margin * max_elements))**(1 / 3))
+    return dict(sol_parameters, bl_edgelength=sol_parameters['bl_edgelength'] * factor,
+                edgelength=sol_parameters['edgelength'] * factor)
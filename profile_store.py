@@ -0,0 +1,101 @@
+#import modules
+import os.path as osp
+from glob import glob
+import numpy as np
+import pyvista as pv
+import cache
+
+"""
+Compiled store of a directory of source velocity profiles (one .vtp per frame), used by mapping.vel_mapping instead
+of reading and preparing the .vtp files for every case. All frames are stored in a single array (profiles.npy in a
+cache entry) that is memory-mapped read-only, so all cases and worker processes share it without parsing VTK files.
+Every row is a point of a frame:
+    x, y, z, vx, vy, vz
+The faces of all frames (VTK cell arrays) are stored in a second array. The offsets of the frames in both arrays, the
+mean normals and the file names are stored as json values. The distance to the edge and the backflow mask of
+utils.interpolate_profiles (edge_distance, backflow) are measured on the aligned frames, as before the store: a
+point at the threshold of the zero boundary can fall on either side of it depending on the rounding of its distance.
+"""
+
+COLUMNS = ['x', 'y', 'z', 'vx', 'vy', 'vz']
+
+#Stores opened by this process, the memory map of a store is only created once
+_opened = {}
+
+def edge_distance(profile):
+    '''
+    returns the distance of every point of a profile to its largest feature edge. The nearest edge point is found with
+    a KD-tree of the edge points, so the memory is linear in the number of points
+    '''
+    from scipy.spatial import cKDTree
+
+    edges = profile.extract_feature_edges().connectivity()
+    large_edge_id = np.argmax(np.bincount(edges['RegionId']))
+    edge_pts = edges.points[np.where(edges['RegionId'] == large_edge_id)]
+    return cKDTree(edge_pts).query(profile.points)[0]
+
+def backflow(profile):
+    '''
+    returns bool array, True where the velocity of a profile points against its (flipped) mean normal
+    '''
+    normal = profile.compute_normals()['Normals'].mean(0) * -1 # Careful with the sign, see utils.interpolate_profiles
+    normal = normal / np.linalg.norm(normal)
+    return np.dot(profile['Velocity'], normal) < 0
+
+def build(profile_dir):
+    '''
+    Reads and prepares the velocity profiles of a directory
+    :arg1 profile_dir: path to the directory with the .vtp files
+
+    returns store dict with the data array (points x COLUMNS), the faces array, the offsets of the frames in both, the
+    mean normal of every frame and the file names
+    '''
+    paths = sorted(glob(osp.join(profile_dir, '*.vtp')))
+    blocks = []
+    faces = []
+    normals = []
+    for path in paths:
+        profile = pv.read(path)
+        blocks.append(np.column_stack([profile.points, profile['Velocity']]))
+        faces.append(np.asarray(profile.faces, dtype=np.int64))
+        normals.append(profile.compute_normals()['Normals'].mean(0))
+    offsets = np.cumsum([0] + [len(block) for block in blocks])
+    face_offsets = np.cumsum([0] + [len(face) for face in faces])
+    return dict(data=np.concatenate(blocks).astype(float), offsets=[int(offset) for offset in offsets],
+                faces=np.concatenate(faces), face_offsets=[int(offset) for offset in face_offsets],
+                normals=np.array(normals), names=[osp.basename(path) for path in paths])
+
+def open_store(profile_dir, cache_dir=None):
+    '''
+    Opens the compiled store of a directory of velocity profiles. The store is compiled once and kept in the cache
+    under a hash of the .vtp files, later calls (also from other processes) memory-map it
+    :arg1 profile_dir: path to the directory with the .vtp files
+    :opt arg2 cache_dir: path to the cache directory, default is None (the store is built in memory)
+
+    returns store dict (see build)
+    '''
+    key = cache.stage_key('profile_store', cache.hash_files(sorted(glob(osp.join(profile_dir, '*.vtp')))), dict(columns=COLUMNS, faces=True))
+    if key in _opened:
+        return _opened[key]
+
+    store = cache.load(cache_dir, key, mmap_mode='r')
+    if store is None:
+        print('Compiling velocity profile store')
+        store = build(profile_dir)
+        cache.store(cache_dir, key, store)
+        if cache_dir is not None:
+            store = cache.load(cache_dir, key, mmap_mode='r')
+    _opened[key] = store
+    return store
+
+def frames(store):
+    '''
+    returns list with a dict per frame with the points, velocities and faces (views of the store) and mean normal
+    '''
+    data = store['data']
+    offsets = store['offsets']
+    faces = store['faces']
+    face_offsets = store['face_offsets']
+    return [dict(points=data[start:end, 0:3], velocity=data[start:end, 3:6],
+                 faces=faces[face_offsets[k]:face_offsets[k + 1]], normal=store['normals'][k])
+            for k, (start, end) in enumerate(zip(offsets[:-1], offsets[1:]))]
@@ -0,0 +1,170 @@
+#import modules
+import os
+import time
+import json
+import contextlib
+
+"""
+Timing of the heavy steps of the workflow (centerline, capping, mmgs, tetgen, write_sol, mmg3d, identify_surfaces,
+interpolate_profiles and xml_creator). The steps are wrapped in profiling.stage, which records the wall time, the CPU
+time (including external programs such as mmg) and the element/point counts that the step adds to the record.
+Throughput (counts per second of wall time) is derived from the counts.
+
+A profile is active per process: pipeline.preprocess_case starts one for every case and writes it to
+log/profiles/profile_<case>.json, batch.run_batch combines the profiles of a batch in log/profile_summary.json.
+When no profile is active (e.g. a module is used on its own) stage does nothing.
+"""
+
+#Counts for which a throughput is calculated
+THROUGHPUT_KEYS = ['cells', 'points', 'frames']
+
+_profile = None
+
+def cpu_time():
+    '''
+    returns CPU time in seconds of this process and its finished child processes (the external meshing tools)
+    '''
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def start(case_name):
+    '''
+    Starts the profile of a case, replaces the active profile of this process
+    '''
+    global _profile
+    _profile = dict(case=case_name, started=time.time(), cpu_start=cpu_time(), stages=[])
+
+@contextlib.contextmanager
+def stage(name):
+    '''
+    Context manager that records the wall and CPU time of a stage in the active profile. The yielded dict can be
+    used to add counts (e.g. record['cells'] = mesh.n_cells), for 'cells', 'points' and 'frames' the throughput
+    per second is added. The stage is also recorded when it raises an exception (with 'failed': True).
+    :arg1 name: name of the stage
+    '''
+    record = {}
+    if _profile is None:
+        yield record
+        return
+
+    profile = _profile
+    start_wall = time.perf_counter()
+    start_cpu = cpu_time()
+    failed = True
+    try:
+        yield record
+        failed = False
+    finally:
+        wall = time.perf_counter() - start_wall
+        entry = dict(stage=name, wall=wall, cpu=cpu_time() - start_cpu)
+        entry.update(record)
+        for key in THROUGHPUT_KEYS:
+            if key in record and wall > 0:
+                entry[f'{key}_per_s'] = record[key] / wall
+        if failed:
+            entry['failed'] = True
+        profile['stages'].append(entry)
+
+def totals(stages):
+    '''
+    Sums the entries of every stage (a stage runs more than once on retries)
+    :arg1 stages: list of stage entries of a profile
+
+    returns dict with per stage the number of calls, wall and CPU time and summed counts
+    '''
+    summary = {}
+    for entry in stages:
+        total = summary.setdefault(entry['stage'], dict(calls=0, wall=0.0, cpu=0.0))
+        total['calls'] += 1
+        total['wall'] += entry['wall']
+        total['cpu'] += entry['cpu']
+        for key in THROUGHPUT_KEYS:
+            if key in entry:
+                total[key] = total.get(key, 0) + entry[key]
+    for total in summary.values():
+        for key in THROUGHPUT_KEYS:
+            if key in total and total['wall'] > 0:
+                total[f'{key}_per_s'] = total[key] / total['wall']
+    return summary
+
+def finish(path=None, **info):
+    '''
+    Ends the active profile and writes it to a .json file
+    :opt arg1 path: path of the .json file, nothing is written if None
+    :opt kwargs: extra information that is stored in the profile (e.g. status='done')
+
+    returns dict with the profile (case, wall, cpu, stages and per stage totals), or None if no profile was active
+    '''
+    global _profile
+    profile, _profile = _profile, None
+    if profile is None:
+        return None
+
+    profile['wall'] = time.time() - profile['started']
+    profile['cpu'] = cpu_time() - profile.pop('cpu_start')
+    profile['totals'] = totals(profile['stages'])
+    profile.update(info)
+
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(profile, file, indent=4, default=float)
+    return profile
+
+def summarize(profiles):
+    '''
+    Combines the profiles of a batch
+    :arg1 profiles: list of profiles (see finish)
+
+    returns dict with the number of cases, total wall time and per stage the number of cases and calls, the total,
+    mean and maximum wall time per case, the total CPU time, the share of the summed wall time of all cases and the
+    mean throughput
+    '''
+    profiles = [profile for profile in profiles if profile]
+    total_wall = sum(profile['wall'] for profile in profiles)
+
+    stages = {}
+    for profile in profiles:
+        for name, total in profile['totals'].items():
+            stage_summary = stages.setdefault(name, dict(cases=0, calls=0, wall=0.0, cpu=0.0, max_wall=0.0, max_case=None))
+            stage_summary['cases'] += 1
+            stage_summary['calls'] += total['calls']
+            stage_summary['wall'] += total['wall']
+            stage_summary['cpu'] += total['cpu']
+            if total['wall'] > stage_summary['max_wall']:
+                stage_summary['max_wall'] = total['wall']
+                stage_summary['max_case'] = profile['case']
+            for key in THROUGHPUT_KEYS:
+                if key in total:
+                    stage_summary[key] = stage_summary.get(key, 0) + total[key]
+
+    for stage_summary in stages.values():
+        stage_summary['mean_wall'] = stage_summary['wall'] / stage_summary['cases']
+        stage_summary['share'] = stage_summary['wall'] / total_wall if total_wall > 0 else None
+        for key in THROUGHPUT_KEYS:
+            if key in stage_summary and stage_summary['wall'] > 0:
+                stage_summary[f'{key}_per_s'] = stage_summary[key] / stage_summary['wall']
+
+    #Sort on total wall time, the stage that dominates the batch comes first
+    stages = dict(sorted(stages.items(), key=lambda item: -item[1]['wall']))
+    return dict(cases=len(profiles), wall=total_wall, stages=stages)
+
+def write_summary(profiles, path):
+    '''
+    Writes the summary of the profiles of a batch (see summarize) to a .json file and prints the slowest stages
+
+    returns dict with the summary
+    '''
+    summary = summarize(profiles)
+    if summary['cases'] == 0:
+        return summary
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(summary, file, indent=4, default=float)
+
+    print(f'Time per stage over {summary["cases"]} cases:')
+    for name, stage_summary in summary['stages'].items():
+        share = f' ({100 * stage_summary["share"]:.0f}%)' if stage_summary['share'] is not None else ''
+        print(f'    {name}: {stage_summary["wall"]:.1f} s{share}, mean {stage_summary["mean_wall"]:.1f} s per case')
+    return summary
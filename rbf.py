@@ -0,0 +1,151 @@
+#import modules
+from itertools import combinations_with_replacement
+import numpy as np
+from scipy.linalg import lu_factor, lu_solve
+from scipy.spatial import distance, cKDTree
+
+"""
+RBF smoothing of the velocity profiles (utils.interpolate_profiles). The nearest neighbour velocities of every frame
+are smoothed with an RBF that is fitted and evaluated at the same points, the cell centers of the target inlet.
+The RBF system
+    [K + s*I  P] [c]   [d]
+    [P^T      0] [p] = [0]
+with K the kernel matrix, s the smoothing and P the polynomial matrix only depends on the points and intp_options,
+not on the velocities. It is therefore LU factorized once (the same factorization as scipy's RBFInterpolator) and
+solved for all frames and velocity components at once. At the data points the interpolant K c + P p equals d - s*c,
+so no evaluation matrix is needed.
+
+The global system needs O(n^2) memory and O(n^3) time, which becomes unaffordable for finely meshed inlets. The local
+mode (smooth_local, intp_options 'neighbors') fits a separate RBF for every point to its k nearest neighbours
+(found with a KD-tree), like RBFInterpolator with neighbors=k. The points are processed in chunks of which the
+batched systems fit in LOCAL_MEMORY, so the peak memory does not depend on the number of points.
+Accuracy of the local mode on 20 frames, linear kernel with smoothing 0.5 on 2610 points, difference with the global
+mode relative to the maximum velocity:
+    k=50  : maximum 1.4%, mean 0.09% (0.9 s, global 0.6 s)
+    k=100 : maximum 0.9%, mean 0.08% (3.0 s)
+    k=200 : maximum 0.6%, mean 0.04% (11.6 s)
+On 10710 points the global mode takes 21 s and 2.8 GB, the local mode with k=50 4.4 s and 0.14 GB. The local mode
+is only worth it for fine inlets, the time grows with k^3 per point.
+"""
+
+#Memory (bytes) of the batched local systems of a chunk of points
+LOCAL_MEMORY = 2**27
+
+#Radial basis functions, the same definitions as scipy.interpolate.RBFInterpolator
+KERNELS = {
+    'linear': lambda r: -r,
+    'thin_plate_spline': lambda r: r**2 * np.log(np.where(r > 0, r, 1)),
+    'cubic': lambda r: r**3,
+    'quintic': lambda r: -r**5,
+    'multiquadric': lambda r: -np.sqrt(r**2 + 1),
+    'inverse_multiquadric': lambda r: 1 / np.sqrt(r**2 + 1),
+    'inverse_quadratic': lambda r: 1 / (r**2 + 1),
+    'gaussian': lambda r: np.exp(-r**2)}
+
+def domain(points):
+    '''
+    returns the shift and scale that map a set of points (... x n x dim) to [-1, 1], like RBFInterpolator
+    '''
+    mins, maxs = points.min(-2, keepdims=True), points.max(-2, keepdims=True)
+    scale = (maxs - mins) / 2
+    scale[scale == 0] = 1
+    return (mins + maxs) / 2, scale
+
+def polynomial_matrix(points, degree, shift, scale):
+    '''
+    returns the monomials up to degree evaluated at the points (... x n x dim) after shifting and scaling them, an
+    empty matrix if degree is -1
+    '''
+    scaled = (points - shift) / scale
+    columns = [np.prod(scaled[..., list(monomial)], axis=-1) for deg in range(degree + 1)
+               for monomial in combinations_with_replacement(range(points.shape[-1]), deg)]
+    return np.stack(columns, axis=-1) if columns else np.zeros(points.shape[:-1] + (0,))
+
+def factorize(points, kernel='linear', smoothing=0.0, epsilon=1.0, degree=0):
+    '''
+    Builds and factorizes the RBF system of a set of points
+    :arg1 points: array (n x dim) with the points
+    :opt arg2 kernel: name of the kernel (see KERNELS)
+    :opt arg3 smoothing: smoothing parameter
+    :opt arg4 epsilon: shape parameter, the kernel is evaluated at epsilon * distance
+    :opt arg5 degree: degree of the added polynomial, -1 for none
+
+    returns dict with the LU factorization, the number of points and the smoothing (input of smooth)
+    '''
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    polynomial = polynomial_matrix(points, degree, *domain(points))
+    m = polynomial.shape[1]
+
+    lhs = np.zeros((n + m, n + m))
+    lhs[:n, :n] = KERNELS[kernel](epsilon * distance.squareform(distance.pdist(points)))
+    lhs[:n, :n] += smoothing * np.eye(n)
+    lhs[:n, n:] = polynomial
+    lhs[n:, :n] = polynomial.T
+
+    lu, piv = lu_factor(lhs, overwrite_a=True, check_finite=False)
+    if np.any(np.diag(lu) == 0):
+        raise np.linalg.LinAlgError('Singular matrix, the polynomial degree may be too high for the points')
+    return dict(lu=lu, piv=piv, n=n, smoothing=smoothing)
+
+def smooth(operator, values):
+    '''
+    Smooths values at the points of a factorized RBF system
+    :arg1 operator: dict returned by factorize
+    :arg2 values: array (n x ...) with the values at the points, e.g. (points x frames x 3) for all frames at once
+
+    returns array with the smoothed values, the same shape as values
+    '''
+    n = operator['n']
+    values = np.asarray(values, dtype=float)
+    data = values.reshape(n, -1)
+    rhs = np.zeros((operator['lu'].shape[0], data.shape[1]))
+    rhs[:n] = data
+    coefficients = lu_solve((operator['lu'], operator['piv']), rhs, check_finite=False)[:n]
+    return (data - operator['smoothing'] * coefficients).reshape(values.shape)
+
+def smooth_local(points, values, neighbors, kernel='linear', smoothing=0.0, epsilon=1.0, degree=0):
+    '''
+    Smooths values at a set of points with a local RBF per point, fitted to its nearest neighbours
+    :arg1 points: array (n x dim) with the points
+    :arg2 values: array (n x ...) with the values at the points, e.g. (points x frames x 3) for all frames at once
+    :arg3 neighbors: number of nearest neighbours of every local RBF
+    :opt arg4-7: kernel, smoothing, epsilon and degree, see factorize
+
+    returns array with the smoothed values, the same shape as values
+    '''
+    points = np.asarray(points, dtype=float)
+    values = np.asarray(values, dtype=float)
+    n = len(points)
+    data = values.reshape(n, -1)
+    k = min(neighbors, n)
+    m = polynomial_matrix(points[:1], degree, 0, 1).shape[-1]
+    smoothed = np.empty_like(data)
+
+    _, neighbours = cKDTree(points).query(points, k)
+    neighbours = neighbours.reshape(n, k)
+    #Per point the system (and its copy in the solver), the distance vectors between the neighbours and their squares
+    #(3 times the system each) and the right hand side and coefficients
+    chunk = max(1, LOCAL_MEMORY // (8 * (8 * (k + m)**2 + 3 * (k + m) * data.shape[1])))
+    for start in range(0, n, chunk):
+        ids = neighbours[start:start + chunk]
+        local = points[ids]
+        shift, scale = domain(local)
+        polynomial = polynomial_matrix(local, degree, shift, scale)
+
+        #Batched systems of all points in the chunk
+        lhs = np.zeros((len(ids), k + m, k + m))
+        lhs[:, :k, :k] = KERNELS[kernel](epsilon * np.linalg.norm(local[:, :, None] - local[:, None], axis=-1))
+        lhs[:, :k, :k] += smoothing * np.eye(k)
+        lhs[:, :k, k:] = polynomial
+        lhs[:, k:, :k] = polynomial.transpose(0, 2, 1)
+        rhs = np.zeros((len(ids), k + m, data.shape[1]))
+        rhs[:, :k] = data[ids]
+        coefficients = np.linalg.solve(lhs, rhs)
+
+        #Evaluate every local RBF at its own point
+        center = points[start:start + chunk, None]
+        vector = np.concatenate([KERNELS[kernel](epsilon * np.linalg.norm(local - center, axis=-1)),
+                                 polynomial_matrix(center, degree, shift, scale)[:, 0]], axis=1)
+        smoothed[start:start + chunk] = np.einsum('ij,ijk->ik', vector, coefficients)
+    return smoothed.reshape(values.shape)
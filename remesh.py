@@ -4,69 +4,81 @@ import os.path as osp
 from glob import glob
 import numpy as np
 import pyvista as pv
-import tetgen as tet
-import meshio
-import subprocess as sub
+import medit
+import mmg_runner
+import profiling
 
 
-def remesh(wall_path, temp_dir,parameters, plot=False):
+def remesh(wall_path, temp_dir,parameters, plot=False, limits=None):
     '''
-    Function to remesh an open surface using mmg. Saves a .mesh
+    Function to remesh an open surface using mmg. Saves a .meshb and returns the remeshed surface
 
     :arg1 wall_path: path to wall file
     :arg2 temp_dir: path to directory used for temporary files
     :arg3 parameters: mmg meshing parameters
     :opt arg4 plot: show plots, default is false
+    :opt arg5 limits: dict with the timeout (s) and memory (MB) of mmg (see mmg_runner.py), default is no limits
+    returns: pyvista PolyData of the remeshed wall
     '''
 
-    file_input_location = osp.join(temp_dir, r'wall.mesh') #hardcoded filename
-    file_output_location = osp.join(temp_dir, r'wall_remeshed.mesh')
+    file_input_location = osp.join(temp_dir, r'wall.meshb') #hardcoded filename
+    file_output_location = osp.join(temp_dir, r'wall_remeshed.meshb')
 
-    # Convert input file from stl to .mesh
-    meshio.write(file_input_location, meshio.read(wall_path))
+    # Convert input file from stl to .meshb
+    medit.write_mesh(file_input_location, medit.from_pyvista(pv.read(wall_path)))
 
     density = parameters['mesh_density']
     sizing = parameters['sizing']
-    ind = ' '
+    limits = limits or {}
 
     print('Start 2D remesh of wall')
 
     # Run mmg
-    sub.run(f"{'py -m mmgs -hausd'}{ind}{density}{ind}{'-nr'}{ind}{file_input_location}{ind}{file_output_location}{ind}{'-hsiz'}{ind}{sizing}")
+    with profiling.stage('mmgs') as record:
+        record['mmg'] = mmg_runner.run('mmgs', file_input_location, file_output_location, ['-hausd', density, '-nr', '-hsiz', sizing], **limits)
 
-    # Convert back to .vtk and plot with pyvista
-    meshio.write(osp.join(temp_dir, r'wall_remeshed.vtk'), meshio.read(file_output_location))
+        # Read the triangles of the result (mmg also outputs the detected ridges as edges)
+        wall_remeshed = medit.to_pyvista(medit.read_mesh(file_output_location), 'triangles')
+        record['cells'] = wall_remeshed.n_cells
+        record['points'] = wall_remeshed.n_points
 
     if plot:
-        wall_remeshed = pv.read(osp.join(temp_dir, r'wall_remeshed.vtk'))
         wall_remeshed.plot(show_edges = True, text='Remeshed surface')
 
     print('Succesfully remeshed wall')
 
-    return
+    return(wall_remeshed)
 
-def remesh_edge_detect(in_path, out_path, temp_path, parameters, plot=False):
+def remesh_edge_detect(surface, temp_path, parameters, plot=False, limits=None):
     '''
-    Remeshes geometry using mmg with edge detection, saves a .mesh and returns pyvista PolyData/UnstructuredGrid
-    :in_path : path to input file (.mesh)
-    :out_path : path to output file (.mesh)
+    Remeshes geometry using mmg with edge detection and returns pyvista PolyData. The surface is passed to mmg as
+    temp_path/combined_mesh.meshb, the result is temp_path/combined_mmg.meshb
+    :surface : pyvista PolyData of the (triangulated) surface
+    :temp_path : path to directory used for temporary files
     :parameters : dict of mmg parameters
     :plot : bool, show intermediate plots
+    :limits : dict with the timeout (s) and memory (MB) of mmg (see mmg_runner.py), None for no limits
     :returns : PyvistaPolydata of the remeshed geo
     '''
     print('Start 2D remeshing')
 
+    in_path = osp.join(temp_path, r'combined_mesh.meshb')
+    out_path = osp.join(temp_path, r'combined_mmg.meshb')
+    medit.write_mesh(in_path, medit.from_pyvista(surface))
+
     density = parameters['mesh_density']
     sizing = parameters['sizing']
     angle = parameters['detection angle']
-    ind = ' '
+    limits = limits or {}
 
     # Run mmg
-    sub.run(f"{'py -m mmgs -ar'}{ind}{angle}{ind}{'-hausd'}{ind}{density}{ind}{in_path}{ind}{out_path}{ind}{'-hsiz'}{ind}{sizing}")
+    with profiling.stage('mmgs') as record:
+        record['mmg'] = mmg_runner.run('mmgs', in_path, out_path, ['-ar', angle, '-hausd', density, '-hsiz', sizing], **limits)
 
-    # Convert back to .vtk and plot with pyvista
-    meshio.write(osp.join(temp_path, r'temp_for_plot_remesh.vtk'), meshio.read(out_path))
-    remeshed = pv.read(osp.join(temp_path, r'temp_for_plot_remesh.vtk'))
+        # Read the triangles of the result (mmg also outputs the detected ridges as edges)
+        remeshed = medit.to_pyvista(medit.read_mesh(out_path), 'triangles')
+        record['cells'] = remeshed.n_cells
+        record['points'] = remeshed.n_points
 
     if plot==True:
         remeshed.plot(show_edges = True, text='Remeshed surface')
@@ -0,0 +1,128 @@
+#import modules
+import copy
+
+"""
+Retry strategy of the meshing part of the workflow (pipeline.mesh_case). A failed meshing attempt is not restarted
+from the input geometry, but from the stage that caused the failure, with parameters that are adjusted for the type
+of failure. Results of the stages before it (cut wall, caps, surface mesh) are reused.
+
+Failure types:
+    non_manifold      : the remeshed surface is not manifold
+    tetgen_error      : TetGen could not mesh the surface
+    too_many_elements : the refined volume mesh has more than max_elements elements
+    bad_quality       : the refined volume mesh has elements with a too low jacobian or a too high aspect ratio
+    geometry_error    : the combined wall and caps are not watertight, not manifold or self-intersecting (preflight.py)
+    mmgs_error        : the surface remesh (mmgs) timed out, ran out of memory or failed (mmg_runner.py)
+    mmg3d_error       : the volume remesh (mmg3d) timed out, ran out of memory or failed (mmg_runner.py)
+
+Every failure type has a plan: a list of retries that are tried one after another (the n-th failure of a type uses
+the n-th retry of its plan). A retry names the stage the meshing restarts from and multiplies parameters of the
+previous attempt by the given factors. The total number of retries is still limited by max_retry.
+"""
+
+#Stages of the meshing, in the order they run
+STAGE_ORDER = ['cut', 'remesh', 'tetgen', 'mmg3d']
+
+RETRY_PLANS = {
+    'non_manifold': [
+        #Finer surface mesh (smaller hausdorff distance) to follow the geometry more closely
+        dict(stage='remesh', mmg_parameters={'mesh_density': 0.5}),
+        dict(stage='remesh', mmg_parameters={'mesh_density': 0.5, 'sizing': 0.8}),
+        #Remesh the wall before cutting, to repair errors in the input geometry
+        dict(stage='cut', wall_remesh=True)],
+    'tetgen_error': [
+        #Less strict radius-edge ratio and a larger maximum volume
+        dict(stage='tetgen', tetgen_parameters={'minratio': 4/3}),
+        dict(stage='tetgen', tetgen_parameters={'minratio': 4/3, 'maxvolume': 2}),
+        #Errors in the surface mesh (e.g. self intersections), remesh the surface with a smaller hausdorff distance
+        dict(stage='remesh', mmg_parameters={'mesh_density': 0.5})],
+    'too_many_elements': [
+        #Larger elements away from the wall (faster growth of a graded size map), then also in the boundary layer
+        dict(stage='mmg3d', mmg3d_sol_parameters={'edgelength': 1.5, 'gradation': 1.25}),
+        dict(stage='mmg3d', mmg3d_sol_parameters={'edgelength': 1.5, 'gradation': 1.25, 'bl_edgelength': 1.25}),
+        dict(stage='remesh', mmg_parameters={'sizing': 1.25})],
+    'bad_quality': [
+        #Follow the surface more closely in mmg3d, then a stricter initial mesh
+        dict(stage='mmg3d', mmg3d_parameters={'hausd': 0.5}),
+        dict(stage='tetgen', tetgen_parameters={'minratio': 0.9}),
+        dict(stage='remesh', mmg_parameters={'sizing': 0.8})],
+    'geometry_error': [
+        #Remesh the wall before cutting, to repair errors in the input geometry
+        dict(stage='cut', wall_remesh=True)],
+    'mmgs_error': [
+        #Less detail along the surface, then remesh the wall before cutting
+        dict(stage='remesh', mmg_parameters={'mesh_density': 2}),
+        dict(stage='cut', wall_remesh=True)],
+    'mmg3d_error': [
+        #Less detail along the surface, then a new initial mesh and a coarser surface mesh
+        dict(stage='mmg3d', mmg3d_parameters={'hausd': 2}),
+        dict(stage='tetgen', tetgen_parameters={'minratio': 4/3}),
+        dict(stage='remesh', mmg_parameters={'mesh_density': 2})],
+}
+
+PARAMETER_KEYS = ['mmg_parameters', 'mmg3d_parameters', 'mmg3d_sol_parameters', 'tetgen_parameters']
+
+def initial_parameters(settings):
+    '''
+    returns dict with the meshing parameters of the first attempt, taken from the settings of preprocess_case
+    '''
+    parameters = {key: copy.deepcopy(settings[key]) for key in PARAMETER_KEYS}
+    parameters['wall_remesh'] = False
+    return parameters
+
+def scale(parameters, factors):
+    '''
+    Multiplies parameters by factors, numbers that are stored as strings (mmg parameters) stay strings and parameters
+    that are None (switched off) stay None
+    :arg1 parameters: dict with parameters
+    :arg2 factors: dict with the factor of every parameter that changes
+
+    returns new dict with the scaled parameters
+    '''
+    scaled = dict(parameters)
+    for key, factor in factors.items():
+        if key not in parameters or parameters[key] is None:
+            continue
+        value = parameters[key]
+        if isinstance(value, str):
+            scaled[key] = f'{float(value) * factor:g}'
+        else:
+            scaled[key] = value * factor
+    return scaled
+
+def next_attempt(failure, failures, parameters):
+    '''
+    Determines how the meshing continues after a failure
+    :arg1 failure: failure type of the last attempt (see RETRY_PLANS)
+    :arg2 failures: list with the failure types of all attempts so far, including the last one
+    :arg3 parameters: dict with the meshing parameters of the last attempt (see initial_parameters)
+
+    returns the stage to restart from and a dict with the parameters of the next attempt, or None if the plan
+    of this failure type is exhausted
+    '''
+    plan = RETRY_PLANS[failure]
+    n = failures.count(failure) - 1
+    if n >= len(plan):
+        return None
+
+    step = plan[n]
+    new_parameters = dict(parameters)
+    for key in PARAMETER_KEYS:
+        if key in step:
+            new_parameters[key] = scale(parameters[key], step[key])
+    if step.get('wall_remesh'):
+        new_parameters['wall_remesh'] = True
+    return step['stage'], new_parameters
+
+def changes(old, new):
+    '''
+    returns dict with the parameters that differ between two attempts, used for reporting
+    '''
+    changed = {}
+    for key in PARAMETER_KEYS:
+        for name, value in new[key].items():
+            if old[key].get(name) != value:
+                changed[f'{key}.{name}'] = value
+    if new['wall_remesh'] != old['wall_remesh']:
+        changed['wall_remesh'] = new['wall_remesh']
+    return changed
@@ -0,0 +1,132 @@
+#import modules
+import os
+import os.path as osp
+import json
+import time
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def read_status(sim_folder):
+    '''
+    Reads the status file that run_febio writes in a simulation folder
+    :arg1 sim_folder: path to the simulation folder
+
+    returns dict with the status of the last run, or None if the case was never run
+    '''
+    status_path = osp.join(sim_folder, r'simulation_status.json')
+    if not osp.exists(status_path):
+        return None
+    with open(status_path) as file:
+        return json.load(file)
+
+def write_status(sim_folder, status):
+    '''
+    Writes the status of a simulation to simulation_status.json in the simulation folder
+    '''
+    with open(osp.join(sim_folder, r'simulation_status.json'), 'w') as file:
+        json.dump(status, file, indent=4)
+
+def feb_hash(sim_folder):
+    '''
+    returns hex string, hash of the simulation.feb file in sim_folder (stored in the status, so a case of which the
+    model was written again after its run is not skipped)
+    '''
+    sha = hashlib.sha256()
+    with open(osp.join(sim_folder, r'simulation.feb'), 'rb') as file:
+        for block in iter(lambda: file.read(2**20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def run_febio(FEBio_path, sim_folder, n_threads, timeout=None):
+    '''
+    Runs FEBio for the simulation.feb file in sim_folder with a fixed number of threads. The solver output is
+    written to febio_output.txt and the exit status and wall time to simulation_status.json in sim_folder.
+    A case counts as done when FEBio exits with 0 and, if a FEBio log is found, reports a normal termination.
+    :arg1 FEBio_path: path to the FEBio executable
+    :arg2 sim_folder: path to the folder containing simulation.feb
+    :arg3 n_threads: number of OpenMP/MKL threads FEBio is allowed to use
+    :opt arg4 timeout: maximum wall time in seconds, default is no limit
+
+    returns dict with the status of the run
+    '''
+    FEBio_inputfile = osp.join(sim_folder, r'simulation.feb')
+    status = dict(case=osp.basename(sim_folder), status='running', returncode=None, walltime=None,
+                  threads=n_threads, started=time.strftime('%Y-%m-%d %H:%M:%S'), feb_hash=feb_hash(sim_folder))
+    write_status(sim_folder, status)
+
+    #Limit the solver threads, FEBio and the MKL solvers otherwise claim every core of the machine
+    env = dict(os.environ)
+    env['OMP_NUM_THREADS'] = str(n_threads)
+    env['MKL_NUM_THREADS'] = str(n_threads)
+
+    start = time.time()
+    try:
+        with open(osp.join(sim_folder, r'febio_output.txt'), 'w') as output:
+            process = subprocess.run([FEBio_path, FEBio_inputfile], cwd=sim_folder, env=env, stdout=output,
+                                     stderr=subprocess.STDOUT, timeout=timeout)
+        status['returncode'] = process.returncode
+    except subprocess.TimeoutExpired:
+        status['error'] = f'timeout after {timeout} s'
+    except OSError as e:
+        status['error'] = str(e)
+    status['walltime'] = time.time() - start
+
+    #FEBio can exit normally after an error termination, so also check the log file if it is there
+    finished = status['returncode'] == 0
+    log_path = osp.join(sim_folder, r'simulation.log')
+    if finished and osp.exists(log_path):
+        with open(log_path, errors='ignore') as log:
+            finished = 'N O R M A L   T E R M I N A T I O N' in log.read()
+    status['status'] = 'done' if finished else 'failed'
+
+    write_status(sim_folder, status)
+    return status
+
+def run_simulations(FEBio_path, output_dir, total_cores=None, threads_per_job=4, rerun='unfinished', timeout=None):
+    '''
+    Runs FEBio for every case folder in output_dir that contains a simulation.feb. Several jobs run at the same
+    time, the number of jobs is chosen so that jobs * threads_per_job stays within total_cores.
+    :arg1 FEBio_path: path to the FEBio executable
+    :arg2 output_dir: path to the output directory containing the case folders
+    :opt arg3 total_cores: number of cores all simulations together may use, default is all cores of the machine
+    :opt arg4 threads_per_job: number of threads for every FEBio job, default is 4
+    :opt arg5 rerun: which cases to run, 'all', 'unfinished' (default, skips cases that are done with the current
+                     simulation.feb) or 'failed'
+                     (only cases that ran before and failed)
+    :opt arg6 timeout: maximum wall time in seconds per job, default is no limit
+
+    returns list of status dicts of the cases that were run
+    '''
+    if total_cores is None:
+        total_cores = os.cpu_count()
+    threads_per_job = max(1, min(threads_per_job, total_cores))
+    n_jobs = max(1, total_cores // threads_per_job)
+
+    #Select the cases to run
+    sim_folders = []
+    for sim in sorted(os.listdir(output_dir)):
+        sim_folder = osp.join(output_dir, sim)
+        if not osp.exists(osp.join(sim_folder, r'simulation.feb')):
+            continue
+        status = read_status(sim_folder)
+        #A case is only done if simulation.feb did not change since its run (e.g. written again by write-feb with other
+        #FEBio_parameters), status files without the hash are from earlier versions and run again
+        if rerun == 'unfinished' and status is not None and status['status'] == 'done' and status.get('feb_hash') == feb_hash(sim_folder):
+            continue
+        if rerun == 'failed' and (status is None or status['status'] != 'failed'):
+            continue
+        sim_folders.append(sim_folder)
+
+    print(f'Start {len(sim_folders)} simulations, {n_jobs} at a time with {threads_per_job} threads each')
+
+    statuses = []
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(run_febio, FEBio_path, sim_folder, threads_per_job, timeout) for sim_folder in sim_folders]
+        for future in as_completed(futures):
+            status = future.result()
+            statuses.append(status)
+            print(f'[{len(statuses)}/{len(sim_folders)}] {status["case"]}: {status["status"]} ({status["walltime"]:.1f} s)')
+
+    return statuses
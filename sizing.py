@@ -0,0 +1,138 @@
+#import modules
+import numpy as np
+import profiling
+
+"""
+Graded size map for mmg3d (volume_mesh.write_sol), used instead of the two-value size map when mmg3d_sol_parameters
+contains a 'gradation'. The edge length at a vertex with wall distance d and local vessel radius R is
+    h = bl_edgelength                                                       for d <= bl_thickness
+    h = min(bl_edgelength + ln(gradation) * (d - bl_thickness), edgelength, R / radius_cells)     otherwise
+The linear growth with slope ln(gradation) is the gradation that mmg3d applies to a size map with -hgrad gradation
+(1.3 by default), so the mesh has the same resolution in the boundary layer as the two-value size map without the
+jump in size at bl_thickness. The size map is graded already, so mmg3d runs with -hgrad -1 (no gradation) on it.
+With the gradation of mmg3d (1.3) the graded map is about the two-value map as mmg3d grades it, only a larger
+gradation gives fewer elements away from the wall. That has not been measured with mmg3d yet, so the two-value map
+stays the default (gradation None). The optional cap R / radius_cells keeps a minimum number of elements across the
+radius of narrow vessels, it only adds elements and is off by default.
+
+The local radius is estimated from the centerline of the volume, taken as the vertices at which the wall distance is
+a local maximum (the medial points of the vessel): R at a vertex is the wall distance of its nearest medial point.
+
+The number of elements of the mesh is predicted by integrating the size map over the initial mesh, a regular
+tetrahedron with edge length h has a volume of h^3/(6*sqrt(2)) (see preflight.py). The density of a cell is the mean of 1/h^3 at
+its vertices, so a coarse initial mesh does not smear out the boundary layer. With a target_elements budget the
+increase of the edge length over bl_edgelength is scaled until the prediction fits, up to edgelength, the boundary
+layer is left as it is.
+"""
+
+#Number of regular tetrahedra with unit edge length per unit volume
+TETS_PER_VOLUME = 6 * np.sqrt(2)
+
+#Default parameters of the graded size map (the others are the keys of mmg3d_sol_parameters)
+DEFAULTS = dict(gradation=1.3, radius_cells=None, target_elements=None)
+
+def wall_distance(points, wall, cutoff=None):
+    '''
+    returns the distance of every point (n x 3) to the closest point of the wall (pyvista surface). With a cutoff
+    the distance is computed with distance_field.py, exact up to the cutoff but not beyond it (only for the two-value
+    size map, the graded size map needs the exact distance)
+    '''
+    if cutoff is not None:
+        import distance_field
+        return distance_field.distance(distance_field.prepare(wall, cutoff), points)
+    closest_points = wall.find_closest_cell(points, return_closest_point=True)[1]
+    return np.linalg.norm(points - closest_points, axis=1)
+
+def local_radius(points, distance, neighbours=16, min_radius=0):
+    '''
+    Estimates the local vessel radius at a set of points from the wall distance
+    :arg1 points: array (n x 3) with the vertices of the volume mesh
+    :arg2 distance: array (n) with the wall distance of the vertices
+    :opt arg3 neighbours: number of nearest vertices among which a medial point has the largest wall distance
+    :opt arg4 min_radius: medial points closer than this to the wall are ignored (local maxima along open ends)
+
+    returns array (n) with the wall distance of the nearest medial point of every vertex (at least its own)
+    '''
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(points)
+    ids = tree.query(points, min(neighbours + 1, len(points)))[1]
+    medial = np.where((distance >= distance[ids].max(1)) & (distance > min_radius))[0]
+    if len(medial) == 0:
+        return np.full(len(points), distance.max())
+    return np.maximum(distance[medial][cKDTree(points[medial]).query(points)[1]], distance)
+
+def graded_size(distance, radius, parameters, scale=1.0):
+    '''
+    Edge length of the graded size map (see the formula at the top of this file)
+    :arg1 distance: array with the wall distance of the vertices
+    :arg2 radius: array with the local radius of the vertices, None without radius_cells
+    :arg3 parameters: mmg3d_sol_parameters with gradation and radius_cells
+    :opt arg4 scale: factor on the increase of the edge length over bl_edgelength
+
+    returns array with the edge length at every vertex (at most edgelength)
+    '''
+    h_bl = parameters['bl_edgelength']
+    grown = h_bl + np.log(parameters['gradation']) * np.maximum(distance - parameters['bl_thickness'], 0)
+    cap = np.full(len(distance), float(parameters['edgelength']))
+    if parameters.get('radius_cells'):
+        cap = np.minimum(cap, radius / parameters['radius_cells'])
+    size = np.minimum(grown, np.maximum(cap, h_bl))
+    return np.minimum(h_bl + scale * (size - h_bl), max(parameters['edgelength'], h_bl))
+
+def predict_elements(mesh, size):
+    '''
+    Predicts the number of elements of a mesh that follows a size map, by integrating it over a volume mesh
+    :arg1 mesh: pyvista UnstructuredGrid of the volume
+    :arg2 size: array with the edge length at every vertex of mesh
+
+    returns predicted number of elements
+    '''
+    volumes = np.abs(mesh.compute_cell_sizes(length=False, area=False, volume=True)['Volume'])
+    cells = mesh.cells_dict[list(mesh.cells_dict)[0]]
+    density = (1 / size[cells]**3).mean(1)
+    return float(TETS_PER_VOLUME * np.sum(volumes * density))
+
+def size_field(mesh, wall, parameters, distance=None):
+    '''
+    Computes the graded size map at the vertices of a volume mesh
+    :arg1 mesh: pyvista UnstructuredGrid of the (initial) volume mesh
+    :arg2 wall: pyvista surface of the wall
+    :arg3 parameters: mmg3d_sol_parameters (bl_thickness, bl_edgelength, edgelength and optionally gradation,
+                      radius_cells and target_elements, see DEFAULTS)
+    :opt arg4 distance: array with the wall distance of the vertices, default is None (computed)
+
+    returns array with the edge length at every vertex and dict with the predicted number of elements and the
+    scale of the growth away from the wall
+    '''
+    parameters = dict(DEFAULTS, **parameters)
+    with profiling.stage('size_field') as record:
+        points = np.asarray(mesh.points, dtype=float)
+        if distance is None:
+            distance = wall_distance(points, wall)
+        radius = local_radius(points, distance, min_radius=parameters['bl_thickness']) if parameters['radius_cells'] else None
+
+        scale = 1.0
+        size = graded_size(distance, radius, parameters)
+        predicted = predict_elements(mesh, size)
+
+        #Faster growth away from the wall until the prediction fits in the budget (bisection on the scale)
+        target = parameters['target_elements']
+        if target is not None and predicted > target:
+            low, high = 1.0, 64.0
+            if predict_elements(mesh, graded_size(distance, radius, parameters, high)) > target:
+                print('Size map: the element budget can not be met by coarsening away from the wall')
+                low = high
+            for _ in range(20 if low < high else 0):
+                middle = (low * high)**0.5
+                if predict_elements(mesh, graded_size(distance, radius, parameters, middle)) > target:
+                    low = middle
+                else:
+                    high = middle
+            scale = high
+            size = graded_size(distance, radius, parameters, scale)
+            predicted = predict_elements(mesh, size)
+
+        record['points'] = len(points)
+        record['predicted_elements'] = predicted
+    return size, dict(predicted_elements=predicted, scale=scale)
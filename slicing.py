@@ -0,0 +1,166 @@
+#import modules
+import numpy as np
+import pyvista as pv
+
+"""
+Plane slicing of triangulated surfaces, used to trace the centerline of the wall (cutting.centerline).
+prepare() stores the points, triangles and unique edges of the surface once. section() then only computes the signed
+distance of the points to the plane, finds the edges that cross it and connects the intersection points of the two
+crossing edges of every crossed triangle into loops. No clipped meshes are created.
+
+The area of a section is the length of its vector area 0.5 * sum(p_i x p_i+1), which is the exact area of a planar
+polygon, and its centroid is the mean of the loop points.
+
+The centerline only needs an approximation of the sections, so it can be traced on a decimated proxy of the wall
+(proxy()) of which the distance to the wall is bounded. The cost of tracing then no longer depends on the resolution
+of the input geometry, only the final cut is done on the full resolution wall.
+"""
+
+def prepare(surface):
+    '''
+    Precomputes the data of a surface that is needed for slicing
+    :arg1 surface: pyvista PolyData or UnstructuredGrid, cells other than triangles are triangulated
+
+    returns dict with the points, the edges (unique vertex pairs) and per triangle the indices of its three edges
+    '''
+    surface = surface.extract_surface().triangulate()
+    faces = surface.regular_faces
+    edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1).astype(np.int64)
+
+    #Unique edges from a single integer key per vertex pair (faster than unique rows)
+    n_points = surface.n_points
+    keys, face_edges = np.unique(edges[:, 0] * n_points + edges[:, 1], return_inverse=True)
+    edges = np.column_stack([keys // n_points, keys % n_points])
+    return dict(points=np.asarray(surface.points, dtype=float), edges=edges, face_edges=face_edges.reshape(3, -1).T)
+
+def loops_of(links, n_nodes):
+    '''
+    Orders the nodes of a graph in which every node has at most two links into loops (or open chains)
+    :arg1 links: array (m x 2) with the linked nodes
+    :arg2 n_nodes: number of nodes
+
+    returns list of arrays with the ordered nodes of every loop
+    '''
+    neighbours = np.full((n_nodes, 2), -1)
+    for a, b in links:
+        neighbours[a, 0 if neighbours[a, 0] < 0 else 1] = b
+        neighbours[b, 0 if neighbours[b, 0] < 0 else 1] = a
+
+    visited = np.zeros(n_nodes, dtype=bool)
+    loops = []
+    #Start open chains at their ends, so they are walked from one end to the other
+    starts = list(np.where((neighbours < 0).sum(1) == 1)[0]) + list(range(n_nodes))
+    for start in starts:
+        if visited[start]:
+            continue
+        loop = [start]
+        visited[start] = True
+        previous, node = -1, start
+        while True:
+            following = [n for n in neighbours[node] if n >= 0 and n != previous and not visited[n]]
+            if not following:
+                break
+            previous, node = node, following[0]
+            visited[node] = True
+            loop.append(node)
+        loops.append(np.array(loop))
+    return loops
+
+def section(sliceable, point, normal):
+    '''
+    Intersects a prepared surface with a plane and returns the section loop closest to point
+    :arg1 sliceable: dict returned by prepare
+    :arg2 point: point on the plane
+    :arg3 normal: normal of the plane
+
+    returns dict with the ordered points of the loop ('points'), the centroid ('center'), the area ('area'),
+    the unit vector area ('normal') and whether the loop is closed ('closed'), or None if the plane misses the surface
+    '''
+    points = sliceable['points']
+    edges = sliceable['edges']
+    face_edges = sliceable['face_edges']
+
+    #Points exactly on the plane count as below it, so every crossed triangle has exactly two crossing edges
+    distance = (points - point) @ np.asarray(normal, dtype=float)
+    above = distance > 0
+    crossing = above[edges[:, 0]] != above[edges[:, 1]]
+    if not np.any(crossing):
+        return None
+
+    #Intersection point of every crossing edge
+    crossing_ids = np.where(crossing)[0]
+    d0 = distance[edges[crossing_ids, 0]]
+    d1 = distance[edges[crossing_ids, 1]]
+    t = (d0 / (d0 - d1))[:, None]
+    intersections = points[edges[crossing_ids, 0]] + t * (points[edges[crossing_ids, 1]] - points[edges[crossing_ids, 0]])
+
+    #Every crossed triangle links the intersection points of its two crossing edges
+    local = np.full(len(edges), -1)
+    local[crossing_ids] = np.arange(len(crossing_ids))
+    crossed = crossing[face_edges]
+    crossed_faces = crossed.sum(1) == 2
+    links = local[face_edges[crossed_faces]][crossed[crossed_faces]].reshape(-1, 2)
+
+    #Select the loop closest to the point
+    loops = loops_of(links, len(crossing_ids))
+    closest = np.argmin([np.linalg.norm(intersections[loop] - point, axis=1).min() for loop in loops])
+    loop = loops[closest]
+    loop_points = intersections[loop]
+
+    #A loop is closed if its first and last point are linked
+    first, last = loop[0], loop[-1]
+    closed = len(loop) > 2 and bool(np.any(((links[:, 0] == first) & (links[:, 1] == last)) | ((links[:, 0] == last) & (links[:, 1] == first))))
+
+    center = loop_points.mean(0)
+    vector_area = 0.5 * np.cross(loop_points - center, np.roll(loop_points, -1, axis=0) - center).sum(0)
+    area = np.linalg.norm(vector_area)
+    return dict(points=loop_points, center=center, area=area, normal=vector_area / area if area > 0 else vector_area, closed=closed)
+
+def loops_to_polydata(loops):
+    '''
+    Combines the points of section loops (see section) in a PolyData with a closed line per loop, for plotting
+    '''
+    points = np.concatenate(loops)
+    offsets = np.cumsum([0] + [len(loop) for loop in loops])
+    lines = np.concatenate([np.concatenate([[len(loop) + 1], np.arange(len(loop)) + offset, [offset]])
+                            for loop, offset in zip(loops, offsets)])
+    return pv.PolyData(points, lines=lines)
+
+def distance_function(surface):
+    '''
+    returns a function that calculates the distance of an array of points (n x 3) to a surface
+    '''
+    import vtk
+    from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+    #The cell locator of the surface is built once and reused for every call
+    implicit = vtk.vtkImplicitPolyDataDistance()
+    implicit.SetInput(surface)
+    def distance(points):
+        values = vtk.vtkDoubleArray()
+        implicit.FunctionValue(numpy_to_vtk(np.ascontiguousarray(points, dtype=float)), values)
+        return np.abs(vtk_to_numpy(values))
+    return distance
+
+def proxy(surface, max_error, min_cells=200):
+    '''
+    Creates a decimated proxy of a surface for tracing the centerline. The proxy is halved (quadric decimation) as long
+    as its Hausdorff distance to the surface stays below max_error. The Hausdorff distance is measured from the points
+    of the surface to the proxy and from the points of the proxy to the surface
+    :arg1 surface: pyvista PolyData
+    :arg2 max_error: maximum Hausdorff distance between the proxy and the surface
+    :opt arg3 min_cells: the surface is not decimated below this number of cells
+
+    returns pyvista PolyData of the proxy (the triangulated surface itself if it can't be decimated within max_error)
+    and its Hausdorff distance to the surface
+    '''
+    surface = surface.extract_surface().triangulate()
+    to_surface = distance_function(surface)
+    best, error = surface, 0.0
+    while best.n_cells > 2 * min_cells:
+        candidate = best.decimate(0.5)
+        candidate_error = max(to_surface(candidate.points).max(), distance_function(candidate)(surface.points).max())
+        if candidate_error > max_error:
+            break
+        best, error = candidate, candidate_error
+    return best, error
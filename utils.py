@@ -2,9 +2,6 @@ import sys
 import os
 from os.path import join
 import numpy as np
-from scipy import interpolate
-from scipy.interpolate import RBFInterpolator, NearestNDInterpolator
-from scipy.spatial import distance
 import pyvista as pv
 
 
@@ -31,47 +28,63 @@ def rotation_matrix_from_vectors(vec1, vec2):
 
 
 # core function for interpolating profiles in 3D space
-def interpolate_profiles(aligned_planes, fxdpts, intp_options):
+def interpolate_profiles(aligned_planes, fxdpts, intp_options, operator=None, n_threads=None):
+    '''
+    Interpolates aligned source profiles on the target points fxdpts. operator is an optional dict with a precomputed
+    RBF factorization ('lu', 'piv', 'n', 'smoothing', see rbf.factorize) and/or the faces of the output plane ('faces'),
+    see mapping.target_operator. The nearest neighbour part is done per frame on a pool of n_threads threads
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    from scipy.spatial import cKDTree
+    import rbf
+    import profile_store
+
     num_frames = len(aligned_planes)
 
-    # Set boundary vectors to zero
     dr = intp_options['zero_boundary_dist']  # percentage threshold for zero boundary
-    edges = [aligned_planes[k].extract_feature_edges().connectivity() for k in range(num_frames)]
-    large_edge_id = [np.argmax(np.bincount(edges[k]['RegionId'])) for k in range(num_frames)]
-    edge_pts = [edges[k].points[np.where(edges[k]['RegionId'] == large_edge_id[k])] for k in range(num_frames)]
-    #edge_pts = [aligned_planes[k].extract_feature_edges(boundary_edges=True, feature_edges=False, manifold_edges=False).points for k in range(num_frames)]
-    dist2edge = [distance.cdist(aligned_planes[k].points, edge_pts[k]).min(axis=1) for k in range(num_frames)]
-    boundary_ids = [np.where(dist2edge[k] < (dr * dist2edge[k].max()))[0] for k in range(num_frames)]
-    for k in range(num_frames):
-        aligned_planes[k]['Velocity'][boundary_ids[k], :] = 0.0
-
-    # Set backflow to zero
-    if intp_options['zero_backflow']:
-        normals = [aligned_planes[k].compute_normals()['Normals'].mean(0) * -1 for k in #Check this !!!!!!! changing the -1 changes the outcome!!!!!
-                   range(num_frames)]  # Careful with the sign
-        normals = [normals[k] / np.linalg.norm(normals[k]) for k in range(num_frames)]
-        for k in range(num_frames):
-            signs = np.dot(aligned_planes[k]['Velocity'], normals[k])
-            aligned_planes[k]['Velocity'][np.where(signs < 0)] = 0.0
 
-    # interpolate velocity profile
-    vel_interp = []
-    # print('fitting...')
-    for k in range(num_frames):
-        nnVel = NearestNDInterpolator(aligned_planes[k].points, aligned_planes[k]['Velocity'])(fxdpts)
-        I = RBFInterpolator(fxdpts, nnVel,
-                            kernel=intp_options['kernel'], smoothing=intp_options['smoothing'],
-                            epsilon=1, degree=intp_options['degree'])
-
-        vel_interp.append(I(fxdpts))
+    def nearest_velocity(plane):
+        # Set boundary vectors to zero, the distance to the edge is measured on the aligned profile
+        dist2edge = profile_store.edge_distance(plane)
+        boundary = dist2edge < (dr * dist2edge.max())
+        plane['Velocity'][boundary, :] = 0.0
+
+        # Set backflow to zero (backflow against the flipped mean normal of the profile, see profile_store.backflow)
+        if intp_options['zero_backflow']:
+            plane['Velocity'][np.where(profile_store.backflow(plane))] = 0.0
+
+        # nearest source point of every target point, from a KD-tree (the same query as NearestNDInterpolator), and
+        # whether it lies in the zero boundary
+        nearest = cKDTree(plane.points).query(fxdpts)[1]
+        return plane['Velocity'][nearest], boundary[nearest]
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        nearest = list(pool.map(nearest_velocity, aligned_planes))
+
+    # interpolate velocity profile, the RBF system only depends on the target points so it is factorized once and
+    # solved for all frames at once, or a local RBF per point is used for the nearest neighbours (see rbf.py)
+    nnVel = np.stack([nearest[k][0] for k in range(num_frames)], axis=1)
+    if intp_options.get('neighbors'):
+        smoothed = rbf.smooth_local(fxdpts, nnVel, intp_options['neighbors'], kernel=intp_options['kernel'],
+                                    smoothing=intp_options['smoothing'], epsilon=1, degree=intp_options['degree'])
+    elif operator is not None and 'lu' in operator:
+        smoothed = rbf.smooth(operator, nnVel)
+    else:
+        smoothed = rbf.smooth(rbf.factorize(fxdpts, kernel=intp_options['kernel'], smoothing=intp_options['smoothing'],
+                                            epsilon=1, degree=intp_options['degree']), nnVel)
+    vel_interp = [smoothed[:, k] for k in range(num_frames)]
     
-    # hard no slip condition (double check)
+    # hard no slip condition (double check), target points of which the nearest source point lies in the zero boundary
     if intp_options['hard_noslip']:
         for k in range(num_frames):
-            vel_interp[k][boundary_ids, :] = 0
-
-    # create new polydatas
-    interp_planes = [pv.PolyData(fxdpts).delaunay_2d() for _ in range(num_frames)] #original alpha = 0.1, removed because it is not necessary and can cause issues
+            vel_interp[k][nearest[k][1], :] = 0
+
+    # create new polydatas, the triangulation is the same for every frame
+    if operator is not None and 'faces' in operator:
+        faces = operator['faces']
+    else:
+        faces = pv.PolyData(fxdpts).delaunay_2d().regular_faces #original alpha = 0.1, removed because it is not necessary and can cause issues
+    interp_planes = [pv.PolyData.from_regular_faces(fxdpts, faces) for _ in range(num_frames)]
     for k in range(num_frames):
         interp_planes[k]['Velocity'] = vel_interp[k]
 
@@ -5,8 +5,9 @@ from glob import glob
 import numpy as np
 import pyvista as pv
 import tetgen as tet
-import meshio
-import subprocess as sub
+import medit
+import mmg_runner
+import profiling
 
 def tetgen(combined_mesh, tetgen_parameters, plot=False):
     '''
@@ -21,39 +22,82 @@ def tetgen(combined_mesh, tetgen_parameters, plot=False):
     print('Start 3D-meshing')
 
     # create 3D tetmesh from surface mesh
-    tetmesh = tet.TetGen(combined_mesh)
-    tetmesh.tetrahedralize(**tetgen_parameters)
-    grid = tetmesh.grid
+    with profiling.stage('tetgen') as record:
+        tetmesh = tet.TetGen(combined_mesh)
+        tetmesh.tetrahedralize(**tetgen_parameters)
+        grid = tetmesh.grid
+        record['cells'] = grid.n_cells
+        record['points'] = grid.n_points
+
+    # Keep the boundary triangles and their references (identification.py). TetGen keeps the input points first, the
+    # triangles are only valid if it did not move or add points on the boundary
+    if 'ref' in combined_mesh.cell_data and np.array_equal(grid.points[:combined_mesh.n_points], combined_mesh.points):
+        grid.field_data['boundary_triangles'] = combined_mesh.regular_faces
+        grid.field_data['boundary_refs'] = combined_mesh.cell_data['ref']
     
     print('3D meshing succesfull')
     return grid
 
-def mmg3d(in_path, out_path, temp_path, parameters, plot=False):
+def single_pass_parameters(tetgen_parameters, sol_parameters):
     '''
-    Remeshes volume mesh using mmg3d, saves a .mesh and returns pyvista PolyData/UnstructuredGrid
-    :in_path : path to input file (.mesh)
-    :out_path : path to output file (.mesh)
-    :parameters : dict of mmg3d parameters
+    Parameters of the single-pass volume meshing (setting volume_meshing = 'single_pass'). TetGen only fills the closed
+    surface with a coarse quality mesh (the maximum volume is left out), which is the seed mesh of mmg3d, instead of a
+    dense mesh that is as fine as the boundary layer. mmg3d then builds the final mesh from the graded size map of
+    sizing.py (with the default gradation if the size map has none): it grows about linearly with the wall distance,
+    so the linear interpolation over the large elements of the seed follows it, where the step of the two-value size
+    map at bl_thickness needs the dense initial mesh.
+    :tetgen_parameters : parameters of the initial volume mesh (main_workflow)
+    :sol_parameters : parameters of the size map (mmg3d_sol_parameters)
+    :returns : dicts with the TetGen parameters and the size map parameters of the single pass
+    '''
+    import sizing
+
+    coarse = {key: value for key, value in tetgen_parameters.items() if key not in ('fixedvolume', 'maxvolume')}
+    if sol_parameters.get('gradation') is None:
+        sol_parameters = dict(sol_parameters, gradation=sizing.DEFAULTS['gradation'])
+    return coarse, sol_parameters
+
+def mmg3d(mesh, temp_path, parameters, sol_path=None, plot=False, limits=None):
+    '''
+    Remeshes volume mesh using mmg3d and returns pyvista UnstructuredGrid. The mesh is passed to mmg3d as
+    temp_path/initial_volume_mesh.meshb, the result is temp_path/mmg3d_mesh.meshb. Boundary triangles with references
+    (field data 'boundary_triangles' and 'boundary_refs', see tetgen) are passed along and read back from the result
+    :mesh : pyvista UnstructuredGrid of the tetrahedral mesh
+    :temp_path : path to directory used for temporary files
+    :parameters : dict of mmg3d parameters (hausd, detection angle and optionally hgrad, the gradation of mmg3d)
+    :sol_path : path to the size map (.solb/.sol, see write_sol), None to remesh without size map
     :plot : bool, show intermediate plots
+    :limits : dict with the timeout (s) and memory (MB) of mmg3d (see mmg_runner.py), None for no limits
     :returns : PyvistaUnstructuredGrid of the remeshed geo
     '''
     print('Start 3D mesh refinement')
 
+    in_path = osp.join(temp_path, r'initial_volume_mesh.meshb')
+    out_path = osp.join(temp_path, r'mmg3d_mesh.meshb')
+    mesh_medit = medit.from_pyvista(mesh)
+    if 'boundary_triangles' in mesh.field_data:
+        mesh_medit['triangles'] = mesh.field_data['boundary_triangles']
+        mesh_medit['refs']['triangles'] = mesh.field_data['boundary_refs']
+    medit.write_mesh(in_path, mesh_medit)
+
     hausd = parameters['hausd']
     angle = parameters['detection angle']
-    ind = ' '
+    limits = limits or {}
 
     # Run mmg
-    sub.run(f"{'py -m mmg3d -hausd'}{ind}{hausd}{ind}{'-ar'}{ind}{angle}{ind}{in_path}{ind}{out_path}")
-
-    # Convert back to .vtk
-    meshio.write(osp.join(temp_path, r'temp_for_plot_3d_remesh.vtk'), meshio.read(out_path))
-    remeshed = pv.read(osp.join(temp_path, r'temp_for_plot_3d_remesh.vtk'))
-
-    # Remove non-tetrahedal elements (mmg3d outputs detected edges as line segments alongside the generated mesh)
-    cell_types = remeshed.celltypes
-    mask = cell_types == 10 # vtk type indication for tets
-    remeshed = remeshed.extract_cells(mask)
+    with profiling.stage('mmg3d') as record:
+        options = ['-hausd', hausd, '-ar', angle] + (['-hgrad', parameters['hgrad']] if 'hgrad' in parameters else [])
+        record['mmg'] = mmg_runner.run('mmg3d', in_path, out_path, options, sol_path, **limits)
+
+        # Keep only the tetrahedra as cells (mmg3d outputs detected edges and boundary triangles alongside the generated
+        # mesh), the boundary triangles are kept as field data
+        result = medit.read_mesh(out_path)
+        remeshed = medit.to_pyvista(result, 'tetrahedra')
+        if 'triangles' in result:
+            remeshed.field_data['boundary_triangles'] = result['triangles']
+            remeshed.field_data['boundary_refs'] = result['refs']['triangles']
+        record['cells'] = remeshed.n_cells
+        record['points'] = remeshed.n_points
 
     # Plot with pyvista
     if plot==True:
@@ -65,15 +109,19 @@ def mmg3d(in_path, out_path, temp_path, parameters, plot=False):
 def write_sol(mesh, surf, parameters, dir, plot=False):
     '''
     Function that creates a .sol file for a mesh. This file can be used by mmg to specify local mesh density
-    paremeter. Outputs the input mesh with an added array 'sol' containing the data written to the .sol file
+    paremeter. Outputs the input mesh with an added array 'sol' containing the data written to the .sol file.
+    If parameters contains a 'gradation' the size map is graded with the wall distance (see sizing.py), otherwise
+    it has two values
     :mesh   : input mesh, must be Pyvista UnstructuredGrid volume mesh
     :surf   : wall of the geometry, can be any Pyvista surface
     :dist   : float, distance to surf that defines where the high density area ends
     :dlow   : far from wall density parameter for mmg
     :dhigh  : close to wall density parameter for mmg
-    :dir    : location to sace .sol
+    :dir    : location to save the .sol, binary if the extension is .solb
     plot    : show plots
     '''
+    import sizing
+
     print('start tagging')
 
     # Unpack parameters
@@ -81,15 +129,28 @@ def write_sol(mesh, surf, parameters, dir, plot=False):
     dlow = parameters['edgelength']
     dhigh = parameters['bl_edgelength']
 
-    # Get closest point to wall for each point in mesh & calculate distance
-    closest_points = surf.find_closest_cell(mesh.points, return_closest_point=True)[1]
-    d_exact = np.linalg.norm(mesh.points - closest_points, axis=1)
+    with profiling.stage('write_sol') as record:
+        # Apply the density parameters
+        if parameters.get('gradation') is not None:
+            # The graded size map grows with the wall distance everywhere, it uses the exact distance
+            density, info = sizing.size_field(mesh, surf, parameters)
+            record.update(info)
+            print('Graded size map, predicted elements:', int(info['predicted_elements']))
+        else:
+            # Distance to the wall for each point in mesh, only needs to be exact within the boundary layer (see distance_field.py)
+            d_exact = sizing.wall_distance(mesh.points, surf, cutoff=dist)
+            density = np.where(d_exact > dist, dlow, dhigh)
+        mesh["sol"] = density
+        length = len(density)
+
+        # Write .sol file
+        if dir.endswith('.solb'):
+            medit.write_sol(dir, density)
+        else:
+            header = 'MeshVersionFormatted \n2\n\nDimension 3\n\nSolAtVertices\n' + str(length) + '\n1 1\n'
+            np.savetxt(dir, density.reshape(-1,1), header=header, footer='End', comments='', fmt='%f')
+        record['points'] = length
 
-    # Apply the density parameters
-    density = np.where(d_exact > dist, dlow, dhigh)
-    mesh["sol"] = density
-    length = len(density)
-    
     # Plot results
     if plot:
         clipped = mesh.clip('z', crinkle=True)
@@ -100,8 +161,4 @@ def write_sol(mesh, surf, parameters, dir, plot=False):
         plotter.add_text('Initial 3D mesh with local tags')
         plotter.show()
 
-    # Write .mesh file
-    header = 'MeshVersionFormatted \n2\n\nDimension 3\n\nSolAtVertices\n' + str(length) + '\n1 1\n'
-    np.savetxt(dir, density.reshape(-1,1), header=header, footer='End', comments='', fmt='%f')
-
     return(mesh)
\ No newline at end of file